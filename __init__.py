@@ -51,6 +51,30 @@ __author__ = supybot.Author('Richard Esplin', 'resplin', 'richard-oss@esplin.sor
 __contributors__ = {supybot.authors.jemfinch}
 
 from . import config
+from . import writer
+reload(writer)
+from . import manifest
+reload(manifest)
+from . import search
+reload(search)
+from . import events
+reload(events)
+from . import compress
+reload(compress)
+from . import stats
+reload(stats)
+from . import maintenance
+reload(maintenance)
+from . import reader
+reload(reader)
+from . import tail
+reload(tail)
+from . import sweeper
+reload(sweeper)
+from . import activity
+reload(activity)
+from . import remote
+reload(remote)
 from . import plugin
 reload(plugin) # In case we're being reloaded.
 # Add more reloads here if you add third-party modules and want them to be
@@ -0,0 +1,163 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Per-channel activity statistics, counted as lines are logged.
+
+Each channel directory counts the lines and bytes of every nick, and the
+lines of each hour of the day, in UTC.  The counts are saved to a snapshot
+next to the manifest of the directory, activity.json, which is merged into
+the counts again when the bot restarts, and rendered into the index page.
+'''
+
+import json
+
+from array import array
+from io import open
+
+try:
+    from html import escape as html_escape
+except ImportError:
+    from xml.sax.saxutils import escape as html_escape
+
+class NickActivity(object):
+    __slots__ = ('lines', 'bytes')
+
+    def __init__(self, lines=0, size=0):
+        self.lines = lines
+        self.bytes = size
+
+class ChannelActivity(object):
+    ''' Activity counts of a channel directory.
+
+        At most maxNicks nicks are counted one by one.  Beyond that, the
+        least active half of them is folded into others, so the memory is
+        bounded however many nicks come and go, and the top talkers stay
+        counted.
+    '''
+    __slots__ = ('path', 'hours', 'nicks', 'others', 'maxNicks', 'dirty')
+    version = 1
+
+    def __init__(self, path, maxNicks):
+        self.path = path
+        # Lines of each hour of the day
+        self.hours = array('L', [0] * 24)
+        # nick -> NickActivity
+        self.nicks = {}
+        # Lines and bytes of the nicks folded away
+        self.others = NickActivity()
+        self.maxNicks = maxNicks
+        self.dirty = False
+
+    def add(self, nick, size, when):
+        activity = self.nicks.get(nick)
+        if activity is None:
+            if len(self.nicks) >= self.maxNicks:
+                self.compact()
+            activity = self.nicks[nick] = NickActivity()
+        activity.lines += 1
+        activity.bytes += size
+        self.hours[int(when // 3600 % 24)] += 1
+        self.dirty = True
+
+    def compact(self):
+        ''' Folds the least active half of the nicks into others. '''
+        nicks = sorted(self.nicks.items(), key=lambda item: item[1].lines)
+        for (nick, activity) in nicks[:len(nicks) - self.maxNicks // 2]:
+            self.others.lines += activity.lines
+            self.others.bytes += activity.bytes
+            del self.nicks[nick]
+
+    def totals(self):
+        return (sum(self.hours),
+                self.others.bytes + sum(activity.bytes
+                                        for activity in self.nicks.values()))
+
+    def top(self, count):
+        ''' Returns the count most active (nick, NickActivity). '''
+        return sorted(self.nicks.items(),
+                      key=lambda item: (-item[1].lines, item[0]))[:count]
+
+    def toJSON(self):
+        return {'version': self.version,
+                'hours': list(self.hours),
+                'nicks': dict((nick, [activity.lines, activity.bytes])
+                              for (nick, activity) in self.nicks.items()),
+                'others': [self.others.lines, self.others.bytes]}
+
+    def merge(self, data):
+        ''' Adds the counts of a snapshot to these. '''
+        if data.get('version') != self.version:
+            return
+        for (hour, lines) in enumerate(data['hours'][:24]):
+            self.hours[hour] += lines
+        for (nick, (lines, size)) in data['nicks'].items():
+            activity = self.nicks.get(nick)
+            if activity is None:
+                activity = self.nicks[nick] = NickActivity()
+            activity.lines += lines
+            activity.bytes += size
+        self.others.lines += data['others'][0]
+        self.others.bytes += data['others'][1]
+        if len(self.nicks) > self.maxNicks:
+            self.compact()
+
+def loadActivity(path):
+    ''' Returns the snapshot at path, or None if there is none. '''
+    try:
+        with open(path, encoding='utf-8') as snapshotFile:
+            return json.load(snapshotFile)
+    except (IOError, OSError, ValueError):
+        return None
+
+def renderActivity(data, topNicks):
+    ''' Returns the HTML section of the index showing the snapshot data, or
+        '' if there is nothing to show.
+    '''
+    if not data or data.get('version') != ChannelActivity.version:
+        return ''
+    activity = ChannelActivity(None, len(data['nicks']) + 1)
+    activity.merge(data)
+    (lines, size) = activity.totals()
+    if not lines:
+        return ''
+    html = ['<div class="style-activity">\n',
+            '<h3>Activity</h3>\n<p>%d lines, %d bytes</p>\n' % (lines, size),
+            '<table class="style-top">\n']
+    for (nick, counts) in activity.top(topNicks):
+        html.append('\t<tr><td>%s</td><td>%d</td><td>%d</td></tr>\n' %
+                    (html_escape(nick), counts.lines, counts.bytes))
+    html.append('</table>\n<table class="style-hours">\n<tr>')
+    peak = max(activity.hours)
+    for (hour, count) in enumerate(activity.hours):
+        html.append('<td title="%02d:00 UTC: %d lines">'
+                    '<div style="height: %dpx"></div>%02d</td>' %
+                    (hour, count, 50 * count // peak, hour))
+    html.append('</tr>\n</table>\n</div>\n')
+    return ''.join(html)
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,703 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Benchmark of HtmlLogger on generated traffic.
+
+Run it from the plugin directory with a Limnoria installation available:
+
+    python bench.py --messages 50000 --channels 20 --json results.json
+
+The traffic mixes PRIVMSG, NOTICE, JOIN, PART, QUIT, NICK and MODE
+messages from a pool of nicks, and messages of the bot itself, which reach
+the plugin through outFilter.  With --days, the clock of the plugin is
+moved forward so the traffic spans that many days, and logs are rotated at
+midnight with rotateLogs and deleteOldLogs.
+
+The throughput, the latency of single messages, the write syscalls and
+bytes written (from /proc/self/io, where available) and the peak RSS are
+printed, and stored with --json.  --compare prints the change from the
+results of an earlier run.
+
+Scheduled events, such as the commits of --durability, run between the
+messages as they would in the bot.
+
+With --bots, that many bots run the benchmark at once, each in a process of
+its own with its own traffic, and log the same channels to the same
+directory, like bots sharing a host.  With --daemon, they write through a
+writer daemon started for the run.  The throughput of all the bots together
+is printed, and the write syscalls include those of the daemon.
+
+The bot is configured in a temporary directory, so nothing outside of it is
+touched.
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import signal
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+default_mix = 'privmsg=80,notice=4,join=4,part=3,quit=3,nick=2,mode=2,echo=2'
+
+def setupBot(tempDir, logDir=None):
+    ''' Writes a minimal registry in tempDir and loads it, the same way
+        supybot-test does before importing conf.  The logs go to logDir if
+        it is given.
+    '''
+    for d in ('conf', 'data', 'logs'):
+        os.makedirs(os.path.join(tempDir, d))
+    registryFilename = os.path.join(tempDir, 'conf', 'bench.conf')
+    with open(registryFilename, 'w') as fd:
+        fd.write("""
+supybot.directories.backup: /dev/null
+supybot.directories.conf: %(dir)s/conf
+supybot.directories.data: %(dir)s/data
+supybot.directories.log: %(logDir)s
+supybot.log.stdout: False
+supybot.log.level: ERROR
+supybot.networks.bench.server: should.not.need.this
+supybot.nick: bench
+""" % {'dir': tempDir,
+       'logDir': logDir or os.path.join(tempDir, 'logs')})
+    import supybot.registry as registry
+    registry.open_registry(registryFilename)
+    import supybot.conf as conf
+    conf.supybot.flush.setValue(False)
+
+def loadPlugin():
+    ''' Imports this directory as the HtmlLogger package, whatever the
+        directory is called on disk.
+    '''
+    pluginDir = os.path.dirname(os.path.abspath(__file__))
+    spec = importlib.util.spec_from_file_location('HtmlLogger',
+            os.path.join(pluginDir, '__init__.py'),
+            submodule_search_locations=[pluginDir])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['HtmlLogger'] = module
+    spec.loader.exec_module(module)
+    return module
+
+class FakeClock(object):
+    ''' Stands for the time module in the plugin, with a time() that is
+        moved forward by the benchmark.
+    '''
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+def parseMix(mix):
+    weights = []
+    for item in mix.split(','):
+        (kind, weight) = item.split('=')
+        weights.append((kind.strip(), int(weight)))
+    return weights
+
+class Traffic(object):
+    ''' Generates messages, keeping track of who is in which channel so
+        parts, quits and nick changes are about users who are there.
+    '''
+    def __init__(self, options, botPrefix):
+        self.random = random.Random(options.seed)
+        self.options = options
+        self.botPrefix = botPrefix
+        self.channels = ['#chan%d' % i for i in range(options.channels)]
+        self.members = dict((channel, set()) for channel in self.channels)
+        self.away = set('nick%d' % i for i in range(options.nicks))
+        self.present = {}
+        self.text = 'x' * options.size
+        self.generation = 0
+        kinds = parseMix(options.mix)
+        self.kinds = [kind for (kind, weight) in kinds]
+        self.cumWeights = []
+        total = 0
+        for (kind, weight) in kinds:
+            total += weight
+            self.cumWeights.append(total)
+
+    def prefix(self, nick):
+        return '%s!user@%s.example.org' % (nick, nick)
+
+    def setup(self):
+        ''' Returns the messages of the bot joining every channel, with the
+            NAMES replies of the nicks already there.
+        '''
+        import supybot.ircmsgs as ircmsgs
+        nick = self.botPrefix.split('!')[0]
+        for name in sorted(self.away):
+            for channel in self.random.sample(self.channels,
+                                              min(3, len(self.channels))):
+                self.enter(name, channel)
+        msgs = []
+        for channel in self.channels:
+            msgs.append(ircmsgs.join(channel, prefix=self.botPrefix))
+            names = sorted(self.members[channel])
+            for i in range(0, len(names), 50):
+                msgs.append(ircmsgs.IrcMsg(prefix='server', command='353',
+                            args=(nick, '=', channel,
+                                  ' '.join(names[i:i+50]))))
+            msgs.append(ircmsgs.IrcMsg(prefix='server', command='366',
+                        args=(nick, channel, 'End of /NAMES list.')))
+        return msgs
+
+    def enter(self, nick, channel):
+        self.members[channel].add(nick)
+        self.present.setdefault(nick, set()).add(channel)
+        self.away.discard(nick)
+
+    def leave(self, nick, channel):
+        self.members[channel].discard(nick)
+        channels = self.present[nick]
+        channels.discard(channel)
+        if not channels:
+            del self.present[nick]
+            self.away.add(nick)
+
+    def member(self, channel):
+        members = self.members[channel]
+        if not members:
+            return None
+        return self.random.choice(sorted(members))
+
+    def next(self):
+        ''' Returns (kind, message).  Messages of kind echo are sent by the
+            bot, and go through outFilter.
+        '''
+        import supybot.ircmsgs as ircmsgs
+        pick = self.random.randint(1, self.cumWeights[-1])
+        for (kind, cumWeight) in zip(self.kinds, self.cumWeights):
+            if pick <= cumWeight:
+                break
+        channel = self.random.choice(self.channels)
+        nick = self.member(channel)
+        if kind == 'join' or nick is None:
+            if not self.away:
+                kind = 'privmsg'
+            else:
+                nick = self.random.choice(sorted(self.away))
+                self.enter(nick, channel)
+                return ('join', ircmsgs.join(channel,
+                                             prefix=self.prefix(nick)))
+        if kind == 'privmsg':
+            targets = ','.join(self.random.sample(self.channels,
+                               min(self.options.targets,
+                                   len(self.channels))))
+            return (kind, ircmsgs.privmsg(targets, self.text,
+                                          prefix=self.prefix(nick)))
+        if kind == 'notice':
+            return (kind, ircmsgs.notice(channel, self.text,
+                                         prefix=self.prefix(nick)))
+        if kind == 'part':
+            self.leave(nick, channel)
+            return (kind, ircmsgs.part(channel, 'bye',
+                                       prefix=self.prefix(nick)))
+        if kind == 'quit':
+            for c in list(self.present[nick]):
+                self.leave(nick, c)
+            return (kind, ircmsgs.quit('Quit: bye', prefix=self.prefix(nick)))
+        if kind == 'nick':
+            self.generation += 1
+            newNick = '%s_%d' % (nick.split('_')[0], self.generation)
+            for c in list(self.present[nick]):
+                self.leave(nick, c)
+                self.enter(newNick, c)
+            self.away.discard(nick)
+            return (kind, ircmsgs.nick(newNick, prefix=self.prefix(nick)))
+        if kind == 'mode':
+            return (kind, ircmsgs.IrcMsg(prefix=self.prefix(nick),
+                                         command='MODE',
+                                         args=(channel, '+v', nick)))
+        if kind == 'echo':
+            return (kind, ircmsgs.privmsg(channel, self.text))
+        raise ValueError('Unknown message kind: %s' % kind)
+
+def readIo(pid='self'):
+    ''' Returns (write syscalls, bytes written) of the process pid so far, or
+        None where /proc/<pid>/io is not available.
+    '''
+    try:
+        with open('/proc/%s/io' % pid) as ioFile:
+            fields = dict(line.split(': ') for line in ioFile.read().split('\n')
+                          if line)
+        return (int(fields['syscw']), int(fields['wchar']))
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+def peakRss():
+    ''' Returns the peak RSS of this process in KiB, or None. '''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return 0
+    index = min(len(sortedValues) - 1, int(len(sortedValues) * fraction))
+    return sortedValues[index]
+
+def logFiles(path):
+    return [os.path.join(directory, f)
+            for (directory, dirs, files) in os.walk(path)
+            for f in files if f.startswith('log_')]
+
+def revision():
+    try:
+        return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(options, tempDir):
+    import supybot.conf as conf
+    import supybot.irclib as irclib
+    import supybot.schedule as schedule
+    module = loadPlugin()
+    irc = irclib.Irc('bench')
+    while irc.takeMsg():
+        pass
+    config = conf.supybot.plugins.HtmlLogger
+    config.asyncWrites.setValue(options.asyncWrites)
+    config.asyncMaintenance.setValue(options.asyncMaintenance)
+    config.maxOpenLogs.setValue(options.maxOpenLogs)
+    config.stats.setValue(options.stats)
+    config.rotateLogs.setValue(options.days > 0)
+    config.deleteOldLogs.setValue(options.keepLogs)
+    config.pageBytes.setValue(options.pageBytes)
+    config.shardIndex.setValue(options.shardIndex)
+    config.flushImmediately.setValue(options.flushImmediately)
+    config.durability.setValue(options.durability)
+    config.durability.interval.setValue(options.commitInterval)
+    config.durability.bytes.setValue(options.commitBytes)
+    if options.writerDaemon:
+        config.writerDaemon.setValue(options.writerDaemon)
+    # Start just before a midnight, so even a short run rotates.
+    start = time.time()
+    start = start - start % 86400 + 86400 - 1
+    clock = FakeClock(start)
+    module.plugin.time = clock
+    plugin = module.Class(irc)
+    traffic = Traffic(options, irc.prefix)
+    for msg in traffic.setup():
+        plugin(irc, msg)
+    for channel in traffic.channels:
+        # Logs of earlier days, for the rotations to clean up and index.
+        logDir = plugin.getLogDir(irc, channel)
+        for day in range(1, options.oldLogs + 1):
+            name = plugin.getLogName(irc, channel, start - 86400 * day)
+            with open(os.path.join(logDir, name), 'w') as logFile:
+                logFile.write('<p>old</p>\n')
+    msgs = [traffic.next() for i in range(options.messages)]
+    if options.days:
+        step = options.days * 86400.0 / options.messages
+    else:
+        step = 0
+    latencies = []
+    counts = {}
+    timer = getattr(time, 'perf_counter', time.time)
+    if options.startAt:
+        # The other bots start at the same time.
+        time.sleep(max(0, options.startAt - time.time()))
+    startedAt = time.time()
+    ioBefore = readIo()
+    started = timer()
+    for (kind, msg) in msgs:
+        clock.now += step
+        before = timer()
+        if kind == 'echo':
+            plugin.outFilter(irc, msg)
+        else:
+            plugin(irc, msg)
+        latencies.append(timer() - before)
+        counts[kind] = counts.get(kind, 0) + 1
+        schedule.run()
+    plugin.flush()
+    if options.stats and not options.worker:
+        print(plugin.statsSummary())
+    plugin.die()
+    elapsed = timer() - started
+    endedAt = time.time()
+    ioAfter = readIo()
+    latencies.sort()
+    logRoot = options.logDir or os.path.join(tempDir, 'logs')
+    results = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'options': dict((name, value)
+                        for (name, value) in vars(options).items()
+                        if name not in ('json', 'compare')),
+        'messages': counts,
+        'elapsed': elapsed,
+        'startedAt': startedAt,
+        'endedAt': endedAt,
+        'msgsPerSec': options.messages / elapsed,
+        # Time the bot thread spent on the messages, without the background
+        # threads catching up at the end.
+        'busy': sum(latencies),
+        'latencyUs': {
+            'p50': percentile(latencies, 0.5) * 1e6,
+            'p99': percentile(latencies, 0.99) * 1e6,
+            'max': latencies[-1] * 1e6 if latencies else 0,
+        },
+        'logFiles': len(logFiles(logRoot)),
+        'logBytes': sum(map(os.path.getsize, logFiles(logRoot))),
+        'peakRssKb': peakRss(),
+    }
+    if ioBefore is not None and ioAfter is not None:
+        results['writeSyscalls'] = ioAfter[0] - ioBefore[0]
+        results['bytesWritten'] = ioAfter[1] - ioBefore[1]
+    return results
+
+def workerArgs(args):
+    ''' Returns the command line arguments of the benchmark without those
+        that only concern the parent of the bots.
+    '''
+    dropped = ('--bots', '--daemon', '--json', '--compare')
+    withValue = ('--bots', '--json', '--compare')
+    kept = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in withValue:
+            skip = True
+        elif arg.split('=')[0] not in dropped:
+            kept.append(arg)
+    return kept
+
+def brokenLogs(logRoot, footer):
+    ''' Returns how many logs have a footer elsewhere than at their end, or
+        more than one header, from bots writing them at the same time.
+    '''
+    broken = 0
+    for path in logFiles(logRoot):
+        with open(path, 'rb') as logFile:
+            contents = logFile.read()
+        if contents.count(b'<h2>') > 1 or \
+                contents.count(footer) > contents.endswith(footer):
+            broken += 1
+    return broken
+
+def runBots(options, tempDir):
+    ''' Runs options.bots benchmarks at once, logging to the same directory,
+        and returns the results of all of them together.
+    '''
+    script = os.path.abspath(__file__)
+    logRoot = os.path.join(tempDir, 'logs')
+    os.makedirs(logRoot)
+    args = workerArgs(sys.argv[1:]) + ['--log-dir', logRoot]
+    daemon = None
+    if options.daemon:
+        socketPath = os.path.join(tempDir, 'writer.sock')
+        daemon = subprocess.Popen([sys.executable, script, '--serve',
+                                   socketPath, '--log-dir', logRoot],
+                                  stdout=subprocess.PIPE)
+        # It prints a line once it listens.
+        daemon.stdout.readline()
+        args += ['--writer-daemon', socketPath]
+    # Enough for every bot to load the plugin before.
+    startAt = time.time() + 2 + 0.5 * options.bots
+    workers = []
+    for i in range(options.bots):
+        resultPath = os.path.join(tempDir, 'bot%d.json' % i)
+        workers.append((resultPath, subprocess.Popen(
+                [sys.executable, script] + args +
+                ['--seed', str(options.seed + i), '--start-at', repr(startAt),
+                 '--worker', resultPath])))
+    bots = []
+    for (resultPath, worker) in workers:
+        if worker.wait():
+            raise RuntimeError('A bot failed with status %s.' %
+                               worker.returncode)
+        with open(resultPath) as resultFile:
+            bots.append(json.load(resultFile))
+    daemonIo = None
+    if daemon is not None:
+        daemonIo = readIo(daemon.pid)
+        daemon.send_signal(signal.SIGINT)
+        daemon.wait()
+    elapsed = max(bot['endedAt'] for bot in bots) - \
+              min(bot['startedAt'] for bot in bots)
+    messages = options.messages * options.bots
+    pluginDir = os.path.dirname(script)
+    with open(os.path.join(pluginDir, 'footer.html'), 'rb') as footerFile:
+        footer = footerFile.read()
+    results = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'options': dict((name, value)
+                        for (name, value) in vars(options).items()
+                        if name not in ('json', 'compare')),
+        'messages': messages,
+        'elapsed': elapsed,
+        'msgsPerSec': messages / elapsed,
+        'busy': sum(bot['busy'] for bot in bots),
+        # The worst bot.
+        'latencyUs': dict((name, max(bot['latencyUs'][name] for bot in bots))
+                          for name in ('p50', 'p99', 'max')),
+        'logFiles': len(logFiles(logRoot)),
+        'logBytes': sum(map(os.path.getsize, logFiles(logRoot))),
+        'brokenLogs': brokenLogs(logRoot, footer),
+        'peakRssKb': sum(bot['peakRssKb'] or 0 for bot in bots),
+        'botMsgsPerSec': [bot['msgsPerSec'] for bot in bots],
+    }
+    if all('writeSyscalls' in bot for bot in bots):
+        results['writeSyscalls'] = sum(bot['writeSyscalls'] for bot in bots)
+        results['bytesWritten'] = sum(bot['bytesWritten'] for bot in bots)
+        if daemonIo is not None:
+            results['daemonWriteSyscalls'] = daemonIo[0]
+            results['writeSyscalls'] += daemonIo[0]
+            results['bytesWritten'] += daemonIo[1]
+    return results
+
+def serve(options, tempDir):
+    ''' Runs the writer daemon of the bots, until it is interrupted. '''
+    setupBot(tempDir, options.logDir)
+    loadPlugin()
+    importlib.import_module('HtmlLogger.daemon').main([options.serve,
+                                                  options.logDir])
+
+# Results compared by --compare, and whether more is better.
+compared = (('msgsPerSec', True), ('busy', False), ('latencyUs.p50', False),
+            ('latencyUs.p99', False), ('writeSyscalls', False),
+            ('bytesWritten', False), ('peakRssKb', False))
+
+def getField(results, name):
+    for key in name.split('.'):
+        if not isinstance(results, dict):
+            return None
+        results = results.get(key)
+    return results
+
+def report(results, out=sys.stdout):
+    options = results['options']
+    out.write('%d messages on %d channels in %.2f s: %.0f msgs/sec\n' %
+              (options['messages'] * options.get('bots', 1),
+               options['channels'], results['elapsed'],
+               results['msgsPerSec']))
+    if 'botMsgsPerSec' in results:
+        out.write('%d bots%s: %s msgs/sec each, %d broken logs\n' %
+                  (options['bots'],
+                   ' through the writer daemon' if options['daemon'] else '',
+                   ', '.join('%.0f' % rate
+                             for rate in results['botMsgsPerSec']),
+                   results['brokenLogs']))
+    out.write('latency: p50 %.1f us, p99 %.1f us, max %.1f us, '
+              'busy %.2f s\n' %
+              (results['latencyUs']['p50'], results['latencyUs']['p99'],
+               results['latencyUs']['max'], results.get('busy', 0)))
+    if 'writeSyscalls' in results:
+        out.write('writes: %d syscalls, %d bytes\n' %
+                  (results['writeSyscalls'], results['bytesWritten']))
+    if 'daemonWriteSyscalls' in results:
+        out.write('writes of the daemon: %d syscalls\n' %
+                  results['daemonWriteSyscalls'])
+    out.write('logs: %d files, %d bytes, peak RSS: %s KiB\n' %
+              (results['logFiles'], results['logBytes'],
+               results['peakRssKb']))
+
+def compare(old, new, out=sys.stdout):
+    out.write('compared to %s:\n' % (old.get('revision') or 'the old run'))
+    for (name, higherIsBetter) in compared:
+        (before, after) = (getField(old, name), getField(new, name))
+        if not before or after is None:
+            continue
+        change = (after - before) * 100.0 / before
+        better = (change > 0) == higherIsBetter
+        out.write('  %-14s %12.1f -> %12.1f  %+6.1f%%%s\n' %
+                  (name, before, after, change,
+                   '' if abs(change) < 5 else
+                   (' better' if better else ' WORSE')))
+
+# (name, message) rendered by --render.
+render_inputs = (
+    ('chat', 'so I tried that yesterday and it works, thanks a lot!'),
+    ('url', 'see https://example.org/wiki/Foo_(bar)?a=1&b=2 for details'),
+    ('formatting', '\x02bold\x02 \x0304,01red\x03 \x1funder\x1f ok'),
+    ('paste', 'def f(x): return x < 10 and x > 0 & "y" ' * 10),
+    ('spaces', 'a ' * 2000),
+    ('blank', ' ' * 4000),
+    ('schemes', 'http:// ' * 500),
+    ('escapes', '&<>"' * 500),
+    ('colors', '\x03' * 1000),
+)
+
+def benchRender(module, out=sys.stdout):
+    ''' Times the message rendering against the chain it replaced. '''
+    import timeit
+    import supybot.ircutils as ircutils
+    plugin = module.plugin
+    # The linkify of the plugin before renderMessage.
+    url_regex = re.compile(r'(\s*)([fhtps]{3,5}://\S+)(\s*)')
+    def chain(s):
+        return url_regex.sub(r'\1<a href="\2">\2</a>\3',
+                             plugin.html_escape(ircutils.stripFormatting(s)))
+    out.write('%-12s %12s %12s\n' % ('input', 'chain (us)', 'render (us)'))
+    for (name, s) in render_inputs:
+        times = []
+        for f in (chain, lambda s: plugin.renderMessage(s, True)):
+            # About a tenth of a second per repeat, however slow f is.
+            once = timeit.timeit(lambda: f(s), number=1)
+            number = max(1, int(0.1 / max(once, 1e-7)))
+            times.append(min(timeit.repeat(lambda: f(s), number=number,
+                                           repeat=3)) / number * 1e6)
+        out.write('%-12s %12.2f %12.2f\n' % (name, times[0], times[1]))
+
+def parseOptions(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark HtmlLogger.')
+    parser.add_argument('--messages', type=int, default=20000,
+                        help='number of messages to log')
+    parser.add_argument('--channels', type=int, default=10,
+                        help='number of channels the messages are spread on')
+    parser.add_argument('--nicks', type=int, default=200,
+                        help='number of nicks talking')
+    parser.add_argument('--size', type=int, default=80,
+                        help='length of each message')
+    parser.add_argument('--targets', type=int, default=1,
+                        help='number of channels each PRIVMSG is sent to')
+    parser.add_argument('--mix', default=default_mix,
+                        help='weights of the kinds of messages (default: '
+                             '%(default)s)')
+    parser.add_argument('--days', type=int, default=0,
+                        help='number of days the traffic spans, with '
+                             'rotateLogs enabled')
+    parser.add_argument('--old-logs', dest='oldLogs', type=int, default=0,
+                        help='number of logs of earlier days each channel '
+                             'starts with')
+    parser.add_argument('--keep-logs', dest='keepLogs', type=int, default=0,
+                        help='supybot.plugins.HtmlLogger.deleteOldLogs')
+    parser.add_argument('--async-writes', dest='asyncWrites',
+                        action='store_true',
+                        help='enable supybot.plugins.HtmlLogger.asyncWrites')
+    parser.add_argument('--sync-maintenance', dest='asyncMaintenance',
+                        action='store_false',
+                        help='disable supybot.plugins.HtmlLogger.'
+                             'asyncMaintenance')
+    parser.add_argument('--max-open-logs', dest='maxOpenLogs', type=int,
+                        default=0,
+                        help='supybot.plugins.HtmlLogger.maxOpenLogs')
+    parser.add_argument('--page-bytes', dest='pageBytes', type=int, default=0,
+                        help='supybot.plugins.HtmlLogger.pageBytes')
+    parser.add_argument('--flat-index', dest='shardIndex',
+                        action='store_false',
+                        help='disable supybot.plugins.HtmlLogger.shardIndex')
+    parser.add_argument('--flush-immediately', dest='flushImmediately',
+                        action='store_true',
+                        help='enable supybot.plugins.HtmlLogger.'
+                             'flushImmediately')
+    parser.add_argument('--durability', default='none',
+                        choices=('none', 'flush', 'fsync'),
+                        help='supybot.plugins.HtmlLogger.durability')
+    parser.add_argument('--commit-interval', dest='commitInterval',
+                        type=float, default=1.0,
+                        help='supybot.plugins.HtmlLogger.durability.interval')
+    parser.add_argument('--commit-bytes', dest='commitBytes', type=int,
+                        default=0,
+                        help='supybot.plugins.HtmlLogger.durability.bytes')
+    parser.add_argument('--no-stats', dest='stats', action='store_false',
+                        help='disable supybot.plugins.HtmlLogger.stats')
+    parser.add_argument('--bots', type=int, default=1,
+                        help='number of bots logging the same channels at '
+                             'once, each in a process of its own')
+    parser.add_argument('--daemon', action='store_true',
+                        help='have the bots write through a writer daemon, '
+                             'like supybot.plugins.HtmlLogger.writerDaemon')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the traffic generator')
+    parser.add_argument('--render', action='store_true',
+                        help='only time the rendering of messages')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the results to FILE')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with the results stored in FILE')
+    # Used by --bots and --daemon to run the bots and the daemon.
+    parser.add_argument('--log-dir', dest='logDir', help=argparse.SUPPRESS)
+    parser.add_argument('--writer-daemon', dest='writerDaemon',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', dest='startAt', type=float,
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--worker', metavar='FILE', help=argparse.SUPPRESS)
+    parser.add_argument('--serve', metavar='SOCKET', help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+def main():
+    options = parseOptions()
+    tempDir = tempfile.mkdtemp(prefix='htmllogger-bench-')
+    try:
+        if options.serve:
+            serve(options, tempDir)
+            return
+        if options.bots > 1 or options.daemon:
+            results = runBots(options, tempDir)
+        else:
+            setupBot(tempDir, options.logDir)
+            if options.render:
+                benchRender(loadPlugin())
+                return
+            results = run(options, tempDir)
+    finally:
+        shutil.rmtree(tempDir)
+    if options.worker:
+        with open(options.worker, 'w') as resultFile:
+            json.dump(results, resultFile)
+        return
+    report(results)
+    if options.compare:
+        with open(options.compare) as oldFile:
+            compare(json.load(oldFile), results)
+    if options.json:
+        with open(options.json, 'w') as jsonFile:
+            json.dump(results, jsonFile, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,213 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Background compression of rotated logs.
+'''
+
+import os
+import gzip
+import time
+import heapq
+import shutil
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import supybot.log as log
+
+compressed_suffix = '.gz'
+# zlib level: most of the gain of level 9 for a fraction of the CPU.
+compress_level = 6
+# Size of the pieces a log is compressed in.  zlib releases the GIL while it
+# compresses a piece, so the bot thread is not held up.
+chunk_size = 65536
+
+def compressFile(path, gzPath, level):
+    ''' Writes the gzip of path to gzPath, through a temporary file, with the
+        modification time of path.
+    '''
+    tmpPath = gzPath + '.tmp'
+    mtime = os.stat(path).st_mtime
+    with open(path, 'rb') as source:
+        with open(tmpPath, 'wb') as rawTarget:
+            with gzip.GzipFile(os.path.basename(path), 'wb', level,
+                               rawTarget, mtime) as target:
+                shutil.copyfileobj(source, target, chunk_size)
+    os.utime(tmpPath, (mtime, mtime))
+    if hasattr(os, 'replace'):
+        os.replace(tmpPath, gzPath)
+    else:
+        os.rename(tmpPath, gzPath)
+
+def decompressFile(gzPath, path):
+    with gzip.open(gzPath, 'rb') as source:
+        with open(path, 'wb') as target:
+            shutil.copyfileobj(source, target, chunk_size)
+
+class Compressor(object):
+    ''' Compresses logs to <log>.gz with a bounded number of threads.
+
+        The original is removed keepOriginal seconds after it was last
+        modified.  Every change to a log directory is reported by calling
+        done(logDir, added, removed) from the compressing thread, with the
+        names of the added and removed files.
+    '''
+    def __init__(self, maxConcurrency, done, level=compress_level):
+        self.level = level
+        self.done = done
+        self.queue = queue.Queue()
+        self.lock = threading.Condition()
+        # path -> (logDir, name, keepOriginal) of the logs waiting
+        self.pending = {}
+        self.active = set()
+        # (time, path, logDir, name) of the originals to remove
+        self.removals = []
+        self.compressed = 0
+        self.removed = 0
+        self.errors = 0
+        self.threads = []
+        for i in range(maxConcurrency):
+            thread = threading.Thread(target=self.run,
+                                      name='HtmlLogger compressor %s' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def compress(self, logDir, name, keepOriginal):
+        path = os.path.join(logDir, name)
+        with self.lock:
+            if path in self.pending:
+                return
+            self.pending[path] = (logDir, name, keepOriginal)
+        self.queue.put(path)
+
+    def cancel(self, path):
+        ''' Forgets about path, which is about to be written again.  Waits
+            for it if it is being compressed right now.
+        '''
+        with self.lock:
+            self.pending.pop(path, None)
+            self.removals = [removal for removal in self.removals
+                             if removal[1] != path]
+            heapq.heapify(self.removals)
+            while path in self.active:
+                self.lock.wait()
+
+    def sync(self):
+        ''' Waits until every log queued so far is compressed. '''
+        self.queue.join()
+
+    def stop(self):
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def run(self):
+        while True:
+            timeout = None
+            with self.lock:
+                if self.removals:
+                    timeout = max(0, self.removals[0][0] - time.time())
+            try:
+                path = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self.removeOriginals()
+                continue
+            try:
+                if path is None:
+                    return
+                with self.lock:
+                    job = self.pending.pop(path, None)
+                    if job is None:
+                        continue
+                    self.active.add(path)
+                try:
+                    self.process(path, *job)
+                finally:
+                    with self.lock:
+                        self.active.discard(path)
+                        self.lock.notify_all()
+            finally:
+                self.queue.task_done()
+
+    def process(self, path, logDir, name, keepOriginal):
+        gzPath = path + compressed_suffix
+        try:
+            mtime = os.stat(path).st_mtime
+            if not (os.path.exists(gzPath) and
+                    int(os.stat(gzPath).st_mtime) == int(mtime)):
+                compressFile(path, gzPath, self.level)
+                self.compressed += 1
+                self.done(logDir, [name + compressed_suffix], [])
+            if not os.path.exists(path):
+                # Deleted while it was being compressed.
+                os.remove(gzPath)
+                self.done(logDir, [], [name + compressed_suffix])
+                return
+        except (IOError, OSError):
+            self.errors += 1
+            log.exception('HtmlLogger could not compress %s:', path)
+            return
+        removeAt = mtime + keepOriginal
+        if removeAt <= time.time():
+            self.removeOriginal(path, logDir, name)
+        else:
+            with self.lock:
+                heapq.heappush(self.removals, (removeAt, path, logDir, name))
+
+    def removeOriginals(self):
+        now = time.time()
+        while True:
+            with self.lock:
+                if not self.removals or self.removals[0][0] > now:
+                    return
+                (removeAt, path, logDir, name) = heapq.heappop(self.removals)
+                self.active.add(path)
+            try:
+                self.removeOriginal(path, logDir, name)
+            finally:
+                with self.lock:
+                    self.active.discard(path)
+                    self.lock.notify_all()
+
+    def removeOriginal(self, path, logDir, name):
+        try:
+            os.remove(path)
+        except OSError:
+            if os.path.exists(path):
+                self.errors += 1
+                log.exception('HtmlLogger could not remove %s:', path)
+                return
+        self.removed += 1
+        self.done(logDir, [], [name])
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -52,7 +52,8 @@ conf.registerChannelValue(HtmlLogger, 'enable',
 conf.registerGlobalValue(HtmlLogger, 'flushImmediately',
     registry.Boolean(False, _("""Determines whether channel logfiles will be
     flushed anytime they're written to, rather than being buffered by the
-    operating system.""")))
+    operating system.  durability flushes them in groups instead, which costs
+    a lot less when many lines are logged.""")))
 conf.registerChannelValue(HtmlLogger, 'showJoinParts',
     registry.Boolean(True, _("""Determines wether joins and parts are logged""")))
 conf.registerChannelValue(HtmlLogger, 'stripFormatting',
@@ -72,7 +73,32 @@ conf.registerChannelValue(HtmlLogger, 'rotateLogs',
     the 'filenameTimestamp' configuration variable.""")))
 conf.registerChannelValue(HtmlLogger, 'deleteOldLogs',
     registry.NonNegativeInteger(0, _("""Determines how many logs for this channel
-    should be kept. If the value is zero, all logs will be kept.""")))
+    should be kept. If the value is zero, all logs will be kept.  Old logs
+    are deleted by the sweeps of deleteOldLogs.sweepInterval, or when a log
+    is started if it is zero.""")))
+conf.registerChannelValue(HtmlLogger.deleteOldLogs, 'maxDays',
+    registry.NonNegativeInteger(0, _("""Determines how many days the logs of
+    this channel are kept after they were last written.  If the value is
+    zero, logs are not deleted by age.  Needs sweepInterval.""")))
+conf.registerChannelValue(HtmlLogger.deleteOldLogs, 'maxBytes',
+    registry.NonNegativeInteger(0, _("""Determines how many bytes the logs of
+    this channel can take; the oldest logs beyond that are deleted.  If the
+    value is zero, there is no limit.  Needs sweepInterval.""")))
+conf.registerGlobalValue(HtmlLogger.deleteOldLogs, 'maxNetworkBytes',
+    registry.NonNegativeInteger(0, _("""Determines how many bytes the logs of
+    the channels of a network can take, or of all channels if
+    networkDirectory is False; the oldest logs beyond that are deleted.  If
+    the value is zero, there is no limit.  Needs sweepInterval.""")))
+conf.registerGlobalValue(HtmlLogger.deleteOldLogs, 'sweepInterval',
+    registry.NonNegativeInteger(0, _("""Determines how many seconds there are
+    between two sweeps of the log directories by a background thread, which
+    deletes the logs beyond the deleteOldLogs limits and updates the index
+    pages of the directories it changed; 3600 sweeps hourly.  If the value
+    is zero, there are no sweeps, and only deleteOldLogs applies, when a log
+    is started.""")))
+conf.registerGlobalValue(HtmlLogger.deleteOldLogs, 'unlinkRate',
+    registry.PositiveInteger(50, _("""Determines how many files a sweep
+    deletes per second at most.""")))
 conf.registerChannelValue(HtmlLogger, 'filenameTimestamp',
     registry.String('%Y-%m-%d', _("""Determines how to represent the timestamp
     used for the filename in rotated logs.  When this timestamp changes, the
@@ -103,5 +129,186 @@ conf.registerGlobalValue(HtmlLogger, 'indexFooterFile',
     index page for the log files. If none is specified, the default footer included with
     the plugin will be used.""")))
 
+conf.registerChannelValue(HtmlLogger, 'coalesceJoinParts',
+    registry.Boolean(False, _("""Determines whether bursts of joins, parts
+    and quits, such as netsplits and mass rejoins, are logged as a single
+    summary row listing the nicks, instead of a row per nick.  Single joins,
+    parts and quits are still logged right away.""")))
+conf.registerGlobalValue(HtmlLogger.coalesceJoinParts, 'window',
+    registry.PositiveFloat(5.0, _("""Determines how many seconds a burst is
+    collected before its summary is logged.""")))
+conf.registerGlobalValue(HtmlLogger.coalesceJoinParts, 'threshold',
+    registry.PositiveInteger(3, _("""Determines how many joins, parts and
+    quits in a channel within the window make a burst.  A quit with a
+    netsplit reason always starts one.""")))
+conf.registerGlobalValue(HtmlLogger.coalesceJoinParts, 'maxNicks',
+    registry.PositiveInteger(1000, _("""Determines how many nicks a summary
+    lists at most.  A burst reaching this size is logged right away.""")))
+
+conf.registerGlobalValue(HtmlLogger, 'stats',
+    registry.Boolean(False, _("""Determines whether the plugin counts the
+    lines and bytes it logs and the errors it meets, and times its work on
+    the logs, for the logstats command.""")))
+conf.registerGlobalValue(HtmlLogger.stats, 'prometheusInterval',
+    registry.NonNegativeInteger(0, _("""Determines how often, in seconds,
+    the statistics are written to htmllogger.prom in the plugin's log
+    directory, in the text format of the Prometheus node exporter's textfile
+    collector.  If the value is zero, they are not written.""")))
+
+conf.registerChannelValue(HtmlLogger, 'pageBytes',
+    registry.NonNegativeInteger(0, _("""Determines how many bytes a log of
+    this channel can hold before the rest of it goes to a new page.  Each page
+    ends with a link to the next one, and the index lists the pages of a log
+    next to it.  If the value is zero, logs are not split by size.""")))
+conf.registerChannelValue(HtmlLogger, 'pageLines',
+    registry.NonNegativeInteger(0, _("""Determines how many lines a log of
+    this channel can hold before the rest of it goes to a new page, like
+    pageBytes.  If the value is zero, logs are not split by lines.""")))
+conf.registerChannelValue(HtmlLogger, 'shardIndex',
+    registry.Boolean(False, _("""Determines whether the index of this channel
+    is split into a page per month and per year, so only the page of the
+    current month is rewritten when a log starts.  index.html then only
+    links to index-<year>.html, which lists the months of the year, each
+    linking to index-<year>-<month>.html, which lists the logs of the month.
+    This needs a year and a month in filenameTimestamp; otherwise index.html
+    lists every log, as it does when this is off.""")))
+
+conf.registerGlobalValue(HtmlLogger, 'maxOpenLogs',
+    registry.NonNegativeInteger(0, _("""Determines how many log files are
+    kept open at once.  Beyond that, the least recently written log is closed
+    without its footer, and reopened as it is when its channel is logged
+    again.  If the value is zero, there is no limit.""")))
+
+conf.registerChannelValue(HtmlLogger, 'searchIndex',
+    registry.Boolean(False, _("""Determines whether the lines logged in this
+    channel are added to a full-text index, for the searchlog command.""")))
+conf.registerGlobalValue(HtmlLogger.searchIndex, 'results',
+    registry.PositiveInteger(5, _("""Determines how many matches the searchlog
+    command returns.""")))
+
+conf.registerGlobalValue(HtmlLogger, 'readResults',
+    registry.PositiveInteger(10, _("""Determines how many lines the lastlog
+    and greplog commands return at most.""")))
+conf.registerGlobalValue(HtmlLogger, 'readTimeout',
+    registry.PositiveFloat(5.0, _("""Determines how many seconds the lastlog
+    and greplog commands read the logs before they reply with what they
+    found so far.""")))
+conf.registerGlobalValue(HtmlLogger, 'readThreads',
+    registry.PositiveInteger(4, _("""Determines how many logs the greplog
+    command reads at the same time.""")))
+
+conf.registerChannelValue(HtmlLogger, 'activityStats',
+    registry.Boolean(False, _("""Determines whether the lines and bytes of
+    each nick, and the lines of each hour of the day, are counted in this
+    channel, saved to the data directory and shown in its index page.""")))
+conf.registerGlobalValue(HtmlLogger.activityStats, 'maxNicks',
+    registry.PositiveInteger(1000, _("""Determines how many nicks are counted
+    one by one in a channel.  Beyond that, the least active half of them is
+    counted as a whole, so the memory used does not grow with the number of
+    nicks.""")))
+conf.registerGlobalValue(HtmlLogger.activityStats, 'topNicks',
+    registry.PositiveInteger(10, _("""Determines how many of the most active
+    nicks the index page shows.""")))
+conf.registerGlobalValue(HtmlLogger.activityStats, 'snapshotInterval',
+    registry.PositiveInteger(300, _("""Determines how many seconds there are
+    between two snapshots of the activity statistics to the data directory.
+    They are also saved when a new log starts, for its index page, and when
+    the plugin is unloaded.""")))
+
+conf.registerChannelValue(HtmlLogger, 'eventStore',
+    registry.Boolean(False, _("""Determines whether the lines logged in this
+    channel are also stored as structured events in the data directory, so
+    the HTML logs can be regenerated with rebuild.py after a change of
+    templates or styles.""")))
+
+conf.registerChannelValue(HtmlLogger, 'compressLogs',
+    registry.Boolean(False, _("""Determines whether the rotated logs of this
+    channel are compressed to .html.gz by a background thread.  The index
+    keeps linking to the .html names, so the web server has to serve the
+    compressed file in their place (with nginx, 'gzip_static always').""")))
+conf.registerGlobalValue(HtmlLogger.compressLogs, 'keepOriginal',
+    registry.NonNegativeInteger(0, _("""Determines how many seconds the
+    uncompressed log is kept after it was rotated.  If the value is zero, it
+    is removed as soon as it is compressed.""")))
+conf.registerGlobalValue(HtmlLogger.compressLogs, 'maxConcurrency',
+    registry.PositiveInteger(1, _("""Determines how many logs can be
+    compressed at the same time, and so how many threads compress them.""")))
+
+conf.registerGlobalValue(HtmlLogger, 'asyncMaintenance',
+    registry.Boolean(False, _("""Determines whether old logs are deleted and
+    index pages rewritten by background threads, so starting the logs of a
+    new day does not hold up the bot.  New logs are still created right
+    away, so no line waits for this work.""")))
+conf.registerGlobalValue(HtmlLogger.asyncMaintenance, 'threads',
+    registry.PositiveInteger(1, _("""Determines how many threads do the
+    background maintenance.  The work on one log directory is always done by
+    the same thread, in order.""")))
+
+class QueueFullPolicy(registry.OnlySomeStrings):
+    validStrings = ('block', 'drop')
+
+conf.registerGlobalValue(HtmlLogger, 'asyncWrites',
+    registry.Boolean(False, _("""Determines whether log lines are written by a
+    background thread, so a slow disk does not hold up the bot.  Lines are
+    queued, and written in batches.""")))
+conf.registerGlobalValue(HtmlLogger.asyncWrites, 'queueSize',
+    registry.PositiveInteger(10000, _("""Determines how many lines can wait in
+    the queue of the background writer.""")))
+conf.registerGlobalValue(HtmlLogger.asyncWrites, 'whenFull',
+    QueueFullPolicy('block', _("""Determines what happens to a line when the
+    queue of the background writer is full: 'block' waits for room, 'drop'
+    discards the line and counts it.""")))
+conf.registerGlobalValue(HtmlLogger.asyncWrites, 'flushInterval',
+    registry.PositiveFloat(1.0, _("""Determines how many seconds the background
+    writer keeps written lines in its buffers before flushing them.""")))
+conf.registerGlobalValue(HtmlLogger.asyncWrites, 'flushBytes',
+    registry.PositiveInteger(65536, _("""Determines how many bytes the
+    background writer writes to a log before flushing it, whatever the time
+    since the last flush.""")))
+
+conf.registerGlobalValue(HtmlLogger, 'writerDaemon',
+    registry.String('', _("""Determines the Unix socket of the writer daemon
+    that writes the logs of the bots sharing the log directory, started with
+    "python -m HtmlLogger.daemon <socket>".  Empty means the logs are written
+    by this bot.  While the daemon cannot be reached, the logs are written by
+    this bot, and asyncWrites and compressLogs are not used either way.""")))
+conf.registerGlobalValue(HtmlLogger.writerDaemon, 'flushInterval',
+    registry.PositiveFloat(0.5, _("""Determines how many seconds the lines
+    for the writer daemon are buffered at most before they are sent.""")))
+conf.registerGlobalValue(HtmlLogger.writerDaemon, 'retryInterval',
+    registry.PositiveInteger(30, _("""Determines how many seconds there are
+    between two attempts to reach the writer daemon, while it cannot be
+    reached.""")))
+
+class DurabilityPolicy(registry.OnlySomeStrings):
+    validStrings = ('none', 'flush', 'fsync')
+
+conf.registerGlobalValue(HtmlLogger, 'durability',
+    DurabilityPolicy('none', _("""Determines how the logs are committed to
+    disk.  'none' leaves it to the buffers and the periodic flush of the bot,
+    'flush' flushes the written logs every durability.interval seconds, so
+    they survive the bot being killed, and 'fsync' also fsyncs them, so they
+    survive the machine crashing.  Each commit ends the written logs with
+    their footer, which is taken off again before the next line, so a log
+    left by a crash is a complete HTML file.""")))
+conf.registerGlobalValue(HtmlLogger.durability, 'interval',
+    registry.PositiveFloat(1.0, _("""Determines how many seconds pass between
+    two commits of the logs.""")))
+conf.registerGlobalValue(HtmlLogger.durability, 'bytes',
+    registry.NonNegativeInteger(0, _("""Determines how many bytes can be logged
+    before the logs are committed, without waiting for durability.interval.
+    0 means only the interval is used.""")))
+conf.registerGlobalValue(HtmlLogger, 'liveTail',
+    registry.Boolean(False, _("""Determines whether the rows of the logs can be
+    fetched as they are logged from the bot's HTTP server, at
+    /htmllogger/<log directory>/<log name>?offset=<bytes>; see tail.py.  The
+    logs are then flushed every durability.interval seconds, even if
+    durability is 'none'.  Only the channels with liveTail.allowChannel are
+    served.""")))
+conf.registerChannelValue(HtmlLogger.liveTail, 'allowChannel',
+    registry.Boolean(False, _("""Determines whether the live tail of the bot's
+    HTTP server serves the logs of this channel, to anyone who can reach the
+    server.  Secret and private channels, and the channels the bot is not
+    in, are never served.""")))
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
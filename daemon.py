@@ -0,0 +1,392 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Shared writer of the logs of several bots running on one host.
+
+Run it as a module from the bot's plugin directory:
+
+    python -m HtmlLogger.daemon <socket> <log root> [--flush-interval 1.0]
+
+and set supybot.plugins.HtmlLogger.writerDaemon to <socket> in every bot.
+The daemon only writes and deletes files under <log root>, the log
+directory of the bots or one above it, and ignores the messages of the
+clients about other paths.
+The bots still render the rows and choose the log names.  They send the
+rows to the daemon, which keeps a single handle open per log, writes the
+rows of all the bots in batches from one thread, writes headers and
+footers, and deletes old logs and rewrites index pages one directory at a
+time, so the bots no longer race on them.
+
+Messages are frames of a 4-byte big-endian length and a JSON array:
+
+    ["open", <path>, <header or null>, <footer>]
+                        opens a log for the client; <header> is written if
+                        the log is new, otherwise the footer is stripped
+    ["write", <path>, <text>]
+    ["close", <path>, <text>]
+                        closes a log for the client; <text>, usually the
+                        footer, is written once no client has it open
+    ["started", <log directory>, <name>, <logs to keep>, <index options>,
+     <activity>]
+                        deletes the old logs and rewrites the index pages,
+                        like a bot does when it starts a log
+    ["commit", <footer>, <fsync>]
+                        commits the logs, like the durability setting
+    ["sync"]            answered with ["synced"] once everything sent before
+                        is written
+
+and the daemon sends back:
+
+    ["deleted", <log directory>, <names>]
+                        the old logs deleted for a "started" message of the
+                        client, as it sent <log directory>, before the
+                        answer to the next "sync"
+    ["synced"]
+
+Logs a client did not close are closed without footer when it goes away.
+The daemon keeps the list of the log files of each directory in memory,
+and only lists a directory again if something else changed it.
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from io import open
+
+from .remote import header_format, frame
+from .writer import LogWriter
+from .maintenance import Maintenance
+from .manifest import Manifest
+from .plugin import writeIndexPages, listLogFiles, oldLogs, truncateFooter
+
+log = logging.getLogger('supybot')
+
+def readExactly(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError()
+    return data
+
+class SharedLogs(object):
+    ''' The logs open for the clients of the daemon. '''
+    def __init__(self, root, writer, maintenance):
+        self.root = os.path.realpath(root)
+        self.writer = writer
+        self.maintenance = maintenance
+        self.lock = threading.Lock()
+        # path -> [file, number of opens]
+        self.logs = {}
+        # log directory -> Manifest
+        self.manifests = {}
+
+    def resolve(self, path):
+        ''' Returns the real path of path, or None if it is not under the
+            log root.
+        '''
+        path = os.path.realpath(path)
+        if not path.startswith(os.path.join(self.root, '')):
+            return None
+        return path
+
+    def getManifest(self, logDir):
+        ''' Returns the list of log files of logDir, listing the directory
+            again if it is not known or was changed by something else.
+        '''
+        with self.lock:
+            manifest = self.manifests.get(logDir)
+            if manifest is None:
+                manifest = Manifest(None, logDir)
+                self.manifests[logDir] = manifest
+        if manifest.isStale():
+            log.info('Rebuilding the list of log files in %s.', logDir)
+            manifest.rebuild(listLogFiles(logDir))
+        return manifest
+
+    def open(self, path, header, footer):
+        with self.lock:
+            entry = self.logs.get(path)
+            if entry is not None:
+                entry[1] += 1
+                return
+            if self.writer.isClosing(path):
+                # Its footer has to be written before it can be stripped.
+                self.writer.sync()
+            if os.path.isfile(path):
+                if os.path.getsize(path):
+                    truncateFooter(path, footer.encode('utf-8'), log)
+            else:
+                # Created by us, which must not make the list stale.
+                manifest = self.manifests.get(os.path.dirname(path))
+                if manifest is not None and manifest.files is not None:
+                    manifest.add(os.path.basename(path))
+            logFile = open(path, encoding='utf-8', mode='a')
+            if header and not logFile.tell():
+                logFile.write(header)
+            self.logs[path] = [logFile, 1]
+
+    def write(self, path, text):
+        ''' Writes text to the log at path.  Returns False if it is not
+            open.
+        '''
+        entry = self.logs.get(path)
+        if entry is None:
+            return False
+        self.writer.write(entry[0], text)
+        return True
+
+    def close(self, path, text):
+        with self.lock:
+            entry = self.logs.get(path)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1]:
+                # Still written by another client.
+                return
+            del self.logs[path]
+            self.writer.close(entry[0], text)
+
+    def started(self, logDir, name, number2keep, indexOptions, activity,
+                report=None):
+        self.maintenance.submit(logDir, self.logStarted, logDir, name,
+                                number2keep, indexOptions, activity, report)
+
+    def logStarted(self, logDir, name, number2keep, indexOptions, activity,
+                   report=None):
+        ''' Deletes the old logs of logDir, and rewrites the index pages of
+            the months of the new and deleted logs.  The names of the
+            deleted logs are passed to report, if given.
+        '''
+        manifest = self.getManifest(logDir)
+        # Opened right after this message was sent.
+        manifest.add(name)
+        changed = [name]
+        if number2keep:
+            for f in oldLogs(manifest.snapshot(), number2keep):
+                try:
+                    os.remove(os.path.join(logDir, f))
+                except OSError:
+                    if os.path.exists(os.path.join(logDir, f)):
+                        raise
+                log.info('Deleting old logfile "%s".', f)
+                manifest.remove(f)
+                changed.append(f)
+        if report is not None and changed[1:]:
+            report(changed[1:])
+        (channel, logURL, filenameTimestamp, shard, header, footer) = \
+            indexOptions[:6]
+        writeIndexPages(logDir, channel, manifest.snapshot(), logURL,
+                        filenameTimestamp, shard, header, footer, changed,
+                        activity)
+        manifest.save()
+
+    def sync(self):
+        self.writer.sync()
+        self.maintenance.sync()
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    ''' Applies the messages of a client. '''
+    def setup(self):
+        # Clients are idle between the messages of their channels, which
+        # the default socket timeout of supybot would take for a failure.
+        self.request.settimeout(None)
+        socketserver.StreamRequestHandler.setup(self)
+
+    def handle(self):
+        logs = self.server.logs
+        # path -> opens of this client
+        opened = {}
+        # path sent by this client -> real path
+        paths = {}
+        # Answers are sent from this thread and the maintenance threads.
+        lock = threading.Lock()
+        def reply(*message):
+            with lock:
+                self.request.sendall(frame(message))
+        def reportDeleted(logDir):
+            def report(removed):
+                try:
+                    reply('deleted', logDir, removed)
+                except (IOError, OSError):
+                    # The client went away.
+                    pass
+            return report
+        self.server.clients.add(self.request)
+        try:
+            while True:
+                try:
+                    (size,) = header_format.unpack(
+                            readExactly(self.rfile, header_format.size))
+                    message = json.loads(
+                            readExactly(self.rfile, size).decode('utf-8'))
+                except EOFError:
+                    return
+                kind = message[0]
+                if kind in ('write', 'open', 'close'):
+                    path = paths.get(message[1])
+                    if path is None:
+                        path = logs.resolve(message[1])
+                        if path is None:
+                            log.warning('HtmlLogger daemon ignored a client '
+                                        'writing to %s.', message[1])
+                            continue
+                        paths[message[1]] = path
+                    message[1] = path
+                elif kind == 'started':
+                    report = reportDeleted(message[1])
+                    path = logs.resolve(message[1])
+                    if path is None or os.path.basename(message[2]) != \
+                                       message[2]:
+                        log.warning('HtmlLogger daemon ignored a client '
+                                    'starting %s in %s.', message[2],
+                                    message[1])
+                        continue
+                    message[1] = path
+                if kind == 'write':
+                    if not logs.write(message[1], message[2]):
+                        # Written without being opened first.
+                        logs.open(message[1], None, '')
+                        opened[message[1]] = opened.get(message[1], 0) + 1
+                        logs.write(message[1], message[2])
+                elif kind == 'open':
+                    logs.open(*message[1:])
+                    opened[message[1]] = opened.get(message[1], 0) + 1
+                elif kind == 'close':
+                    if opened.get(message[1]):
+                        opened[message[1]] -= 1
+                        logs.close(*message[1:])
+                        if not opened[message[1]]:
+                            del opened[message[1]]
+                            paths = dict((sent, path)
+                                         for (sent, path) in paths.items()
+                                         if path != message[1])
+                elif kind == 'started':
+                    logs.started(*message[1:], report=report)
+                elif kind == 'commit':
+                    logs.writer.commit(*message[1:])
+                elif kind == 'sync':
+                    logs.sync()
+                    reply('synced')
+        except (IOError, OSError, ValueError):
+            log.exception('HtmlLogger daemon lost a client:')
+        finally:
+            self.server.clients.discard(self.request)
+            for (path, count) in opened.items():
+                for i in range(count):
+                    logs.close(path, '')
+
+class DaemonServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, root, writer, maintenance):
+        if os.path.exists(path):
+            # Left by a daemon that did not stop cleanly.
+            os.remove(path)
+        socketserver.UnixStreamServer.__init__(self, path, DaemonHandler)
+        self.path = path
+        self.logs = SharedLogs(root, writer, maintenance)
+        # Connections of the clients
+        self.clients = set()
+
+    def stop(self):
+        ''' Stops serving, disconnects the clients, whose logs are closed
+            without footer, and waits for everything to be written.  Call
+            it from another thread than serve_forever.
+        '''
+        self.shutdown()
+        self.server_close()
+        for client in list(self.clients):
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except (IOError, OSError):
+                pass
+        # The handlers close the logs of their client.
+        while self.clients:
+            time.sleep(0.01)
+        self.logs.sync()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+            description='Write the HtmlLogger logs of several bots.')
+    parser.add_argument('socket', help='the Unix socket to listen on')
+    parser.add_argument('root', help='the directory the logs are under')
+    parser.add_argument('--queue-size', dest='queueSize', type=int,
+                        default=100000,
+                        help='rows waiting to be written at most, like '
+                             'asyncWrites.queueSize')
+    parser.add_argument('--flush-interval', dest='flushInterval', type=float,
+                        default=1.0,
+                        help='seconds before written rows are flushed, like '
+                             'asyncWrites.flushInterval')
+    parser.add_argument('--flush-bytes', dest='flushBytes', type=int,
+                        default=65536,
+                        help='bytes after which a log is flushed, like '
+                             'asyncWrites.flushBytes')
+    parser.add_argument('--threads', type=int, default=2,
+                        help='threads deleting old logs and writing index '
+                             'pages')
+    options = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    writer = LogWriter(options.queueSize, 'block', options.flushInterval,
+                       options.flushBytes)
+    maintenance = Maintenance(options.threads)
+    server = DaemonServer(options.socket, options.root, writer, maintenance)
+    sys.stdout.write('Writing logs for the clients of %s\n' % options.socket)
+    sys.stdout.flush()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        thread.join()
+        writer.stop()
+        maintenance.stop()
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,150 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Structured store of the logged events, from which the HTML logs can be
+regenerated.
+
+Events of a channel are appended to one JSON lines file per UTC day,
+<YYYY-MM-DD>.jsonl, in a directory named like the channel's log directory.
+Each line is a JSON array:
+
+    ["reset"]                     start of a segment, forget all nicks
+    ["nick", <id>, <nick>]        <id> stands for <nick> until the next reset
+    [<time>, <notice>, <id>, <message>]
+                                  an event; <id> is null if there is no nick
+    [<time>, <notice>, <id>, <message>, <html>]
+                                  an event logged as the given HTML, such as
+                                  a join/part summary
+
+A segment starts each time the file is opened, so a file can be appended to
+without reading it first.
+'''
+
+import os
+import json
+import time
+import logging
+
+from io import open
+
+log = logging.getLogger('supybot')
+
+def dayFileName(day):
+    return time.strftime('%Y-%m-%d.jsonl', time.gmtime(day * 86400))
+
+class EventFile(object):
+    def __init__(self, directory, day):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.day = day
+        self.path = os.path.join(directory, dayFileName(day))
+        self.file = open(self.path, encoding='utf-8', mode='a')
+        self.file.write(u'["reset"]\n')
+        self.nicks = {}
+
+    def append(self, when, notice, nick, text, html=None):
+        nickId = None
+        if nick is not None:
+            nickId = self.nicks.get(nick)
+            if nickId is None:
+                nickId = len(self.nicks)
+                self.nicks[nick] = nickId
+                self.file.write(u'%s\n' % json.dumps(['nick', nickId, nick],
+                                                     ensure_ascii=False,
+                                                     separators=(',', ':')))
+        record = [int(when * 1000) / 1000.0, int(notice), nickId, text]
+        if html is not None:
+            record.append(html)
+        self.file.write(u'%s\n' % json.dumps(record, ensure_ascii=False,
+                                             separators=(',', ':')))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class EventStore(object):
+    ''' Appends events to the day files of each log directory.  One file per
+        directory is kept open, the one of the current day.
+    '''
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+
+    def append(self, logDir, when, notice, nick, text, html=None):
+        day = int(when // 86400)
+        eventFile = self.files.get(logDir)
+        try:
+            if eventFile is None or eventFile.day != day:
+                if eventFile is not None:
+                    eventFile.close()
+                eventFile = EventFile(os.path.join(self.root, logDir), day)
+                self.files[logDir] = eventFile
+            eventFile.append(when, notice, nick, text, html)
+        except (IOError, OSError):
+            log.exception('HtmlLogger could not store an event in %s:',
+                          logDir)
+            self.files.pop(logDir, None)
+
+    def flush(self):
+        for eventFile in self.files.values():
+            eventFile.flush()
+
+    def close(self):
+        for eventFile in self.files.values():
+            eventFile.close()
+        self.files.clear()
+
+def readEvents(path):
+    ''' Yields (time, notice, nick, message, html) for every event of a day
+        file; html is None unless the event was logged as HTML.  A truncated
+        last line, from a crash, is skipped.
+    '''
+    nicks = {}
+    with open(path, encoding='utf-8') as eventFile:
+        for line in eventFile:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record[0] == 'reset':
+                nicks = {}
+            elif record[0] == 'nick':
+                nicks[record[1]] = record[2]
+            else:
+                (when, notice, nickId, text) = record[:4]
+                html = None
+                if len(record) > 4:
+                    html = record[4]
+                nick = None
+                if nickId is not None:
+                    nick = nicks.get(nickId)
+                yield (when, bool(notice), nick, text, html)
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,96 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Background maintenance of the log directories.
+'''
+
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import supybot.log as log
+
+class Maintenance(object):
+    ''' Runs the slow work on the log directories, such as deleting old logs
+        and rewriting index pages, from a pool of threads.
+
+        The tasks of a directory always go to the same thread, so they run
+        one at a time, in the order they were submitted.
+    '''
+    def __init__(self, threads):
+        self.queues = []
+        self.threads = []
+        self.done = 0
+        self.errors = 0
+        for i in range(threads):
+            tasks = queue.Queue()
+            thread = threading.Thread(target=self.run, args=(tasks,),
+                                      name='HtmlLogger maintenance %s' % i)
+            thread.daemon = True
+            thread.start()
+            self.queues.append(tasks)
+            self.threads.append(thread)
+
+    def submit(self, logDir, function, *args):
+        ''' Has function(*args) called after the tasks submitted before for
+            logDir.
+        '''
+        self.queues[hash(logDir) % len(self.queues)].put((function, args))
+
+    def sync(self):
+        ''' Waits until every task submitted so far is done. '''
+        for tasks in self.queues:
+            tasks.join()
+
+    def stop(self):
+        ''' Waits for the submitted tasks, and stops the threads. '''
+        for tasks in self.queues:
+            tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def run(self, tasks):
+        while True:
+            task = tasks.get()
+            try:
+                if task is None:
+                    return
+                (function, args) = task
+                try:
+                    function(*args)
+                    self.done += 1
+                except Exception:
+                    self.errors += 1
+                    log.exception('HtmlLogger maintenance task failed:')
+            finally:
+                tasks.task_done()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,134 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Persistent list of the log files of a channel directory.
+'''
+
+import os
+import json
+import bisect
+import threading
+
+from io import open
+
+def writeAtomically(path, text):
+    ''' Writes text to path through a temporary file, so readers never see
+        a partially written file.
+    '''
+    tmpPath = path + '.tmp'
+    with open(tmpPath, encoding='utf-8', mode='w') as tmpFile:
+        tmpFile.write(text)
+    if hasattr(os, 'replace'):
+        os.replace(tmpPath, path)
+    else:
+        os.rename(tmpPath, path)
+
+class Manifest(object):
+    ''' Sorted list of the log files of one channel directory.
+
+        The manifest is stored outside of the log directory, with the mtime
+        the directory had when it was last saved.  If the directory was
+        modified by something else since then, the manifest is stale and has
+        to be rebuilt from the directory contents.
+
+        It can be saved from another thread than the one changing it.  If
+        path is None, it is only kept in memory, and saving it only records
+        the mtime.
+    '''
+    version = 1
+
+    def __init__(self, path, logDir):
+        self.path = path
+        self.logDir = logDir
+        self.files = None
+        self.mtime = None
+        self.dirty = False
+        self.lock = threading.Lock()
+        if path is None:
+            return
+        try:
+            with open(path, encoding='utf-8') as manifestFile:
+                data = json.load(manifestFile)
+            if data.get('version') == self.version:
+                self.files = sorted(data['files'])
+                self.mtime = data['mtime']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def isStale(self):
+        if self.files is None:
+            return True
+        if self.dirty:
+            # Changed by us, and not saved yet.
+            return False
+        try:
+            return os.stat(self.logDir).st_mtime != self.mtime
+        except OSError:
+            return True
+
+    def rebuild(self, files):
+        with self.lock:
+            self.files = sorted(files)
+            self.dirty = True
+
+    def add(self, name):
+        with self.lock:
+            index = bisect.bisect_left(self.files, name)
+            if index == len(self.files) or self.files[index] != name:
+                self.files.insert(index, name)
+            self.dirty = True
+
+    def remove(self, name):
+        with self.lock:
+            index = bisect.bisect_left(self.files, name)
+            if index < len(self.files) and self.files[index] == name:
+                del self.files[index]
+            self.dirty = True
+
+    def snapshot(self):
+        ''' Returns a copy of the list of files. '''
+        with self.lock:
+            return list(self.files)
+
+    def save(self):
+        ''' Records the current mtime of the log directory, and writes the
+            manifest.  Call it after the last change to the directory.
+        '''
+        with self.lock:
+            self.mtime = os.stat(self.logDir).st_mtime
+            self.dirty = False
+            if self.path is None:
+                return
+            manifestDir = os.path.dirname(self.path)
+            if not os.path.exists(manifestDir):
+                os.makedirs(manifestDir)
+            writeAtomically(self.path, json.dumps({'version': self.version,
+                                                   'mtime': self.mtime,
+                                                   'files': self.files}))
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
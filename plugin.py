@@ -33,19 +33,24 @@ Channel Logger that produces HTML files.
 import os
 import re
 import sys
-import shutil
 import time
+import json
+import threading
+import collections
 
 if sys.version_info[0] >= 3:
     from html import escape as html_escape
     bin_mode = ''
+    intern_string = sys.intern
 else:
     from xml.sax.saxutils import escape as html_escape
     from io import open
     bin_mode = 'b'
+    intern_string = intern
 
 import supybot.conf as conf
 import supybot.world as world
+import supybot.schedule as schedule
 import supybot.ircdb as ircdb
 import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
@@ -53,6 +58,11 @@ import supybot.ircutils as ircutils
 import supybot.registry as registry
 import supybot.callbacks as callbacks
 import supybot.commands as commands
+try:
+    import supybot.httpserver as httpserver
+except ImportError:
+    # Supybot has no HTTP server.
+    httpserver = None
 try:
     from supybot.i18n import PluginInternationalization, internationalizeDocstring
     _ = PluginInternationalization('HtmlLogger')
@@ -62,8 +72,29 @@ except:
     _ = lambda x:x
     internationalizeDocstring = lambda x:x
 
-# This regex doesn't match every URL, but it is simple and gets most.
-url_regex = re.compile("(\s*)([fhtps]{3,5}://\S+)(\s*)")
+from .writer import LogWriter, commitLog
+from .remote import DaemonClient, RemoteLog
+from .maintenance import Maintenance
+from .manifest import Manifest, writeAtomically
+from .search import SearchIndex
+from .reader import logFiles, lastRows, grepRows
+from .events import EventStore
+from .tail import fragment
+from .sweeper import Sweeper
+from .activity import ChannelActivity, loadActivity, renderActivity
+from .compress import Compressor, compressed_suffix, decompressFile
+from .stats import Stats, not_timed, timer, prometheus, \
+                   buckets as stats_buckets, operations as stats_operations
+
+# This regex doesn't match every URL, but it is simple and gets most.  URLs
+# are searched for in the raw message, and stop before characters that
+# cannot be part of a URL in a message.
+raw_url_regex = re.compile(r'[fhtps]{3,5}://[^\s<>"]+')
+# Not taken as the end of a URL, like the dot ending a sentence.
+url_trailing = '.,;:!?\')'
+# What ircutils.stripFormatting removes.
+color_regex = re.compile(r'\x03(?:\d{1,2},\d{1,2}|\d{1,2}|,\d{1,2}|)')
+format_chars = ('\x02', '\x0f', '\x16', '\x1d', '\x1f')
 
 file_prefix = "log"
 file_suffix = "html"
@@ -72,6 +103,513 @@ notice_class = "style-notice"
 timestamp_class = "style-tz"
 nick_class = "style-nick"
 message_class = "style-msg"
+burst_class = "style-burst"
+pages_class = "style-pages"
+nicks_class = "style-nicks"
+# Quit reason of the users lost in a netsplit: the two servers that split.
+netsplit_regex = re.compile(r'^([\w-]+(?:\.[\w-]+)+) ([\w-]+(?:\.[\w-]+)+)$')
+# How much of the end of a log is searched for an old footer when the footer
+# template no longer matches.
+footer_window = 4096
+# Templates are not checked for modifications more often than this (seconds).
+template_check_interval = 1
+plugin_dir = os.path.dirname(os.path.realpath(__file__))
+
+def nextLogNameChange(format, now):
+    ''' Returns the first time after now at which time.strftime(format) in
+        UTC gives a different string, or None if it does not change within a
+        year.  Every strftime field changes on a second, minute, hour or day
+        boundary, so only those need to be tried.
+    '''
+    current = time.strftime(format, time.gmtime(now))
+    now = int(now)
+    candidates = [now + 1, now - now % 60 + 60]
+    nextHour = now - now % 3600 + 3600
+    candidates.extend(nextHour + 3600 * i for i in range(24))
+    nextDay = now - now % 86400 + 86400
+    candidates.extend(nextDay + 86400 * i for i in range(367))
+    for candidate in candidates:
+        if time.strftime(format, time.gmtime(candidate)) != current:
+            return candidate
+    return None
+
+def channel2URL(channel_name):
+    ''' Some characters are not allowed in URLs, and so must be
+        substituted.
+        Every reference to the log file name should be processed by this
+        function so that the log file can be linked in the URL.
+    '''
+    urlFriendly = channel_name
+    # The hash character in the last segment of a URL directs the browser to
+    # an anchor in the page.
+    if channel_name.startswith('##'):
+        urlFriendly = channel_name.replace('##', 'hashhash-', 1)
+    elif channel_name.startswith('#'):
+        urlFriendly = channel_name.replace('#', 'hash-', 1)
+    return urlFriendly
+
+def uncompressedName(fileName):
+    if fileName.endswith(compressed_suffix):
+        return fileName[:-len(compressed_suffix)]
+    return fileName
+
+# Index pages of a year and of a month: index-<year>[-<month>].html
+shard_regex = re.compile(r'^index-[0-9]{4}(?:-[0-9]{2})?\.%s$' % file_suffix)
+# strftime directives that give the year, and the month.
+year_directives = ('%Y', '%y', '%F', '%c', '%x', '%D')
+month_directives = ('%m', '%b', '%B', '%h', '%j', '%F', '%c', '%x', '%D')
+# Subdirectory of the bot's HTTP server answering the live tail requests.
+tail_subdir = 'htmllogger'
+# Upper bound on the number of cached dates of log names.
+max_log_dates = 100000
+
+# Pages after the first of a log: log_<channel>_<timestamp>.p<page>.html
+page_regex = re.compile(r'^(.*)\.p([0-9]+)\.%s$' % file_suffix)
+
+def pageName(name, page):
+    ''' Returns the file name of a page of the log name.  The first page
+        is the log itself.
+    '''
+    if page == 1:
+        return name
+    return '%s.p%d.%s' % (name[:-len(file_suffix)-1], page, file_suffix)
+
+def splitPage(fileName):
+    ''' Returns (log name, page) for the file name of a log or of one of
+        its pages, compressed or not.
+    '''
+    name = uncompressedName(fileName)
+    match = page_regex.match(name)
+    if match is None:
+        return (name, 1)
+    return ('%s.%s' % (match.group(1), file_suffix), int(match.group(2)))
+
+def lastPage(logDir, name):
+    ''' Returns the number of the last page of the log name in logDir.
+        Pages are only deleted with the whole log, so the first missing page
+        is past the last one.
+    '''
+    page = 1
+    while os.path.exists(os.path.join(logDir, pageName(name, page + 1))) or \
+          os.path.exists(os.path.join(logDir, pageName(name, page + 1) +
+                                      compressed_suffix)):
+        page += 1
+    return page
+
+def listLogFiles(logDir):
+    return [f for f in os.listdir(logDir)
+              if os.path.isfile(os.path.join(logDir, f))
+                 and f.startswith(file_prefix+"_")
+                 and uncompressedName(f).endswith("."+file_suffix)]
+
+def oldLogs(files, number2keep):
+    ''' Returns the files of all but the number2keep newest logs.  A log,
+        its pages and their compressed copies count as one.
+    '''
+    names = sorted(set(splitPage(f)[0] for f in files))
+    need2delete = set(names[::-1][number2keep:])
+    return [f for f in files if splitPage(f)[0] in need2delete]
+
+def truncateFooter(logPath, footer, log):
+    ''' Truncates footer from the end of an existing log file, so new lines
+        can be appended.  Only the tail of the file is read.  A partial last
+        row, left by a crash, is dropped.  Warnings go to log.
+    '''
+    with open(logPath, mode='rb+') as logFile:
+        logFile.seek(0, os.SEEK_END)
+        size = logFile.tell()
+        window = min(size, max(len(footer), footer_window))
+        logFile.seek(size - window)
+        tail = logFile.read(window)
+        if footer and tail.endswith(footer):
+            logFile.truncate(size - len(footer))
+        elif tail.rstrip().endswith(b'</html>'):
+            # The footer template changed since this log was closed.  Cut
+            # at </body> so at least the document stays well formed.
+            end = tail.rfind(b'</body>')
+            if end != -1:
+                log.warning('Footer of %s does not match the footer '
+                            'template, truncating at </body>.', logPath)
+                logFile.truncate(size - window + end)
+        elif tail and not tail.endswith(b'\n'):
+            # Cut short by a crash in the middle of a row: drop what was
+            # written of the row.
+            end = tail.rfind(b'\n')
+            if end != -1:
+                log.warning('%s ends with a partial row, truncating it.',
+                            logPath)
+                logFile.truncate(size - window + end + 1)
+
+def pageLink(fileName, text):
+    return '<p class="%s"><a href="%s">%s</a></p>\n' % (pages_class, fileName,
+                                                        text)
+
+def logDateName(channel, name):
+    ''' Returns the timestamp part of the name of a log of channel. '''
+    return name[len(file_prefix)+len(channel2URL(channel))+2
+                :-(len(file_suffix)+1)]
+
+def canShard(filename_timeformat):
+    ''' Returns True if the names of the logs tell their year and month. '''
+    return any(d in filename_timeformat for d in year_directives) and \
+           any(d in filename_timeformat for d in month_directives)
+
+# (filenameTimestamp, timestamp part of a log name) -> (year, month) or None
+log_dates = {}
+
+def logMonth(datename, filename_timeformat):
+    ''' Returns (year, month) of a log from the timestamp part of its name,
+        or None if it does not parse with filename_timeformat.
+    '''
+    key = (filename_timeformat, datename)
+    month = log_dates.get(key, False)
+    if month is False:
+        try:
+            date = time.strptime(datename, filename_timeformat)
+            month = (date.tm_year, date.tm_mon)
+        except ValueError:
+            month = None
+        if len(log_dates) >= max_log_dates:
+            log_dates.clear()
+        log_dates[key] = month
+    return month
+
+def shardName(year, month=None):
+    if month is None:
+        return 'index-%04d.%s' % (year, file_suffix)
+    return 'index-%04d-%02d.%s' % (year, month, file_suffix)
+
+def groupPages(logFiles):
+    ''' Returns {log name: page numbers} for logFiles.  Compressed logs
+        count under their uncompressed name.
+    '''
+    pages = {}
+    for f in logFiles:
+        if '.p' in f or f.endswith(compressed_suffix):
+            (name, page) = splitPage(f)
+        else:
+            (name, page) = (f, 1)
+        pages.setdefault(name, set()).add(page)
+    return pages
+
+def renderLogItems(channel, names, pages, logURL, filename_timeformat=None):
+    ''' Returns the list items of the logs names, newest first, with the
+        links to their pages, and the end of the list.
+    '''
+    # Separate logs by month, but only if the filename date format is what we expect
+    simple_split_months = False
+    lastmonth = ''
+    if filename_timeformat == "%Y-%m-%d":
+        simple_split_months = True
+    index = []
+    for f in sorted(names, reverse=True):
+        datename = logDateName(channel, f)
+        if simple_split_months and datename[0:7] != lastmonth:
+            monthstring = datename[0:7]
+            if lastmonth == '': # First time through
+                index.append('<h3>%s</h3>\n<ul>\n'%(monthstring))
+            else:
+                index.append('</ul>\n<h3>%s</h3>\n<ul>\n'%(monthstring))
+            lastmonth = monthstring
+        links = ''.join(' <a href="%s%s">%s</a>' % (logURL, pageName(f, page),
+                                                    page)
+                        for page in sorted(pages[f]) if page > 1)
+        if links:
+            links = ' &ndash; pages:' + links
+        index.append('\t<li><a href="%s%s">%s</a>%s</li>\n'
+                     %(logURL,f,datename or f,links))
+    index.append("</ul>\n")
+    return ''.join(index)
+
+def renderIndex(channel, logFiles, logURL, filename_timeformat, header,
+                footer, activity=''):
+    ''' Returns the index page listing logFiles, newest first.  Compressed
+        logs are listed under their uncompressed name, and the pages of a
+        log next to it.  activity is the HTML of the activity statistics.
+    '''
+    if logURL != '': logURL = logURL + '/'
+    pages = groupPages(logFiles)
+    return ''.join([header, "<h2>Daily Logs for %s</h2>\n" %(channel),
+                    activity,
+                    renderLogItems(channel, pages, pages, logURL,
+                                   filename_timeformat),
+                    footer])
+
+def groupMonths(channel, names, filename_timeformat):
+    ''' Returns ({(year, month): log names}, the names without a date). '''
+    months = {}
+    others = []
+    start = len(file_prefix) + len(channel2URL(channel)) + 2
+    end = -(len(file_suffix) + 1)
+    cached = log_dates.get
+    for name in names:
+        month = cached((filename_timeformat, name[start:end]), False)
+        if month is False:
+            month = logMonth(name[start:end], filename_timeformat)
+        if month is None:
+            others.append(name)
+        else:
+            months.setdefault(month, []).append(name)
+    return (months, others)
+
+def renderTopIndex(channel, months, others, pages, logURL, header, footer,
+                   activity=''):
+    ''' Returns the index page linking to the pages of every year and month
+        of months, followed by the logs without a date.  activity is the
+        HTML of the activity statistics.
+    '''
+    index = [header, "<h2>Daily Logs for %s</h2>\n" %(channel), activity]
+    for year in sorted(set(year for (year, month) in months), reverse=True):
+        index.append('<h3><a href="%s%s">%04d</a></h3>\n<ul>\n' %
+                     (logURL, shardName(year), year))
+        for (y, month) in sorted(months, reverse=True):
+            if y == year:
+                index.append('\t<li><a href="%s%s">%04d-%02d</a> (%d)</li>\n'
+                             % (logURL, shardName(year, month), year, month,
+                                len(months[(year, month)])))
+        index.append('</ul>\n')
+    if others:
+        index.append('<h3>%s</h3>\n<ul>\n' % _('Other logs'))
+        index.append(renderLogItems(channel, others, pages, logURL))
+    index.append(footer)
+    return ''.join(index)
+
+def renderYearIndex(channel, year, months, logURL, header, footer):
+    ''' Returns the index page of a year, linking to its months. '''
+    index = [header,
+             "<h2>Daily Logs for %s in %04d</h2>\n" % (channel, year),
+             pageLink('%sindex.%s' % (logURL, file_suffix), _('All years')),
+             '<ul>\n']
+    for (y, month) in sorted(months, reverse=True):
+        if y == year:
+            index.append('\t<li><a href="%s%s">%04d-%02d</a> (%d)</li>\n' %
+                         (logURL, shardName(year, month), year, month,
+                          len(months[(year, month)])))
+    index.append('</ul>\n')
+    index.append(footer)
+    return ''.join(index)
+
+def renderMonthIndex(channel, year, month, names, pages, logURL, header,
+                     footer):
+    ''' Returns the index page of the logs names of a month. '''
+    return ''.join([header,
+                    "<h2>Daily Logs for %s in %04d-%02d</h2>\n" %
+                    (channel, year, month),
+                    pageLink('%s%s' % (logURL, shardName(year)), '%04d' % year),
+                    '<ul>\n',
+                    renderLogItems(channel, names, pages, logURL),
+                    footer])
+
+def writeIndexPages(logDir, channel, logFiles, logURL, filename_timeformat,
+                    shard, header, footer, changed=None, activity=''):
+    ''' Writes the index pages of logDir for logFiles.  If shard is true and
+        the log names tell their year and month, index.html links to a page
+        per year and per month.  If changed is given, only the pages of the
+        months of those files, and of months without one, are rewritten,
+        with index.html and the pages of their years.  activity is the HTML
+        of the activity statistics, shown in index.html.  Returns the number
+        of pages written.
+    '''
+    sharded = shard and canShard(filename_timeformat)
+    if changed is None or not sharded:
+        # Pages left from another layout or from deleted months.
+        stale = set(f for f in os.listdir(logDir) if shard_regex.match(f))
+    if not sharded:
+        writeAtomically(os.path.join(logDir, 'index.%s' % file_suffix),
+                        renderIndex(channel, logFiles, logURL,
+                                    filename_timeformat, header, footer,
+                                    activity))
+        for f in stale:
+            os.remove(os.path.join(logDir, f))
+        return 1
+    if logURL != '': logURL = logURL + '/'
+    pages = groupPages(logFiles)
+    (months, others) = groupMonths(channel, pages, filename_timeformat)
+    if changed is None:
+        dirty = set(months)
+    else:
+        dirty = set(groupMonths(channel,
+                                set(splitPage(f)[0] for f in changed),
+                                filename_timeformat)[0])
+        dirty.update(m for m in months if not os.path.exists(
+                os.path.join(logDir, shardName(*m))))
+        stale = set(shardName(*m) for m in dirty) | \
+                set(shardName(year) for (year, month) in dirty)
+    written = 0
+    for (year, month) in dirty:
+        if (year, month) in months:
+            name = shardName(year, month)
+            writeAtomically(os.path.join(logDir, name),
+                            renderMonthIndex(channel, year, month,
+                                             months[(year, month)], pages,
+                                             logURL, header, footer))
+            stale.discard(name)
+            written += 1
+    years = set(year for (year, month) in months)
+    for year in years & set(year for (year, month) in dirty):
+        name = shardName(year)
+        writeAtomically(os.path.join(logDir, name),
+                        renderYearIndex(channel, year, months, logURL, header,
+                                        footer))
+        stale.discard(name)
+        written += 1
+    writeAtomically(os.path.join(logDir, 'index.%s' % file_suffix),
+                    renderTopIndex(channel, months, others, pages, logURL,
+                                   header, footer, activity))
+    for f in stale:
+        path = os.path.join(logDir, f)
+        if os.path.exists(path):
+            os.remove(path)
+    return written + 1
+
+def stripIrcFormatting(s):
+    ''' Same as ircutils.stripFormatting, but only does the replacements
+        that change something.
+    '''
+    if '\x03' in s:
+        s = color_regex.sub('', s)
+    for char in format_chars:
+        if char in s:
+            s = s.replace(char, '')
+    return s
+
+def urlEnd(s, start, end):
+    ''' Returns where the URL found in s[start:end] really ends, without
+        trailing punctuation.  A closing parenthesis is kept if the URL
+        opened one.
+    '''
+    while end > start and s[end-1] in url_trailing:
+        if s[end-1] == ')' and \
+                s.count('(', start, end) >= s.count(')', start, end):
+            break
+        end -= 1
+    return end
+
+def renderMessage(s, stripFormatting=False):
+    ''' Returns the HTML of a message: IRC formatting removed if
+        stripFormatting, HTML escaped, and URLs linked.  URLs are found in
+        the raw message, so an escaped character is never taken as part of
+        one, and messages without "://" skip the search.
+    '''
+    if stripFormatting:
+        s = stripIrcFormatting(s)
+    if '://' not in s:
+        return html_escape(s)
+    pieces = []
+    last = 0
+    for match in raw_url_regex.finditer(s):
+        start = match.start()
+        end = urlEnd(s, start, match.end())
+        if end <= start:
+            continue
+        url = html_escape(s[start:end])
+        pieces.append(html_escape(s[last:start]))
+        pieces.append('<a href="%s">%s</a>' % (url, url))
+        last = end
+    pieces.append(html_escape(s[last:]))
+    return ''.join(pieces)
+
+class LineRenderer(object):
+    ''' Renders log rows in one piece.
+
+        Each combination of notice, timestamp and nick gets a format string
+        built once.  The formatted timestamp is reused within the same
+        second, and the last nick and message are remembered, so a message
+        sent to several channels is only escaped and linkified once.
+    '''
+    def __init__(self):
+        self.templates = {}
+        self.timestampKey = None
+        self.timestampString = ''
+        self.nickKey = None
+        self.nickString = ''
+        self.messageKey = None
+        self.messageString = ''
+
+    def getTemplate(self, notice, timestamp, nick):
+        key = (notice, timestamp, nick)
+        template = self.templates.get(key)
+        if template is None:
+            row_classes = row_class
+            if notice:
+                row_classes = row_class + " " + notice_class
+            template = '<p class="%s">' % row_classes
+            if timestamp:
+                template += '<span class="%s">%%s</span>' % timestamp_class
+            if nick:
+                template += '<span class="%s">%%s</span>' % nick_class
+            template += '<span class="%s">%%s</span></p>\n' % message_class
+            self.templates[key] = template
+        return template
+
+    def timestamp(self, format, now=None):
+        if now is None:
+            now = time.time()
+        key = (int(now), format)
+        if key != self.timestampKey:
+            if format:
+                self.timestampString = \
+                        time.strftime(format, time.gmtime(now)) + '  '
+            else:
+                self.timestampString = ''
+            self.timestampKey = key
+        return self.timestampString
+
+    def nick(self, nick):
+        if nick != self.nickKey:
+            self.nickString = html_escape("<%s> " %nick)
+            self.nickKey = nick
+        return self.nickString
+
+    def message(self, s, stripFormatting):
+        key = (s, stripFormatting)
+        if key != self.messageKey:
+            self.messageString = renderMessage(s, stripFormatting)
+            self.messageKey = key
+        return self.messageString
+
+    def render(self, notice, nick, s, timestampFormat=None,
+               stripFormatting=False, now=None, html=None):
+        ''' Returns the row for a message.  There is no timestamp if
+            timestampFormat is None, and no nick if nick is None.  now is the
+            time of the message, and defaults to the current time.  If html
+            is given, it is used as the message as it is, instead of s.
+        '''
+        args = []
+        if timestampFormat is not None:
+            args.append(self.timestamp(timestampFormat, now))
+        if nick is not None:
+            args.append(self.nick(nick))
+        if html is None:
+            args.append(self.message(s, stripFormatting))
+        else:
+            args.append(html)
+        template = self.getTemplate(notice, timestampFormat is not None,
+                                    nick is not None)
+        return template % tuple(args)
+
+def formatBound(seconds):
+    ''' Formats the upper bound of a histogram bucket. '''
+    if seconds is None:
+        return '-'
+    if seconds == float('inf'):
+        return '>%gs' % stats_buckets[-1]
+    if seconds < 0.001:
+        return '<%dus' % round(seconds * 1000000)
+    if seconds < 1:
+        return '<%gms' % (seconds * 1000)
+    return '<%gs' % seconds
+
+def registryLoadedAt():
+    ''' Returns when the registry was last read from disk.
+    '''
+    # A reload (config reload, or the bot re-reading its .conf) only fills
+    # registry._cache; each value picks it up lazily the next time it is
+    # called, so no callback fires for values a snapshot no longer reads.
+    # The module-private timestamp open_registry() sets is the only signal;
+    # checked against Limnoria 2026.05.08.  Should a release drop it,
+    # snapshots only follow changes made at runtime.
+    return getattr(registry, '_lastModified', 0)
 
 class FakeLog(object):
     def flush(self):
@@ -81,22 +619,356 @@ class FakeLog(object):
     def write(self, s):
         return
 
+class ChannelSettings(object):
+    ''' Snapshot of the registry values used to log one channel, so the
+        message path does not walk the registry for every line.
+    '''
+    __slots__ = ('enable', 'timestamp', 'timestampFormat', 'stripFormatting',
+                 'flushImmediately', 'noLogPrefix', 'showJoinParts',
+                 'rotateLogs', 'filenameTimestamp', 'deleteOldLogs',
+                 'searchIndex', 'eventStore', 'compressLogs',
+                 'networkDirectory', 'maxOpenLogs', 'coalesceJoinParts',
+                 'coalesceWindow', 'coalesceThreshold', 'coalesceMaxNicks',
+                 'pageBytes', 'pageLines', 'shardIndex', 'activityStats',
+                 'logCapability', 'builtAt')
+
+    def __init__(self, plugin, channel):
+        for name in ('enable', 'timestamp', 'stripFormatting', 'noLogPrefix',
+                     'showJoinParts', 'rotateLogs', 'filenameTimestamp',
+                     'deleteOldLogs', 'searchIndex', 'eventStore',
+                     'compressLogs', 'coalesceJoinParts', 'pageBytes',
+                     'pageLines', 'shardIndex', 'activityStats'):
+            setattr(self, name, plugin.watchRegistryValue(name, channel))
+        for name in ('window', 'threshold', 'maxNicks'):
+            setattr(self, 'coalesce' + name[0].upper() + name[1:],
+                    plugin.watchRegistryValue('coalesceJoinParts.' + name))
+        self.flushImmediately = plugin.watchRegistryValue('flushImmediately')
+        self.networkDirectory = plugin.watchRegistryValue('networkDirectory')
+        self.maxOpenLogs = plugin.watchRegistryValue('maxOpenLogs')
+        self.timestampFormat = plugin.watchValue(conf.supybot.log.timestampFormat)
+        self.logCapability = ircdb.makeChannelCapability(channel,
+                                                         'logChannelMessages')
+        self.builtAt = registryLoadedAt()
+
+    def isStale(self):
+        ''' True if the registry was reloaded from disk since this snapshot
+            was taken.  Values changed at runtime drop the snapshot through
+            their callbacks instead.
+        '''
+        return self.builtAt < registryLoadedAt()
+
+class Template(object):
+    ''' Contents of a header or footer template, with what is needed to tell
+        whether the file changed on disk.
+    '''
+    __slots__ = ('path', 'mtime', 'text', 'checkedAt')
+
+    def __init__(self, path, mtime, text):
+        self.path = path
+        self.mtime = mtime
+        self.text = text
+        self.checkedAt = 0
+
+class Membership(object):
+    ''' Which channels each nick of a network is in, as far as the bot can
+        see, kept up to date from JOIN, PART, KICK, NICK, QUIT and NAMES.
+        Nicks and channels are stored lowercased.
+    '''
+    __slots__ = ('nicks', 'counts', 'names')
+
+    def __init__(self):
+        # nick -> set of channels
+        self.nicks = {}
+        # channel -> number of nicks in it, so a channel with nobody known
+        # in it is not searched for
+        self.counts = {}
+        # Channels whose NAMES reply is being received.
+        self.names = set()
+
+    def channelsOf(self, nick):
+        return self.nicks.get(ircutils.toLower(nick), ())
+
+    def join(self, nick, channel):
+        channels = self.nicks.get(nick)
+        if channels is None:
+            channels = set()
+            self.nicks[nick] = channels
+        if channel not in channels:
+            channels.add(channel)
+            self.counts[channel] = self.counts.get(channel, 0) + 1
+
+    def part(self, nick, channel):
+        channels = self.nicks.get(nick)
+        if channels is None or channel not in channels:
+            return
+        channels.remove(channel)
+        if not channels:
+            del self.nicks[nick]
+        self.leave(channel)
+
+    def leave(self, channel):
+        count = self.counts[channel] - 1
+        if count:
+            self.counts[channel] = count
+        else:
+            del self.counts[channel]
+
+    def drop(self, channel):
+        ''' Forgets everyone in channel.  This walks every nick, but only
+            happens when the bot leaves the channel or gets its NAMES.
+        '''
+        if channel not in self.counts:
+            return
+        del self.counts[channel]
+        for (nick, channels) in list(self.nicks.items()):
+            channels.discard(channel)
+            if not channels:
+                del self.nicks[nick]
+
+    def quit(self, nick):
+        for channel in self.nicks.pop(nick, ()):
+            self.leave(channel)
+
+    def rename(self, oldNick, newNick):
+        channels = self.nicks.pop(oldNick, None)
+        if channels is None:
+            return
+        for channel in self.nicks.pop(newNick, ()):
+            # Should not happen, but the counts have to stay right.
+            self.leave(channel)
+        self.nicks[newNick] = channels
+
+    def fill(self, state):
+        ''' Adds who the irc state says is in the channels of the bot, for a
+            Membership created after the bot joined them.
+        '''
+        for (channel, channelState) in state.channels.items():
+            channel = intern_string(ircutils.toLower(channel))
+            for nick in channelState.users:
+                self.join(ircutils.toLower(nick), channel)
+
+    def addMsg(self, irc, msg):
+        command = msg.command
+        if command == 'JOIN':
+            nick = ircutils.toLower(msg.nick)
+            for channel in msg.args[0].split(','):
+                self.join(nick, intern_string(ircutils.toLower(channel)))
+        elif command == 'PART' or command == 'KICK':
+            if command == 'PART':
+                nick = msg.nick
+            else:
+                nick = msg.args[1]
+            nick = ircutils.toLower(nick)
+            me = ircutils.strEqual(nick, irc.nick)
+            for channel in msg.args[0].split(','):
+                channel = ircutils.toLower(channel)
+                if me:
+                    self.drop(channel)
+                else:
+                    self.part(nick, channel)
+        elif command == 'NICK':
+            self.rename(ircutils.toLower(msg.nick),
+                        ircutils.toLower(msg.args[0]))
+        elif command == 'QUIT':
+            self.quit(ircutils.toLower(msg.nick))
+        elif command == '353':
+            channel = intern_string(ircutils.toLower(msg.args[2]))
+            if channel not in self.names:
+                # A new reply replaces what we knew of the channel.
+                self.drop(channel)
+                self.names.add(channel)
+            for name in msg.args[3].split():
+                # Strip the status prefixes and, with userhost-in-names,
+                # the user and host.
+                nick = name.lstrip('@%+&~!').split('!', 1)[0]
+                self.join(ircutils.toLower(nick), channel)
+        elif command == '366':
+            self.names.discard(ircutils.toLower(msg.args[1]))
+
+class Burst(object):
+    ''' Joins, parts and quits of a channel waiting to be logged as one
+        summary row.
+    '''
+    __slots__ = ('nicks', 'size', 'splits', 'event')
+
+    labels = (('join', 'joined'), ('part', 'left'), ('quit', 'quit'))
+
+    def __init__(self):
+        # kind -> nicks, in order
+        self.nicks = {'join': [], 'part': [], 'quit': []}
+        self.size = 0
+        self.splits = []
+        self.event = None
+
+    def add(self, kind, nick, split=None):
+        self.nicks[kind].append(nick)
+        self.size += 1
+        if split is not None and split not in self.splits:
+            self.splits.append(split)
+
+    def summary(self):
+        counts = ['%s %s' % (len(self.nicks[kind]), label)
+                  for (kind, label) in self.labels if self.nicks[kind]]
+        text = '*** %s' % ', '.join(counts)
+        if self.splits:
+            text = '*** Netsplit %s: %s' % (
+                    ', '.join('%s <-> %s' % split for split in self.splits),
+                    ', '.join(counts))
+        return text
+
+    def nickList(self):
+        return '; '.join('%s: %s' % (label, ' '.join(self.nicks[kind]))
+                         for (kind, label) in self.labels
+                         if self.nicks[kind])
+
+    def render(self):
+        ''' Returns the summary as plain text, and as HTML where the nicks
+            are only shown once the summary is clicked.
+        '''
+        summary = self.summary()
+        nickList = self.nickList()
+        text = '%s (%s)' % (summary, nickList)
+        html = ('%s <label class="%s"><input type="checkbox"/>[%s nicks]'
+                '<span class="%s"> %s</span></label>' %
+                (html_escape(summary), burst_class, self.size, nicks_class,
+                 html_escape(nickList)))
+        return (text, html)
+
+if httpserver is not None:
+    class TailCallback(httpserver.SupyHTTPServerCallback):
+        ''' Answers the fragment requests of the live tail, see tail.py. '''
+        name = 'HtmlLogger live tail'
+        public = False
+
+        def __init__(self, plugin):
+            self.plugin = plugin
+
+        def doGetOrHead(self, handler, path, write_content):
+            # Only snapshots taken by the bot thread are read from here.
+            (status, headers, body) = fragment(
+                    conf.supybot.directories.log.dirize(self.plugin.name()),
+                    path, self.plugin.tailFooter, self.plugin.tailDirs)
+            handler.send_response(status)
+            for (name, value) in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if write_content:
+                self.wfile.write(body)
+
 class HtmlLogger(callbacks.Plugin):
     noIgnore = True
     def __init__(self, irc):
         self.__parent = super(HtmlLogger, self)
         self.__parent.__init__(irc)
-        self.lastMsgs = {}
-        self.lastStates = {}
+        # irc -> Membership
+        self.members = {}
+        # (irc, channel) -> times of the last joins, parts and quits
+        self.recentJoinParts = {}
+        # (irc, channel) -> Burst
+        self.bursts = {}
         self.logs = {}
+        # (irc, channel) of the open logs, least recently written first
+        self.logOrder = collections.OrderedDict()
+        # (irc, channel) -> path of the logs closed by maxOpenLogs, which
+        # have no footer
+        self.parkedLogs = {}
+        # open log -> [bytes, rows] of its page, for the paged logs
+        self.pages = {}
+        self.logHits = 0
+        self.logMisses = 0
+        self.logEvictions = 0
+        self.settings = {}
+        self.templates = {}
+        self.manifests = {}
+        self.renderer = LineRenderer()
+        self.searchIndex = None
+        self.searchIndexLock = threading.Lock()
+        self.eventStore = EventStore(
+                conf.supybot.directories.data.dirize(
+                    os.path.join(self.name(), 'events')))
+        self.watchedValues = {}
+        self.settingsChanged = self.configChanged
+        self.rotations = {}
+        # filenameTimestamp -> (time, the next change of the name after it)
+        self.nameChanges = {}
+        # Log directories known to exist
+        self.logDirs = set()
+        self.rotationEvent = None
+        self.rotationTime = None
+        self.writer = None
+        self.writerOptions = None
+        # Logs written since the last commit of durability, when they are
+        # written from this thread
+        self.uncommitted = set()
+        # log -> its size without the footer written by the last commit
+        self.committed = {}
+        self.uncommittedBytes = 0
+        self.updateWriter()
+        self.maintenance = None
+        self.maintenanceOptions = None
+        self.updateMaintenance()
+        self.compressor = None
+        self.compressorOptions = None
+        # (logDir, added, removed) reported by the compressor threads
+        self.compressorChanges = collections.deque()
+        self.sweeper = None
+        self.sweeperOptions = None
+        # (logDir, removed) reported by the sweeper thread
+        self.sweeperChanges = collections.deque()
+        self.updateSweeper()
+        # (network, channel) -> ChannelActivity, shared by the channels
+        # logged in the same directory
+        self.activity = {}
+        # log directory -> ChannelActivity
+        self.activityDirs = {}
+        self.activityInterval = None
+        self.updateActivity()
+        self.stats = None
+        self.statsInterval = 0
+        self.updateStats()
+        self.durability = None
+        self.commitBytes = 0
+        self.updateDurability()
+        self.daemon = None
+        self.daemonOptions = None
+        # Time of the next attempt to reach the writer daemon
+        self.daemonRetry = 0
+        self.updateDaemon()
+        self.tailHooked = False
+        # Log directories served by the live tail, and the footer it strips
+        self.tailDirs = frozenset()
+        self.tailFooter = b''
+        self.updateTail()
         self.flusher = self.flush
         world.flushers.append(self.flusher)
 
     def die(self):
         self.log.debug('Logging is dying.')
+        self.endBursts()
         for log in self._logs():
             self.endLog(log)
+        self.endParkedLogs()
+        self.logs.clear()
+        self.stopDaemon()
+        self.unscheduleRotation()
+        self.unscheduleStats()
+        self.unscheduleCommits()
+        self.unhookTail()
+        self.unscheduleActivity()
+        self.snapshotActivity()
+        self.stopWriter()
+        self.stopMaintenance()
+        self.stopCompressor()
+        self.stopSweeper()
+        if self.searchIndex is not None:
+            self.searchIndex.stop()
+            self.searchIndex = None
+        self.eventStore.close()
         world.flushers = [x for x in world.flushers if x is not self.flusher]
+        for value in self.watchedValues.values():
+            value.removeCallback(self.settingsChanged)
+        self.watchedValues.clear()
 
     def __call__(self, irc, msg):
         try:
@@ -104,27 +976,791 @@ class HtmlLogger(callbacks.Plugin):
             # doesn't call doNick or doQuit.
             # if msg.args and irc.isChannel(msg.args[0]):
             self.__parent.__call__(irc, msg)
-            if irc in self.lastMsgs:
-                if irc not in self.lastStates:
-                    self.lastStates[irc] = irc.state.copy()
-                self.lastStates[irc].addMsg(irc, self.lastMsgs[irc])
         finally:
-            # We must make sure this always gets updated.
-            self.lastMsgs[irc] = msg
+            # We must make sure this always gets updated.  It is updated
+            # after the handlers ran, so they see who was where before.
+            self.getMembership(irc).addMsg(irc, msg)
+            if self.tailHooked and self.isTailChange(irc, msg):
+                self.updateTailDirs()
 
     def reset(self):
         self.log.debug('Reset all logs.')
+        self.endBursts()
+        self.recentJoinParts.clear()
         for log in self._logs():
             self.endLog(log)
+        self.endParkedLogs()
         self.logs.clear()
-        self.lastMsgs.clear()
-        self.lastStates.clear()
+        self.logOrder.clear()
+        self.pages.clear()
+        self.rotations.clear()
+        self.unscheduleRotation()
+        self.logDirs.clear()
+        self.members.clear()
+        self.clearSettings()
+
+    def getMembership(self, irc):
+        if not isinstance(irc, irclib.Irc):
+            irc = irc.getRealIrc()
+        members = self.members.get(irc)
+        if members is None:
+            members = Membership()
+            # The plugin may be loaded after the bot joined its channels.
+            members.fill(irc.state)
+            self.members[irc] = members
+        return members
 
     def _logs(self):
         for logs in self.logs.values():
             for log in logs.values():
                 yield log
 
+    def watchValue(self, value):
+        ''' Returns the value of a registry entry, and makes sure the cached
+            settings are dropped when it changes.
+        '''
+        if id(value) not in self.watchedValues:
+            value.addCallback(self.settingsChanged)
+            self.watchedValues[id(value)] = value
+        return value()
+
+    def watchRegistryValue(self, name, channel=None):
+        if channel is None:
+            value = self.registryValue(name, value=False)
+        else:
+            value = self.registryValue(name, channel, value=False)
+        return self.watchValue(value)
+
+    def clearSettings(self):
+        self.settings.clear()
+
+    def configChanged(self):
+        self.clearSettings()
+        self.templates.clear()
+        # The background writer is stopped before the daemon takes over.
+        self.updateWriter()
+        self.updateDaemon()
+        self.updateMaintenance()
+        self.updateSweeper()
+        self.updateActivity()
+        self.updateStats()
+        self.updateDurability()
+        self.updateTail()
+        if self.compressor is not None and \
+                self.getCompressorOptions() != self.compressorOptions:
+            self.stopCompressor()
+        # rotateLogs or filenameTimestamp may have changed, so every open log
+        # is checked again, once the registry is done updating.
+        self.scheduleRotation(time.time())
+
+    def updateWriter(self):
+        ''' Starts, restarts or stops the background writer to match the
+            asyncWrites settings.
+        '''
+        if self.watchRegistryValue('asyncWrites') and \
+                not self.watchRegistryValue('writerDaemon'):
+            options = tuple(self.watchRegistryValue('asyncWrites.' + name)
+                            for name in ('queueSize', 'whenFull',
+                                         'flushInterval', 'flushBytes'))
+        else:
+            options = None
+        if options == self.writerOptions:
+            return
+        self.stopWriter()
+        if options is not None:
+            self.log.debug('Starting the background writer.')
+            self.writer = LogWriter(*options)
+            # The writer takes over the commits done so far.
+            self.writer.committed.update(self.committed)
+            self.writer.uncommitted.update(self.uncommitted)
+            self.committed.clear()
+            self.uncommitted.clear()
+        self.writerOptions = options
+
+    def stopWriter(self):
+        if self.writer is not None:
+            self.log.debug('Stopping the background writer.')
+            self.writer.stop()
+            self.committed.update(self.writer.committed)
+            self.uncommitted.update(self.writer.uncommitted)
+            self.writer = None
+        self.writerOptions = None
+
+    def updateDaemon(self):
+        ''' Connects to or disconnects from the writer daemon to match the
+            writerDaemon settings.
+        '''
+        path = self.watchRegistryValue('writerDaemon')
+        if path:
+            options = (path,
+                       self.watchRegistryValue('writerDaemon.flushInterval'),
+                       self.watchRegistryValue('writerDaemon.retryInterval'))
+        else:
+            options = None
+        if options == self.daemonOptions:
+            return
+        self.stopDaemon()
+        self.daemonOptions = options
+        if options is not None:
+            self.connectDaemon()
+            schedule.addPeriodicEvent(self.flushDaemon, options[1],
+                                      self.daemonEventName(), now=False)
+
+    def daemonEventName(self):
+        return '%s.daemon.%s' % (self.name(), id(self))
+
+    def stopDaemon(self):
+        if self.daemonOptions is not None:
+            try:
+                schedule.removePeriodicEvent(self.daemonEventName())
+            except KeyError:
+                pass
+            self.daemonOptions = None
+        if self.daemon is not None:
+            self.dropDaemon()
+
+    def connectDaemon(self):
+        ''' Connects to the writer daemon, and has it write the open logs
+            from now on.
+        '''
+        try:
+            self.daemon = DaemonClient(self.daemonOptions[0], self.sendDaemon)
+        except (IOError, OSError) as e:
+            self.log.warning('HtmlLogger could not reach the writer daemon '
+                             'at %s, writing the logs directly: %s',
+                             self.daemonOptions[0], e)
+            self.countError('daemon')
+            self.daemonRetry = time.time() + self.daemonOptions[2]
+            return
+        self.log.info('HtmlLogger writes the logs through the writer daemon '
+                      'at %s.', self.daemonOptions[0])
+        for logs in self.logs.values():
+            for (channel, log) in list(logs.items()):
+                if not hasattr(log, 'fileno'):
+                    continue
+                self.takeFooter(log)
+                log.close()
+                self.replaceLog(logs, channel, log, self.openFile(log.name))
+
+    def dropDaemon(self):
+        ''' Disconnects from the writer daemon, and writes the logs directly
+            from now on.  What the daemon did not get is written directly.
+        '''
+        client = self.daemon
+        self.daemon = None
+        client.full = None
+        remoteLogs = []
+        for logs in self.logs.values():
+            for (channel, log) in logs.items():
+                if isinstance(log, RemoteLog):
+                    log.close()
+                    remoteLogs.append((logs, channel, log))
+        try:
+            client.sync()
+        except (IOError, OSError):
+            self.log.exception('HtmlLogger lost the writer daemon, writing '
+                               'the logs directly:')
+            self.countError('daemon')
+            self.replayDaemon(client.pending)
+        client.close()
+        if self.daemonOptions is not None:
+            self.daemonRetry = time.time() + self.daemonOptions[2]
+        for (logs, channel, log) in remoteLogs:
+            try:
+                # In case the daemon committed it last.
+                self.stripFooter(log.name)
+                self.replaceLog(logs, channel, log,
+                                open(log.name, mode='a'+bin_mode))
+            except IOError:
+                self.log.exception('Error opening log:')
+                self.countError('fakeLog')
+                self.replaceLog(logs, channel, log, FakeLog())
+
+    def replayDaemon(self, messages):
+        ''' Does what the writer daemon would have done with messages. '''
+        for message in messages:
+            kind = message[0]
+            try:
+                if kind == 'open':
+                    if os.path.isfile(message[1]) and \
+                            os.path.getsize(message[1]):
+                        self.stripFooter(message[1])
+                    elif message[2]:
+                        with open(message[1], mode='a'+bin_mode) as logFile:
+                            logFile.write(message[2])
+                elif kind in ('write', 'close'):
+                    with open(message[1], mode='a'+bin_mode) as logFile:
+                        logFile.write(message[2])
+                elif kind == 'started':
+                    (logDir, name, number2keep, indexOptions) = message[1:5]
+                    self.runMaintenance(logDir, self.logStarted, logDir, name,
+                                        number2keep, None, None, indexOptions)
+            except IOError:
+                self.log.exception('Error writing log:')
+                self.countError('daemon')
+
+    def replaceLog(self, logs, channel, log, newLog):
+        logs[channel] = newLog
+        page = self.pages.pop(log, None)
+        if page is not None:
+            self.pages[newLog] = page
+
+    def sendDaemon(self):
+        ''' Sends what is buffered for the writer daemon.  If it fails, the
+            next flushDaemon falls back to writing directly.
+        '''
+        try:
+            self.daemon.flush()
+        except (IOError, OSError):
+            pass
+
+    def flushDaemon(self):
+        ''' Sends what is buffered for the writer daemon, or tries to reach
+            it again if it is time to.
+        '''
+        if self.daemon is None:
+            if self.daemonOptions is not None and \
+                    time.time() >= self.daemonRetry:
+                self.connectDaemon()
+            return
+        try:
+            self.daemon.flush()
+            self.forgetDaemonDeletions()
+        except (IOError, OSError):
+            self.dropDaemon()
+
+    def forgetDaemonDeletions(self):
+        ''' Takes the logs the writer daemon deleted for us off the search
+            index.
+        '''
+        for (logDir, names) in self.daemon.poll():
+            self.forgetLogs(logDir, names)
+
+    def openFile(self, path, header=None):
+        ''' Opens the log at path for appending, through the writer daemon if
+            there is one.  The daemon writes header first if the log is new.
+        '''
+        if self.daemon is not None:
+            self.daemon.send('open', path, header, self.getFooter())
+            return RemoteLog(self.daemon, path)
+        return open(path, mode='a'+bin_mode)
+
+    def updateMaintenance(self):
+        ''' Starts, restarts or stops the maintenance threads to match the
+            asyncMaintenance settings.
+        '''
+        if self.watchRegistryValue('asyncMaintenance'):
+            options = (self.watchRegistryValue('asyncMaintenance.threads'),)
+        else:
+            options = None
+        if options == self.maintenanceOptions:
+            return
+        self.stopMaintenance()
+        if options is not None:
+            self.log.debug('Starting the maintenance threads.')
+            self.maintenance = Maintenance(*options)
+        self.maintenanceOptions = options
+
+    def stopMaintenance(self):
+        ''' Stops the maintenance threads, once the tasks they were given are
+            done.
+        '''
+        if self.maintenance is not None:
+            self.log.debug('Stopping the maintenance threads.')
+            self.maintenance.stop()
+            self.maintenance = None
+        self.maintenanceOptions = None
+
+    def runMaintenance(self, logDir, function, *args):
+        ''' Calls function(*args) from a maintenance thread, after the
+            earlier tasks of logDir, or right away if asyncMaintenance is
+            disabled.
+        '''
+        if self.maintenance is not None:
+            self.maintenance.submit(logDir, function, *args)
+        else:
+            function(*args)
+
+    def syncMaintenance(self):
+        ''' Waits for the maintenance threads, if any, to be done. '''
+        if self.maintenance is not None:
+            self.maintenance.sync()
+
+    def writeLog(self, log, text, flush=False):
+        if self.writer is not None:
+            self.writer.write(log, text, flush)
+        else:
+            if self.committed:
+                self.takeFooter(log)
+            log.write(text)
+            if flush:
+                log.flush()
+            if self.durability is not None:
+                self.uncommitted.add(log)
+        if self.commitBytes:
+            self.uncommittedBytes += len(text)
+            if self.uncommittedBytes >= self.commitBytes:
+                self.commitLogs()
+
+    def takeFooter(self, log):
+        ''' Truncates the footer written by the last commit, if any, off a
+            log written from this thread.
+        '''
+        self.uncommitted.discard(log)
+        size = self.committed.pop(log, None)
+        if size is not None:
+            log.truncate(size)
+
+    def updateDurability(self):
+        ''' Schedules or unschedules the commits of the logs to match the
+            durability settings.
+        '''
+        mode = self.watchRegistryValue('durability')
+        if mode == 'none' and self.watchRegistryValue('liveTail'):
+            # The rows have to reach the files to be tailed.
+            mode = 'flush'
+        if mode == 'none':
+            options = None
+        else:
+            options = (mode, self.watchRegistryValue('durability.interval'),
+                       self.watchRegistryValue('durability.bytes'))
+        if options == self.durability:
+            return
+        self.unscheduleCommits()
+        if options is not None:
+            schedule.addPeriodicEvent(self.commitLogs, options[1],
+                                      self.commitEventName(), now=False)
+            self.commitBytes = options[2]
+        self.durability = options
+
+    def updateTail(self):
+        ''' Hooks or unhooks the live tail on the bot's HTTP server to match
+            liveTail.
+        '''
+        if self.watchRegistryValue('liveTail'):
+            if not self.tailHooked and httpserver is not None:
+                httpserver.hook(tail_subdir, TailCallback(self))
+                self.tailHooked = True
+            self.updateTailDirs()
+        else:
+            self.unhookTail()
+
+    def updateTailDirs(self):
+        ''' Snapshots the log directories the live tail serves, those of the
+            channels the bot is in that are neither secret nor private and
+            have liveTail.allowChannel, and the footer it strips.
+        '''
+        if not self.tailHooked:
+            return
+        logDirs = set()
+        for irc in world.ircs:
+            for (channel, state) in irc.state.channels.items():
+                if 's' in state.modes or 'p' in state.modes:
+                    continue
+                channel = self.normalizeChannel(irc, channel)
+                if self.watchRegistryValue('liveTail.allowChannel', channel):
+                    logDirs.add(self.getRelativeLogDir(irc, channel))
+        self.tailDirs = frozenset(logDirs)
+        self.tailFooter = self.getFooter().encode('utf-8')
+
+    def isTailChange(self, irc, msg):
+        ''' True if msg can change the channels served by the live tail. '''
+        if msg.command in ('MODE', '324'):
+            return True
+        if msg.command in ('JOIN', 'PART'):
+            return ircutils.strEqual(msg.nick, irc.nick)
+        if msg.command == 'KICK':
+            return ircutils.strEqual(msg.args[1], irc.nick)
+        return False
+
+    def unhookTail(self):
+        if self.tailHooked:
+            httpserver.unhook(tail_subdir)
+            self.tailHooked = False
+
+    def commitEventName(self):
+        return '%s.commit.%s' % (self.name(), id(self))
+
+    def unscheduleCommits(self):
+        if self.durability is not None:
+            try:
+                schedule.removePeriodicEvent(self.commitEventName())
+            except KeyError:
+                pass
+            self.durability = None
+            self.commitBytes = 0
+
+    def commitLogs(self):
+        ''' Group commit of durability: ends every log written since the
+            last commit with its footer, and flushes it, and fsyncs it in
+            fsync mode.  The footer is taken off by the next write.
+        '''
+        if self.durability is None:
+            return
+        sync = (self.durability[0] == 'fsync')
+        footer = self.getFooter()
+        self.uncommittedBytes = 0
+        with self.measure('commit'):
+            if self.writer is not None:
+                self.writer.commit(footer, sync)
+                return
+            if self.daemon is not None:
+                self.daemon.send('commit', footer, sync)
+            for log in self.uncommitted:
+                if not hasattr(log, 'fileno'):
+                    continue
+                try:
+                    self.committed[log] = commitLog(log, footer)
+                    if sync:
+                        os.fsync(log.fileno())
+                except (IOError, OSError, ValueError):
+                    self.log.exception('Error committing log:')
+                    self.countError('commit')
+            self.uncommitted.clear()
+
+    def syncLogs(self):
+        ''' Waits for the background writer, or the writer daemon, if any, to
+            write everything.
+        '''
+        if self.writer is not None:
+            self.writer.sync()
+        if self.daemon is not None:
+            try:
+                self.daemon.sync()
+                self.forgetDaemonDeletions()
+            except (IOError, OSError):
+                self.dropDaemon()
+
+    def updateStats(self):
+        ''' Starts or stops counting, and the Prometheus dump, to match the
+            stats settings.
+        '''
+        interval = 0
+        if self.watchRegistryValue('stats'):
+            if self.stats is None:
+                self.stats = Stats()
+            interval = self.watchRegistryValue('stats.prometheusInterval')
+        else:
+            self.stats = None
+        if interval != self.statsInterval:
+            self.unscheduleStats()
+            if interval:
+                schedule.addPeriodicEvent(self.writePrometheus, interval,
+                                          self.statsEventName(), now=False)
+            self.statsInterval = interval
+
+    def statsEventName(self):
+        return '%s.stats.%s' % (self.name(), id(self))
+
+    def unscheduleStats(self):
+        if self.statsInterval:
+            try:
+                schedule.removePeriodicEvent(self.statsEventName())
+            except KeyError:
+                pass
+            self.statsInterval = 0
+
+    def measure(self, name):
+        ''' Returns a context manager timing what runs in it, if statistics
+            are enabled.
+        '''
+        if self.stats is None:
+            return not_timed
+        return self.stats.timed(name)
+
+    def countError(self, kind):
+        if self.stats is not None:
+            self.stats.error(kind)
+
+    def getCompressorOptions(self):
+        return (self.watchRegistryValue('compressLogs.maxConcurrency'),)
+
+    def getCompressor(self):
+        if self.compressor is None:
+            self.compressorOptions = self.getCompressorOptions()
+            self.compressor = Compressor(*self.compressorOptions,
+                                         done=self.compressorDone)
+        return self.compressor
+
+    def stopCompressor(self):
+        if self.compressor is not None:
+            self.log.debug('Stopping the compressor.')
+            self.compressor.stop()
+            self.compressor = None
+        self.compressorOptions = None
+
+    def compressorDone(self, logDir, added, removed):
+        ''' Called from the compressor threads.  The manifests are updated
+            by applyCompressorChanges, when they are next used.
+        '''
+        self.compressorChanges.append((logDir, added, removed))
+
+    def updateSweeper(self):
+        ''' Starts, restarts or stops the sweeps of the log tree to match
+            the deleteOldLogs settings.
+        '''
+        interval = self.watchRegistryValue('deleteOldLogs.sweepInterval')
+        if interval:
+            options = (interval,
+                       self.watchRegistryValue('deleteOldLogs.unlinkRate'))
+        else:
+            options = None
+        if options == self.sweeperOptions:
+            return
+        self.stopSweeper()
+        if options is not None:
+            self.log.debug('Starting the sweeper.')
+            self.sweeper = Sweeper(
+                    conf.supybot.directories.log.dirize(self.name()),
+                    options[1], self.logGroupName, self.isClosingLog,
+                    self.sweeperDone)
+            schedule.addPeriodicEvent(self.sweepLogs, interval,
+                                      self.sweepEventName(), now=False)
+        self.sweeperOptions = options
+
+    def stopSweeper(self):
+        if self.sweeper is not None:
+            self.log.debug('Stopping the sweeper.')
+            try:
+                schedule.removePeriodicEvent(self.sweepEventName())
+            except KeyError:
+                pass
+            try:
+                schedule.removeEvent(self.sweptEventName())
+            except KeyError:
+                pass
+            self.sweeper.stop()
+            self.sweeper = None
+            self.applySweeperChanges()
+        self.sweeperOptions = None
+
+    def sweepEventName(self):
+        return '%s.sweep.%s' % (self.name(), id(self))
+
+    def sweptEventName(self):
+        return '%s.swept.%s' % (self.name(), id(self))
+
+    def sweepLogs(self):
+        # The registry is read here, as the sweeper thread must not create
+        # channel values while the bot thread walks the registry.
+        self.sweeper.sweep(self.retentionLimits(),
+                           self.registryValue('deleteOldLogs.maxNetworkBytes'))
+
+    def retentionLimits(self):
+        ''' Returns the (keep, maxAge, maxBytes) limits of the logs of the
+            channels that have limits of their own, by lowercased name, and
+            those of the other channels under None.
+        '''
+        names = ('deleteOldLogs', 'deleteOldLogs.maxDays',
+                 'deleteOldLogs.maxBytes')
+        channels = set()
+        for name in names:
+            value = self.registryValue(name, value=False)
+            channels.update(child for (child, _) in
+                            value.getValues(fullNames=False)
+                            if ircutils.isChannel(child))
+        limits = {}
+        for channel in [None] + sorted(channels):
+            (keep, maxDays, maxBytes) = [self.registryValue(name, channel)
+                                         for name in names]
+            key = channel and ircutils.toLower(channel)
+            limits[key] = (keep, maxDays * 86400, maxBytes)
+        return limits
+
+    def logGroupName(self, fileName):
+        ''' Returns the name of the log that fileName is a page or a copy
+            of, or None if it is not a log.
+        '''
+        if not fileName.startswith(file_prefix + '_') or \
+                not uncompressedName(fileName).endswith('.' + file_suffix):
+            return None
+        return splitPage(fileName)[0]
+
+    def isClosingLog(self, path):
+        writer = self.writer
+        return writer is not None and writer.isClosing(path)
+
+    def sweeperDone(self, logDir, removed):
+        ''' Called from the sweeper thread.  The manifests and index pages
+            are updated by applySweeperChanges, from the bot thread.
+        '''
+        self.sweeperChanges.append((logDir, removed))
+        name = self.sweptEventName()
+        if name not in schedule.schedule.events:
+            schedule.addEvent(self.applySweeperChanges, time.time(), name)
+
+    def applySweeperChanges(self):
+        changes = collections.OrderedDict()
+        while self.sweeperChanges:
+            (logDir, removed) = self.sweeperChanges.popleft()
+            changes.setdefault(logDir, []).extend(removed)
+        for (logDir, removed) in changes.items():
+            channel = os.path.basename(logDir)
+            self.runMaintenance(logDir, self.logsDeleted, logDir, removed,
+                                self.getIndexOptions(
+                                    None, channel,
+                                    ChannelSettings(self, channel)))
+
+    def logsDeleted(self, logDir, removed, indexOptions):
+        ''' Takes the logs deleted by a sweep off the manifest of logDir, and
+            rewrites the index pages of their months.
+        '''
+        manifest = self.getManifest(logDir)
+        for name in removed:
+            manifest.remove(name)
+        self.forgetLogs(logDir, removed)
+        self.writeIndex(logDir, indexOptions, removed)
+
+    def updateActivity(self):
+        ''' Schedules the snapshots of the activity statistics to match
+            activityStats.snapshotInterval.
+        '''
+        interval = self.watchRegistryValue('activityStats.snapshotInterval')
+        maxNicks = self.watchRegistryValue('activityStats.maxNicks')
+        for activity in self.activityDirs.values():
+            activity.maxNicks = maxNicks
+        if interval == self.activityInterval:
+            return
+        self.unscheduleActivity()
+        schedule.addPeriodicEvent(self.snapshotActivity, interval,
+                                  self.activityEventName(), now=False)
+        self.activityInterval = interval
+
+    def activityEventName(self):
+        return '%s.activity.%s' % (self.name(), id(self))
+
+    def unscheduleActivity(self):
+        if self.activityInterval is not None:
+            try:
+                schedule.removePeriodicEvent(self.activityEventName())
+            except KeyError:
+                pass
+            self.activityInterval = None
+
+    def countActivity(self, irc, channel, nick, s):
+        key = (irc.network, channel)
+        activity = self.activity.get(key)
+        if activity is None:
+            logDir = self.getLogDir(irc, channel)
+            activity = self.activityDirs.get(logDir)
+            if activity is None:
+                activity = ChannelActivity(
+                        self.getDataPath(logDir, 'activity.json'),
+                        self.registryValue('activityStats.maxNicks'))
+                data = loadActivity(activity.path)
+                if data is not None:
+                    # Counted before the restart.
+                    activity.merge(data)
+                self.activityDirs[logDir] = activity
+            self.activity[key] = activity
+        activity.add(nick, len(s.encode('utf-8')), time.time())
+
+    def snapshotActivity(self, logDir=None):
+        ''' Has the activity statistics changed since their last snapshot,
+            only those of logDir if it is given, saved by the maintenance
+            threads.
+        '''
+        if logDir is None:
+            items = self.activityDirs.items()
+        else:
+            items = [(logDir, self.activityDirs.get(logDir))]
+        for (logDir, activity) in items:
+            if activity is None or not activity.dirty:
+                continue
+            activity.dirty = False
+            self.runMaintenance(logDir, self.saveActivity, activity.path,
+                                activity.toJSON())
+
+    def saveActivity(self, path, data):
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            writeAtomically(path, json.dumps(data))
+        except (IOError, OSError):
+            self.log.exception('Could not save the activity statistics:')
+            self.countError('activity')
+
+    def applyCompressorChanges(self):
+        while self.compressorChanges:
+            (logDir, added, removed) = self.compressorChanges.popleft()
+            manifest = self.manifests.get(logDir)
+            if manifest is None or manifest.files is None:
+                # Its mtime will tell it is stale when it is loaded.
+                continue
+            for name in added:
+                manifest.add(name)
+            for name in removed:
+                manifest.remove(name)
+
+    def compressOldLogs(self, compressor, keepOriginal, logDir, manifest,
+                        current):
+        ''' Queues every uncompressed log of logDir but the pages of current,
+            such as the logs rotated before a restart, for compression.
+        '''
+        current = splitPage(current)[0]
+        for name in manifest.snapshot():
+            if splitPage(name)[0] == current or \
+                    not name.endswith('.' + file_suffix):
+                continue
+            path = os.path.join(logDir, name)
+            if self.writer is not None and self.writer.isClosing(path):
+                # rotateLog queues it once its footer is written.
+                continue
+            compressor.compress(logDir, name, keepOriginal)
+
+    def reopenCompressed(self, logDir, name):
+        ''' Makes a compressed log writable again.  The uncompressed log wins
+            if both exist.
+        '''
+        path = os.path.join(logDir, name)
+        if not os.path.isfile(path):
+            self.log.info('Decompressing %s to append to it.', path)
+            decompressFile(path + compressed_suffix, path)
+        os.remove(path + compressed_suffix)
+        self.runMaintenance(logDir, self.updateManifest, logDir, [name],
+                            [name + compressed_suffix])
+
+    def getSearchIndexPath(self):
+        return conf.supybot.directories.data.dirize(
+                os.path.join(self.name(), 'search.sqlite'))
+
+    def getSearchIndex(self):
+        # Also opened by the maintenance threads, to forget deleted logs.
+        with self.searchIndexLock:
+            if self.searchIndex is None:
+                self.searchIndex = SearchIndex(self.getSearchIndexPath())
+            return self.searchIndex
+
+    def forgetLogs(self, logDir, names):
+        ''' Takes the lines of the deleted logs names of logDir off the
+            search index, if there is one.
+        '''
+        if self.searchIndex is None and \
+                not os.path.exists(self.getSearchIndexPath()):
+            return
+        searchIndex = self.getSearchIndex()
+        relativeDir = os.path.relpath(
+                logDir, conf.supybot.directories.log.dirize(self.name()))
+        for name in names:
+            searchIndex.forget(relativeDir, uncompressedName(name))
+
+    def getRelativeLogDir(self, irc, channel):
+        ''' Returns the log directory of a channel relative to the plugin's
+            log directory.  The search index and the event store group lines
+            by it.
+        '''
+        if self.getSettings(irc, channel).networkDirectory:
+            return os.path.join(irc.network, channel)
+        return channel
+
+    def getSettings(self, irc, channel):
+        key = (irc.network, self.normalizeChannel(irc, channel))
+        settings = self.settings.get(key)
+        if settings is None or settings.isStale():
+            settings = ChannelSettings(self, channel)
+            self.settings[key] = settings
+        return settings
+
     def getTemplatePath(self, template_name):
         registry_value = ''
         default_name = ''
@@ -140,220 +1776,768 @@ class HtmlLogger(callbacks.Plugin):
         elif template_name == 'indexFooter':
             registry_value = 'indexFooterFile'
             default_name = 'footer.html'
-        templatePath = self.registryValue(registry_value)
+        templatePath = self.watchRegistryValue(registry_value)
         if templatePath == '':
-            templatePath = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                                        default_name)
+            templatePath = os.path.join(plugin_dir, default_name)
         return templatePath
 
+    def getTemplate(self, templateName):
+        ''' Returns the contents of a template.  The file is only read again
+            if its path or modification time changed.
+        '''
+        now = time.time()
+        template = self.templates.get(templateName)
+        if template is not None and \
+                now - template.checkedAt < template_check_interval:
+            return template.text
+        templatePath = self.getTemplatePath(templateName)
+        mtime = os.stat(templatePath).st_mtime
+        if template is None or template.path != templatePath or \
+                template.mtime != mtime:
+            self.log.debug('Loading %s template from %s.' %
+                           (templateName, templatePath))
+            with open(templatePath, encoding='utf-8', mode='r') as templateFile:
+                template = Template(templatePath, mtime, templateFile.read())
+            self.templates[templateName] = template
+        template.checkedAt = now
+        return template.text
+
     def channel2URL(self, channel_name):
         ''' Some characters are not allowed in URLs, and so must be
             substituted.
             Every reference to the log file name should be processed by this
             function so that the log file can be linked in the URL.
         '''
-        urlFriendly = channel_name
-        # The hash character in the last segment of a URL directs the browser to
-        # an anchor in the page.
-        if channel_name.startswith('##'):
-            urlFriendly = channel_name.replace('##', 'hashhash-', 1)
-        elif channel_name.startswith('#'):
-            urlFriendly = channel_name.replace('#', 'hash-', 1)
-        return urlFriendly
+        return channel2URL(channel_name)
 
-    def startLog(self, logPath, channel):
+    def startLog(self, logPath, channel, previous=None):
+        ''' Writes the header of a new log, with a link to the previous page
+            if it is not the first page.  With the writer daemon, returns the
+            header for openLog instead.
+        '''
         self.log.info('Starting new log file: %s.' % logPath)
-        templatePath = self.getTemplatePath('header')
-        self.log.debug('Using header template from %s.' % templatePath)
-        shutil.copyfile(templatePath, logPath)
-        with open(logPath, encoding='utf-8', mode='a'+bin_mode) as logFile:
-            logFile.write("<h2>Daily Log for %s</h2>\n" %(channel))
+        header = self.getTemplate('header') + \
+                 "<h2>Daily Log for %s</h2>\n" %(channel)
+        if previous is not None:
+            header += pageLink(previous, _('Previous page'))
+        if self.daemon is not None:
+            # Written by the daemon, unless another bot started the log.
+            return header
+        self.expectLog(*os.path.split(logPath))
+        with open(logPath, encoding='utf-8', mode='w'+bin_mode) as logFile:
+            logFile.write(header)
+
+    def expectLog(self, logDir, name):
+        ''' Adds the log name, about to be created, to the manifest of
+            logDir if it is loaded, so creating it does not make the
+            manifest stale.
+        '''
+        manifest = self.manifests.get(logDir)
+        if manifest is not None and manifest.files is not None:
+            manifest.add(name)
 
-    def generateIndex(self, logDir, channel):
+    def getIndexOptions(self, irc, channel, settings=None):
+        ''' Returns what writeIndex needs besides the list of logs, read from
+            the bot thread.  settings defaults to those of channel on irc.
+        '''
+        if settings is None:
+            settings = self.getSettings(irc, channel)
+        topNicks = 0
+        if settings.activityStats:
+            topNicks = self.registryValue('activityStats.topNicks')
+        return (channel, self.registryValue("logURL"),
+                settings.filenameTimestamp, settings.shardIndex,
+                self.getTemplate('indexHeader'), self.getFooter('indexFooter'),
+                topNicks)
+
+    def generateIndex(self, irc, logDir, channel):
+        ''' Has every index page of logDir rewritten from its manifest, and
+            the manifest saved, by a maintenance thread.
+        '''
+        self.runMaintenance(logDir, self.writeIndex, logDir,
+                            self.getIndexOptions(irc, channel))
+
+    def writeIndex(self, logDir, indexOptions, changed=None):
+        ''' Rewrites the index pages of logDir, only those of the months of
+            the changed files if they are given.
+        '''
         self.log.info('Generating a new index.html in %s.' % logDir)
-        templatePath = self.getTemplatePath('indexHeader')
-        self.log.debug('Using header template from %s.' % templatePath)
-        indexPath = os.path.join(logDir, 'index.html')
-        shutil.copyfile(templatePath, indexPath)
-        logFiles = [f for f in os.listdir(logDir)
-                      if os.path.isfile(os.path.join(logDir, f))
-                           and f.startswith(file_prefix+"_")
-                           and f.endswith("."+file_suffix)]
-        logFiles.sort(reverse=True)
-        logURL = self.registryValue("logURL")
-        if logURL != '': logURL = logURL + '/'
-        # Separate logs by month, but only if the filename date format is what we expect
-        filename_timeformat = self.registryValue('filenameTimestamp', channel)
-        simple_split_months = False
-        lastmonth = ''
-        if filename_timeformat == "%Y-%m-%d":
-            simple_split_months = True
-        footerString = self.getFooter('indexFooter')
-        with open(indexPath, encoding='utf-8', mode='a'+bin_mode) as indexFile:
-            indexFile.write("<h2>Daily Logs for %s</h2>\n" %(channel))
-            for f in logFiles:
-                datename = f[len(file_prefix)+len(self.channel2URL(channel))+2
-                             :-(len(file_suffix)+1)]
-                if simple_split_months and datename[0:7] != lastmonth:
-                    monthstring = datename[0:7]
-                    if lastmonth == '': # First time through
-                        indexFile.write('<h3>%s</h3>\n<ul>\n'%(monthstring))
-                    else:
-                        indexFile.write('</ul>\n<h3>%s</h3>\n<ul>\n'%(monthstring))
-                    lastmonth = monthstring
-                indexFile.write('\t<li><a href="%s%s">%s</a></li>\n'
-                                %(logURL,f,datename))
-            indexFile.write("</ul>\n")
-            indexFile.write(footerString)
+        with self.measure('index'):
+            manifest = self.getManifest(logDir)
+            (channel, logURL, filenameTimestamp, shard, header, footer,
+             topNicks) = indexOptions
+            activity = ''
+            if topNicks:
+                activity = renderActivity(
+                        loadActivity(self.getDataPath(logDir,
+                                                      'activity.json')),
+                        topNicks)
+            writeIndexPages(logDir, channel, manifest.snapshot(), logURL,
+                            filenameTimestamp, shard, header, footer, changed,
+                            activity)
+            manifest.save()
+
+    def updateManifest(self, logDir, added, removed):
+        manifest = self.getManifest(logDir)
+        for name in added:
+            manifest.add(name)
+        for name in removed:
+            manifest.remove(name)
+        manifest.save()
+
+    def logStarted(self, logDir, name, number2keep, compressor, keepOriginal,
+                   indexOptions):
+        ''' Does the work on logDir that follows the start of the log name:
+            deletes the old logs if number2keep is not zero, has the others
+            compressed if compressor is given, and rewrites the index pages
+            of the months of the added and deleted logs.
+        '''
+        manifest = self.getManifest(logDir)
+        manifest.add(name)
+        changed = [name]
+        if number2keep > 0:
+            changed.extend(self.removeOldLogs(logDir, number2keep))
+        if compressor is not None:
+            self.compressOldLogs(compressor, keepOriginal, logDir, manifest,
+                                 name)
+        self.writeIndex(logDir, indexOptions, changed)
+
+    def startedLog(self, irc, channel, logDir, name, number2keep, compressor,
+                   keepOriginal):
+        ''' Has logStarted run for the new log name of channel, by the writer
+            daemon if there is one, which does not compress logs.
+        '''
+        indexOptions = self.getIndexOptions(irc, channel)
+        if self.daemon is None:
+            self.runMaintenance(logDir, self.logStarted, logDir, name,
+                                number2keep, compressor, keepOriginal,
+                                indexOptions)
+            return
+        activity = ''
+        topNicks = indexOptions[-1]
+        if topNicks:
+            activity = renderActivity(
+                    loadActivity(self.getDataPath(logDir, 'activity.json')),
+                    topNicks)
+        self.daemon.send('started', logDir, name, number2keep, indexOptions,
+                         activity)
+
+    def listLogFiles(self, logDir):
+        return listLogFiles(logDir)
+
+    def getManifest(self, logDir):
+        ''' Returns the list of log files of logDir, rebuilding it from the
+            directory if it is missing or was not updated by us.
+        '''
+        self.applyCompressorChanges()
+        manifest = self.manifests.get(logDir)
+        if manifest is None:
+            manifest = Manifest(self.getDataPath(logDir, 'manifest.json'),
+                                logDir)
+            self.manifests[logDir] = manifest
+        if manifest.isStale():
+            self.log.info('Rebuilding the list of log files in %s.' % logDir)
+            manifest.rebuild(self.listLogFiles(logDir))
+        return manifest
+
+    def getDataPath(self, logDir, name):
+        ''' Returns the path of the file name kept about logDir in the data
+            directory.
+        '''
+        logRoot = conf.supybot.directories.log.dirize(self.name())
+        return os.path.join(conf.supybot.directories.data.dirize(self.name()),
+                            os.path.relpath(logDir, logRoot), name)
 
     def getFooter(self, templateName = 'footer'):
-        ''' Reads the footer, and returns it as a string for appending to the
-            log file.
+        ''' Returns the footer as a string for appending to the log file. '''
+        return self.getTemplate(templateName)
+
+    def stripFooter(self, logPath):
+        ''' Truncates the footer from the end of an existing log file, so new
+            lines can be appended.
         '''
-        templatePath = self.getTemplatePath(templateName)
-        self.log.debug('Using footer template from %s.' % templatePath)
-        footerString = ''
-        with open(templatePath, mode='r'+bin_mode) as footerFile:
-            footerString = footerFile.read()
-        return footerString
+        truncateFooter(logPath, self.getFooter().encode('utf-8'), self.log)
 
-    def endLog(self, log):
+    def endLog(self, log, callback=None, nextPage=None):
+        ''' Writes the footer and closes log.  callback is called once it is
+            closed, from the writer thread if there is one.  If nextPage is
+            given, a link to it comes before the footer.
+        '''
         self.log.debug('Closing log file.')
         footerString = self.getFooter()
-        log.write(footerString)
-        log.close()
+        if nextPage is not None:
+            footerString = pageLink(nextPage, _('Next page')) + footerString
+        if isinstance(log, RemoteLog):
+            log.close(footerString)
+            if callback is not None:
+                callback()
+        elif self.writer is not None:
+            self.writer.close(log, footerString, callback)
+        else:
+            self.takeFooter(log)
+            log.write(footerString)
+            log.close()
+            if callback is not None:
+                callback()
 
-    def flush(self):
-        self.checkLogNames()
-        for log in self._logs():
+    def rotateLog(self, irc, channel, log):
+        ''' Closes a log whose name changed, and has it compressed, with its
+            earlier pages, if compressLogs is enabled.
+        '''
+        self.log.debug('Timestamp change. Close the log.')
+        with self.measure('rotate'):
+            if not self.getSettings(irc, channel).compressLogs or \
+                    not hasattr(log, 'fileno'):
+                self.endLog(log)
+                return
+            (logDir, name) = os.path.split(log.name)
+            compressor = self.getCompressor()
+            keepOriginal = self.registryValue('compressLogs.keepOriginal')
+            self.endLog(log, lambda: compressor.compress(logDir, name,
+                                                         keepOriginal))
+            (logName, page) = splitPage(name)
+            for earlier in range(1, page):
+                f = pageName(logName, earlier)
+                if os.path.isfile(os.path.join(logDir, f)):
+                    compressor.compress(logDir, f, keepOriginal)
+
+    def turnPage(self, irc, channel, log):
+        ''' Starts the next page of a log, and ends log with a link to it. '''
+        with self.measure('rotate'):
+            (logDir, name) = os.path.split(log.name)
+            (logName, page) = splitPage(name)
+            nextName = pageName(logName, page + 1)
+            nextPath = os.path.join(logDir, nextName)
+            self.log.debug('Log is full, starting page %s.', page + 1)
             try:
-                log.flush()
-            except ValueError as e:
-                if e.args[0] != 'I/O operation on a closed file':
-                    self.log.exception('Odd exception:')
+                header = self.startLog(nextPath, channel, previous=name)
+            except IOError:
+                # Keep writing to this page.
+                self.log.exception('Error starting the next page:')
+                self.countError('page')
+                self.pages.pop(log, None)
+                return
+            self.startedLog(irc, channel, logDir, nextName, 0, None, None)
+            del self.logs[irc][channel]
+            self.logOrder.pop((irc, channel), None)
+            self.pages.pop(log, None)
+            self.endLog(log, nextPage=nextName)
+            self.openLog(irc, channel, nextPath, time.time(), header)
+
+    def countPage(self, settings, log, size):
+        ''' Counts a row of size bytes in the current page of a paged log.
+            Returns True if the page is full with it.
+        '''
+        page = self.pages.get(log)
+        if page is None:
+            if not hasattr(log, 'name'):
+                return False
+            page = self.measurePage(log.name, settings.pageLines)
+            self.pages[log] = page
+        page[0] += size
+        page[1] += 1
+        return (settings.pageBytes and page[0] >= settings.pageBytes) or \
+               (settings.pageLines and page[1] >= settings.pageLines)
+
+    def measurePage(self, logPath, countRows):
+        ''' Returns [bytes, rows] of the page at logPath.  Rows are only
+            counted if countRows is true, as it means reading the page.
+        '''
+        rows = 0
+        try:
+            size = os.path.getsize(logPath)
+            if countRows:
+                start = ('<p class="%s' % row_class).encode('ascii')
+                with open(logPath, mode='rb') as logFile:
+                    rows = sum(1 for line in logFile if line.startswith(start))
+        except (IOError, OSError):
+            size = 0
+        return [size, rows]
+
+    def parkLog(self, irc, channel, log):
+        ''' Closes an open log without writing its footer, so it can be
+            reopened as it is.
+        '''
+        if isinstance(log, RemoteLog):
+            log.close()
+        elif self.writer is not None:
+            self.writer.close(log, '')
+        else:
+            self.takeFooter(log)
+            log.close()
+        self.parkedLogs[(irc, channel)] = log.name
+
+    def endParkedLog(self, irc, channel, rotated=False):
+        ''' Writes the footer of a parked log. '''
+        path = self.parkedLogs.pop((irc, channel))
+        try:
+            log = self.openFile(path)
+        except IOError:
+            self.log.exception('Error opening log:')
+            return
+        if rotated:
+            self.rotateLog(irc, channel, log)
+        else:
+            self.endLog(log)
+
+    def endParkedLogs(self):
+        for (irc, channel) in list(self.parkedLogs):
+            self.endParkedLog(irc, channel)
+
+    def evictLogs(self, limit):
+        ''' Parks the least recently written logs until only limit are
+            open.
+        '''
+        while len(self.logOrder) > limit:
+            ((irc, channel), _) = self.logOrder.popitem(last=False)
+            log = self.logs.get(irc, {}).pop(channel, None)
+            if log is None:
+                continue
+            self.pages.pop(log, None)
+            self.log.debug('Too many open logs, parking %s.', log.name)
+            self.parkLog(irc, channel, log)
+            self.logEvictions += 1
+
+    def flush(self):
+        with self.measure('flush'):
+            self.checkLogNames()
+            self.syncLogs()
+            self.eventStore.flush()
+            for log in self._logs():
+                try:
+                    log.flush()
+                except ValueError as e:
+                    if e.args[0] != 'I/O operation on a closed file':
+                        self.log.exception('Odd exception:')
+                        self.countError('flush')
 
-    def logNameTimestamp(self, channel):
-        format = self.registryValue('filenameTimestamp', channel)
-        return time.strftime(format, time.gmtime())
+    def logNameTimestamp(self, settings, now=None):
+        return time.strftime(settings.filenameTimestamp, time.gmtime(now))
 
-    def getLogName(self, channel):
-        if self.registryValue('rotateLogs', channel):
+    def getLogName(self, irc, channel, now=None):
+        settings = self.getSettings(irc, channel)
+        if settings.rotateLogs:
             return '%s_%s_%s.%s' % (file_prefix, self.channel2URL(channel),
-                                    self.logNameTimestamp(channel), file_suffix)
+                                    self.logNameTimestamp(settings, now),
+                                    file_suffix)
         else:
             return '%s_%s.%s' % (file_prefix, self.channel2URL(channel), file_suffix)
 
     def getLogDir(self, irc, channel):
         logDir = conf.supybot.directories.log.dirize(self.name())
-        if self.registryValue('networkDirectory'):
+        if self.getSettings(irc, channel).networkDirectory:
                 logDir = os.path.join(logDir,  irc.network)
         logDir = os.path.join(logDir, channel)
-        if not os.path.exists(logDir):
-            os.makedirs(logDir)
+        if logDir not in self.logDirs:
+            if not os.path.exists(logDir):
+                os.makedirs(logDir)
+            self.logDirs.add(logDir)
         return logDir
 
+    def nextNameChange(self, settings, now):
+        ''' Same as nextLogNameChange, but only computed once for all the
+            logs rotated at the same time.
+        '''
+        format = settings.filenameTimestamp
+        cached = self.nameChanges.get(format)
+        if cached is not None and cached[0] <= now < cached[1]:
+            return cached[1]
+        nextChange = nextLogNameChange(format, now)
+        if nextChange is not None:
+            self.nameChanges[format] = (now, nextChange)
+        return nextChange
+
     def checkLogNames(self):
+        ''' Closes the logs whose name changed, and schedules the next check
+            for the earliest time a remaining log has to be rotated.
+        '''
+        self.unscheduleRotation()
+        now = time.time()
+        self.rotations.clear()
         for (irc, logs) in list(self.logs.items()):
             for (channel, log) in list(logs.items()):
-                if self.registryValue('rotateLogs', channel):
-                    name = self.getLogName(channel)
-                    if name != os.path.basename(log.name):
-                        self.log.debug('Timestamp change. Close the log.')
-                        self.endLog(log)
-                        del logs[channel]
+                if self.isRotated(irc, channel, log.name, now):
+                    self.rotateLog(irc, channel, log)
+                    del logs[channel]
+                    self.logOrder.pop((irc, channel), None)
+                    self.pages.pop(log, None)
+        for ((irc, channel), path) in list(self.parkedLogs.items()):
+            if self.isRotated(irc, channel, path, now):
+                self.endParkedLog(irc, channel, rotated=True)
+        pending = [t for t in self.rotations.values() if t is not None]
+        if pending:
+            self.scheduleRotation(min(pending))
+
+    def isRotated(self, irc, channel, path, now):
+        ''' True if the log at path has to be rotated.  Otherwise, records
+            when it will have to be.
+        '''
+        settings = self.getSettings(irc, channel)
+        if not settings.rotateLogs:
+            return False
+        if self.getLogName(irc, channel, now) != \
+                splitPage(os.path.basename(path))[0]:
+            return True
+        self.rotations[(irc, channel)] = self.nextNameChange(settings, now)
+        return False
+
+    def scheduleRotation(self, when):
+        ''' Makes sure checkLogNames runs no later than when. '''
+        if self.rotationEvent is not None:
+            if self.rotationTime <= when:
+                return
+            self.unscheduleRotation()
+        self.rotationTime = when
+        self.rotationEvent = schedule.addEvent(self.checkLogNames, when)
+
+    def unscheduleRotation(self):
+        if self.rotationEvent is not None:
+            try:
+                schedule.removeEvent(self.rotationEvent)
+            except KeyError:
+                pass
+            self.rotationEvent = None
 
     def deleteOldLogs(self, irc, channel, number2keep):
+        ''' Has the old logs of a channel deleted by a maintenance thread. '''
         logDir = self.getLogDir(irc, channel)
-        logFiles = [f for f in os.listdir(logDir)
-                            if os.path.isfile(os.path.join(logDir, f))
-                               and f.startswith(file_prefix+"_")
-                               and f.endswith("."+file_suffix)]
-        logFiles.sort(reverse=True)
-        need2delete = logFiles[number2keep:]
+        self.runMaintenance(logDir, self.removeOldLogs, logDir, number2keep)
+
+    def removeOldLogs(self, logDir, number2keep):
+        ''' Deletes all but the number2keep newest logs of logDir.  Returns
+            the names of the deleted files.
+        '''
+        manifest = self.getManifest(logDir)
+        need2delete = oldLogs(manifest.snapshot(), number2keep)
+        deleted = []
         if len(need2delete) > 0:
             self.log.info('Cleaning logs in "%s".', logDir)
             self.log.info('Will keep %s logfiles.', number2keep)
-            for f in need2delete:
-                self.log.info('Deleting old logfile "%s."', f)
-                os.remove(os.path.join(logDir, f))
+            with self.measure('delete'):
+                for f in need2delete:
+                    self.log.info('Deleting old logfile "%s."', f)
+                    try:
+                        os.remove(os.path.join(logDir, f))
+                    except OSError:
+                        if os.path.exists(os.path.join(logDir, f)):
+                            raise
+                    manifest.remove(f)
+                    deleted.append(f)
+            self.forgetLogs(logDir, deleted)
+        return deleted
 
     def getLog(self, irc, channel):
-        self.checkLogNames()
         try:
             logs = self.logs[irc]
         except KeyError:
             logs = ircutils.IrcDict()
             self.logs[irc] = logs
+        key = (irc, channel)
         if channel in logs:
-            return logs[channel]
-        else:
-            try:
-                name = self.getLogName(channel)
-                logDir = self.getLogDir(irc, channel)
-                logPath = os.path.join(logDir, name)
-                if not os.path.isfile(logPath):
-                    self.startLog(logPath, channel)
-                    # Clean up old log files
-                    number2keep = self.registryValue('deleteOldLogs', channel)
-                    if number2keep > 0:
-                        self.deleteOldLogs(irc, channel, number2keep)
-                    # Generate a new index file
-                    self.generateIndex(logDir, channel)
-                else: # Remove the footer if it is there
-                    # This will not work with huge log files
-                    with open(logPath, mode='r'+bin_mode) as logFile:
-                        logFileString = logFile.read()
-                    footerString = self.getFooter()
-                    if logFileString.endswith(footerString):
-                        with open(logPath, mode='w'+bin_mode) as logFile:
-                            logFile.write(logFileString[:-len(footerString)])
-                log = open(logPath, mode='a'+bin_mode)
-                logs[channel] = log
-                return log
-            except IOError:
-                self.log.exception('Error opening log:')
-                return FakeLog()
+            # The scheduled check may not have run yet if the boundary was
+            # crossed a moment ago.
+            rotationTime = self.rotations.get(key)
+            if rotationTime is None or time.time() < rotationTime:
+                self.logHits += 1
+                if self.getSettings(irc, channel).maxOpenLogs:
+                    # Only needed to find the least recently written log.
+                    self.logOrder.move_to_end(key)
+                return logs[channel]
+            log = logs.pop(channel)
+            self.rotateLog(irc, channel, log)
+            del self.rotations[key]
+            self.logOrder.pop(key, None)
+            self.pages.pop(log, None)
+        self.logMisses += 1
+        with self.measure('open'):
+            return self.openChannelLog(irc, channel)
 
-    def timestamp(self, log):
-        format = conf.supybot.log.timestampFormat()
-        if format:
-            log.write(time.strftime(format, time.gmtime()))
-            log.write('  ')
+    def openChannelLog(self, irc, channel):
+        ''' Opens the current log of a channel, starting it if it does not
+            exist.  Returns a FakeLog if it cannot be opened.
+        '''
+        key = (irc, channel)
+        try:
+            now = time.time()
+            name = self.getLogName(irc, channel, now)
+            logDir = self.getLogDir(irc, channel)
+            # Logs are continued on their last page.
+            name = pageName(name, lastPage(logDir, name))
+            logPath = os.path.join(logDir, name)
+            parkedPath = self.parkedLogs.get(key)
+            if parkedPath == logPath:
+                # Parked logs have no footer to strip.  Anything the writer
+                # still has to write to it comes before what is written now.
+                del self.parkedLogs[key]
+                return self.openLog(irc, channel, logPath, now)
+            if parkedPath is not None:
+                self.endParkedLog(irc, channel, rotated=True)
+            if self.writer is not None and self.writer.isClosing(logPath):
+                # Its footer has to be written before it can be stripped.
+                self.writer.sync()
+            if self.compressor is not None:
+                self.compressor.cancel(logPath)
+            if os.path.exists(logPath + compressed_suffix):
+                self.reopenCompressed(logDir, name)
+            header = None
+            if not os.path.isfile(logPath):
+                header = self.startLog(logPath, channel)
+                # The old logs are cleaned up and the index rewritten in the
+                # background, while lines go to the new log.
+                settings = self.getSettings(irc, channel)
+                compressor = None
+                keepOriginal = None
+                if settings.compressLogs and self.daemon is None:
+                    compressor = self.getCompressor()
+                    keepOriginal = \
+                        self.registryValue('compressLogs.keepOriginal')
+                # The sweeps delete the old logs, if there are sweeps.
+                number2keep = settings.deleteOldLogs
+                if self.sweeper is not None:
+                    number2keep = 0
+                if settings.activityStats:
+                    # So the new index shows them.
+                    self.snapshotActivity(logDir)
+                self.startedLog(irc, channel, logDir, name, number2keep,
+                                compressor, keepOriginal)
+            elif self.daemon is None: # Remove the footer if it is there
+                self.stripFooter(logPath)
+            return self.openLog(irc, channel, logPath, now, header)
+        except IOError:
+            self.log.exception('Error opening log:')
+            self.countError('fakeLog')
+            # In case a log directory was removed.
+            self.logDirs.clear()
+            return FakeLog()
+
+    def openLog(self, irc, channel, logPath, now, header=None):
+        log = self.openFile(logPath, header)
+        self.logs[irc][channel] = log
+        self.logOrder[(irc, channel)] = None
+        settings = self.getSettings(irc, channel)
+        if settings.rotateLogs:
+            rotationTime = self.nextNameChange(settings, now)
+            self.rotations[(irc, channel)] = rotationTime
+            if rotationTime is not None:
+                self.scheduleRotation(rotationTime)
+        if settings.maxOpenLogs:
+            self.evictLogs(settings.maxOpenLogs)
+        return log
 
     def normalizeChannel(self, irc, channel):
         return ircutils.toLower(channel)
 
-    def linkify(self, message):
-        '''Enclose all URLs in the message with an href.'''
-        return url_regex.sub(r'\1<a href="\2">\2</a>\3', message)
-
     def doLog(self, irc, channel, notice, nick, s, *args):
         ''' notice: Boolean. True if message should be styled as a notice. '''
-        if not self.registryValue('enable', channel):
+        settings = self.getSettings(irc, channel)
+        if not settings.enable:
             return
-        s = format(s, *args)
+        self.logRow(irc, channel, settings, notice, nick, format(s, *args))
+
+    def logRow(self, irc, channel, settings, notice, nick, s, html=None):
+        ''' Logs the message s, or the HTML html if it is given, in which
+            case s is only used for the event store and the search index.
+        '''
         channel = self.normalizeChannel(irc, channel)
         log = self.getLog(irc, channel)
-        row_classes = row_class
-        if notice:
-            row_classes = row_class + " " + notice_class
-        log.write('<p class="%s">' % row_classes)
-        if self.registryValue('timestamp', channel):
-            log.write('<span class="%s">' % timestamp_class)
-            self.timestamp(log)
-            log.write('</span>')
-        if nick != None:
-            log.write('<span class="%s">' % nick_class)
-            log.write(html_escape("<%s> " %nick))
-            log.write('</span>')
-        if self.registryValue('stripFormatting', channel):
-            s = ircutils.stripFormatting(s)
-        log.write('<span class="%s">' % message_class)
-        log.write(self.linkify(html_escape(s)))
-        log.write('</span>')
-        log.write('</p>\n')
-        if self.registryValue('flushImmediately'):
-            log.flush()
+        if settings.timestamp:
+            timestampFormat = settings.timestampFormat
+        else:
+            timestampFormat = None
+        stats = self.stats
+        if stats is not None:
+            started = timer()
+        row = self.renderer.render(notice, nick, s, timestampFormat,
+                                   settings.stripFormatting, html=html)
+        self.writeLog(log, row, settings.flushImmediately)
+        paged = settings.pageBytes or settings.pageLines
+        if stats is not None or paged:
+            if stats is not None:
+                stats.histograms['write'].observe(timer() - started)
+            if isinstance(row, bytes):
+                size = len(row)
+            else:
+                size = len(row.encode('utf-8'))
+            if stats is not None:
+                stats.line(irc.network, channel, size)
+        fullPage = paged and self.countPage(settings, log, size)
+        if settings.activityStats and nick is not None:
+            self.countActivity(irc, channel, nick, s)
+        if settings.eventStore:
+            self.eventStore.append(self.getRelativeLogDir(irc, channel),
+                                   time.time(), notice, nick, s, html)
+        if settings.searchIndex and hasattr(log, 'name'):
+            self.getSearchIndex().add(self.getRelativeLogDir(irc, channel),
+                                      os.path.basename(log.name), nick,
+                                      stripIrcFormatting(s))
+        if fullPage:
+            self.turnPage(irc, channel, log)
+
+    def statsSummary(self):
+        stats = self.stats
+        (lines, size) = stats.totals()
+        parts = [_('%s lines, %s bytes in %s channels since %s') %
+                 (lines, size, len(stats.channels),
+                  time.strftime('%Y-%m-%d %H:%M:%S',
+                                time.gmtime(stats.started)))]
+        parts.append(_('logs: %s open, %s parked, %s hits, %s misses, '
+                       '%s evictions') %
+                     (sum(len(logs) for logs in self.logs.values()),
+                      len(self.parkedLogs), self.logHits, self.logMisses,
+                      self.logEvictions))
+        timings = []
+        for (name, description) in stats_operations:
+            histogram = stats.histograms[name]
+            if histogram.count:
+                timings.append('%s %s/%s (%s)' %
+                               (name,
+                                formatBound(histogram.percentile(0.5)),
+                                formatBound(histogram.percentile(0.99)),
+                                histogram.count))
+        if timings:
+            parts.append(_('p50/p99: %s') % ', '.join(timings))
+        sweeper = self.sweeper
+        if sweeper is not None and sweeper.lastSweep is not None:
+            parts.append(_('sweeps: %s, %s files and %s bytes deleted, the '
+                           'last one %s files and %s bytes in %.2fs') %
+                         ((sweeper.sweeps, sweeper.deleted,
+                           sweeper.reclaimed) + sweeper.lastSweep))
+        errors = ['%s %s' % (kind, count)
+                  for (kind, count) in sorted(self.errorCounts().items())
+                  if count]
+        parts.append(_('errors: %s') % (', '.join(errors) or _('none')))
+        return '; '.join(parts)
+
+    def errorCounts(self):
+        ''' Returns the errors counted here and by the background threads. '''
+        errors = dict(self.stats.errors)
+        if self.writer is not None:
+            errors['writer'] = self.writer.errors
+            errors['writerDropped'] = self.writer.dropped
+        if self.compressor is not None:
+            errors['compressor'] = self.compressor.errors
+        if self.maintenance is not None:
+            errors['maintenance'] = self.maintenance.errors
+        if self.sweeper is not None:
+            errors['sweeper'] = self.sweeper.errors
+        if self.searchIndex is not None:
+            errors['searchDropped'] = self.searchIndex.dropped
+        return errors
+
+    def writePrometheus(self):
+        ''' Writes the statistics for the Prometheus textfile collector. '''
+        if self.stats is None:
+            return
+        logRoot = conf.supybot.directories.log.dirize(self.name())
+        if not os.path.exists(logRoot):
+            os.makedirs(logRoot)
+        errors = self.errorCounts()
+        for kind in self.stats.errors:
+            del errors[kind]
+        gauges = [('open_logs', 'Open log files.',
+                   sum(len(logs) for logs in self.logs.values())),
+                  ('parked_logs', 'Log files closed by maxOpenLogs.',
+                   len(self.parkedLogs))]
+        counters = [('log_hits_total', 'Lines written to an open log.',
+                     self.logHits),
+                    ('log_misses_total', 'Logs opened.', self.logMisses),
+                    ('log_evictions_total', 'Logs closed by maxOpenLogs.',
+                     self.logEvictions)]
+        if self.sweeper is not None:
+            counters.extend([('swept_files_total',
+                              'Log files deleted by the sweeps.',
+                              self.sweeper.deleted),
+                             ('swept_bytes_total',
+                              'Bytes reclaimed by the sweeps.',
+                              self.sweeper.reclaimed)])
+            if self.sweeper.lastSweep is not None:
+                gauges.append(('last_sweep_seconds',
+                               'Duration of the last sweep.',
+                               self.sweeper.lastSweep[2]))
+        counters.extend(('%s_errors_total' % kind,
+                         'Errors counted by the %s thread.' % kind, count)
+                        for (kind, count) in sorted(errors.items()))
+        try:
+            writeAtomically(os.path.join(logRoot, 'htmllogger.prom'),
+                            prometheus(self.stats, gauges, counters))
+        except (IOError, OSError):
+            self.log.exception('Could not write the statistics:')
+            self.countError('stats')
+
+    @internationalizeDocstring
+    def logstats(self, irc, msg, args, channel):
+        """[<channel>]
+
+        Shows how much was logged, how long logging takes and the errors
+        since the plugin was loaded.  <channel> adds how much was logged in
+        <channel>; it defaults to the current channel.
+        """
+        if self.stats is None:
+            irc.error(_('Statistics are disabled.'))
+            return
+        summary = self.statsSummary()
+        if channel:
+            (lines, size) = self.stats.channels.get(
+                    (irc.network, self.normalizeChannel(irc, channel)),
+                    (0, 0))
+            summary = _('%s: %s lines, %s bytes; %s') % (channel, lines,
+                                                         size, summary)
+        irc.reply(summary)
+    logstats = commands.wrap(logstats, [commands.optional('channel')])
+
+    def logJoinPart(self, irc, channel, kind, nick, split, s, *args):
+        ''' Logs a join, part or quit, unless it is part of a burst, in which
+            case it is added to the burst's summary.  split is the pair of
+            servers of a netsplit quit, or None.
+        '''
+        settings = self.getSettings(irc, channel)
+        if not settings.enable:
+            return
+        if settings.coalesceJoinParts:
+            key = (irc, self.normalizeChannel(irc, channel))
+            burst = self.bursts.get(key)
+            if burst is None and self.isBurst(key, settings, split):
+                burst = Burst()
+                self.bursts[key] = burst
+                burst.event = schedule.addEvent(
+                        lambda: self.endBurst(key),
+                        time.time() + settings.coalesceWindow)
+            if burst is not None:
+                burst.add(kind, nick, split)
+                if burst.size >= settings.coalesceMaxNicks:
+                    self.endBurst(key)
+                return
+        self.logRow(irc, channel, settings, True, None, format(s, *args))
+
+    def isBurst(self, key, settings, split):
+        now = time.time()
+        recent = self.recentJoinParts.get(key)
+        if recent is None or recent.maxlen != settings.coalesceThreshold:
+            recent = collections.deque(maxlen=settings.coalesceThreshold)
+            self.recentJoinParts[key] = recent
+        recent.append(now)
+        return split is not None or \
+            (len(recent) == recent.maxlen and
+             now - recent[0] <= settings.coalesceWindow)
+
+    def endBurst(self, key):
+        ''' Logs the summary of a burst. '''
+        burst = self.bursts.pop(key, None)
+        if burst is None:
+            return
+        try:
+            schedule.removeEvent(burst.event)
+        except KeyError:
+            # It is the event running now.
+            pass
+        (irc, channel) = key
+        (text, html) = burst.render()
+        self.logRow(irc, channel, self.getSettings(irc, channel), True, None,
+                    text, html)
+
+    def endBursts(self):
+        for key in list(self.bursts):
+            self.endBurst(key)
 
     @internationalizeDocstring
     def flushlog(self, irc, msg, args, channel):
@@ -364,24 +2548,165 @@ class HtmlLogger(callbacks.Plugin):
         if not channel:
             irc.reply("There is no default channel here, you can add a channel name to this command...")
             return
-        if not self.registryValue('enable', channel):
+        if not self.getSettings(irc, channel).enable:
             irc.reply("The channel [{0}] is not enabled, so no nead to flush your logs...".format(channel))
             return
         channel = self.normalizeChannel(irc, channel)
         log = self.getLog(irc, channel)
+        self.syncLogs()
         log.flush()
         irc.reply("Woooosh, your log has been flushed...")
     flushlog = commands.wrap(flushlog, [commands.optional('channel')])
 
+    @internationalizeDocstring
+    def searchlog(self, irc, msg, args, channel, terms):
+        """[<channel>] <term> [<term> ...]
+
+        Searches the logs of <channel> for lines containing all the terms.
+        <channel> is only necessary if the message isn't sent in the channel
+        itself.
+        """
+        self.checkChannelPresence(irc, msg, channel)
+        if not self.getSettings(irc, channel).searchIndex:
+            irc.error(_('The logs of %s are not indexed.') % channel)
+            return
+        channel = self.normalizeChannel(irc, channel)
+        limit = self.registryValue('searchIndex.results')
+        matches = self.getSearchIndex().search(
+                self.getRelativeLogDir(irc, channel), terms, limit)
+        if not matches:
+            irc.reply(_('No matches.'))
+            return
+        logURL = self.registryValue('logURL')
+        if logURL != '': logURL = logURL + '/'
+        irc.replies(['[%s] %s%s (%s%s)' % (when, nick and '<%s> ' % nick,
+                                           text, logURL, fileName)
+                     for (when, nick, text, fileName) in matches])
+    searchlog = commands.thread(commands.wrap(searchlog,
+                                              ['channel',
+                                               commands.many('something')]))
+
+    def checkChannelPresence(self, irc, msg, channel):
+        ''' Errors out unless the sender of msg is in channel, so only the
+            members of a secret channel read its logs.
+        '''
+        if channel not in irc.state.channels:
+            irc.error(_("I'm not in %s.") % channel, Raise=True)
+        if msg.nick not in irc.state.channels[channel].users:
+            irc.error(_('You must be in %s to use this command.') % channel,
+                      Raise=True)
+
+    def readLogs(self, irc, channel, read):
+        ''' Has read(logDir, deadline) called from a thread of its own,
+            once the logs of channel are written.  It returns the replies.
+        '''
+        channel = self.normalizeChannel(irc, channel)
+        self.syncLogs()
+        log = self.logs.get(irc, {}).get(channel)
+        if log is not None and self.writer is None:
+            log.flush()
+        logDir = self.getLogDir(irc, channel)
+        deadline = time.time() + self.registryValue('readTimeout')
+        def run():
+            try:
+                irc.replies(read(logDir, deadline))
+            except Exception:
+                self.log.exception('Error reading the logs of %s:', channel)
+                irc.error(_('The logs could not be read.'))
+        thread = threading.Thread(target=run, name='HtmlLogger reader')
+        thread.daemon = True
+        thread.start()
+
+    def formatRows(self, rows):
+        logURL = self.registryValue('logURL')
+        if logURL != '': logURL = logURL + '/'
+        return ['[%s] %s%s (%s%s)' % (when, nick and '<%s> ' % nick, text,
+                                      logURL, fileName)
+                for (fileName, (when, nick, text)) in rows]
+
+    @internationalizeDocstring
+    def lastlog(self, irc, msg, args, channel, count):
+        """[<channel>] [<number>]
+
+        Returns the last <number> lines logged in <channel>, or as many as
+        the readResults setting.  <channel> is only necessary if the message
+        isn't sent in the channel itself.
+        """
+        self.checkChannelPresence(irc, msg, channel)
+        if not self.getSettings(irc, channel).enable:
+            irc.error(_('%s is not logged.') % channel)
+            return
+        limit = self.registryValue('readResults')
+        count = min(count or limit, limit)
+        def read(logDir, deadline):
+            (rows, done) = lastRows(logFiles(logDir), count, deadline)
+            if not rows:
+                return [_('Nothing logged.')]
+            rows.reverse()
+            replies = self.formatRows(rows)
+            if not done:
+                replies.append(_('Stopped reading after %s seconds.') %
+                               self.registryValue('readTimeout'))
+            return replies
+        self.readLogs(irc, channel, read)
+    lastlog = commands.wrap(lastlog, ['channel',
+                                      commands.optional('positiveInt')])
+
+    @internationalizeDocstring
+    def greplog(self, irc, msg, args, channel, opts, regexp):
+        """[<channel>] [--days <days>] <regexp>
+
+        Returns the last lines logged in <channel> matching the regular
+        expression <regexp>, as many as the readResults setting, from the
+        logs written in the last <days> days (default: 1).  <channel> is
+        only necessary if the message isn't sent in the channel itself.
+        """
+        self.checkChannelPresence(irc, msg, channel)
+        if not self.getSettings(irc, channel).enable:
+            irc.error(_('%s is not logged.') % channel)
+            return
+        try:
+            regexp = re.compile(regexp, re.I)
+        except re.error as e:
+            irc.errorInvalid(_('regular expression'), regexp, str(e))
+            return
+        days = dict(opts).get('days', 1)
+        limit = self.registryValue('readResults')
+        threads = self.registryValue('readThreads')
+        def read(logDir, deadline):
+            logs = logFiles(logDir, time.time() - days * 86400)
+            try:
+                # In a process of its own, killed if the regexp takes too
+                # long between two checks of the deadline.
+                (rows, searched, done) = commands.process(
+                        grepRows, logs, regexp, limit, deadline, threads,
+                        timeout=max(0, deadline - time.time()) + 1,
+                        pn=self.name(), cn='greplog')
+            except commands.ProcessTimeoutError:
+                (rows, searched, done) = ([], 0, False)
+            replies = self.formatRows(rows) or [_('No matches.')]
+            if not done:
+                replies.append(_('Stopped after %s seconds, %s of %s logs '
+                                 'searched.') %
+                               (self.registryValue('readTimeout'), searched,
+                                len(logs)))
+            return replies
+        self.readLogs(irc, channel, read)
+    greplog = commands.wrap(greplog, ['channel',
+                                      commands.getopts({'days':
+                                                        'positiveInt'}),
+                                      'text'])
+
 
     def doPrivmsg(self, irc, msg):
         (recipients, text) = msg.args
         for channel in recipients.split(','):
             if irc.isChannel(channel):
-                noLogPrefix = self.registryValue('noLogPrefix', channel)
-                cap = ircdb.makeChannelCapability(channel, 'logChannelMessages')
+                settings = self.getSettings(irc, channel)
+                noLogPrefix = settings.noLogPrefix
                 try:
-                    logChannelMessages = ircdb.checkCapability(msg.prefix, cap,
+                    logChannelMessages = ircdb.checkCapability(msg.prefix,
+                        settings.logCapability,
                         ignoreOwner=True)
                 except KeyError:
                     logChannelMessages = True
@@ -408,16 +2733,15 @@ class HtmlLogger(callbacks.Plugin):
     def doNick(self, irc, msg):
         oldNick = msg.nick
         newNick = msg.args[0]
-        for (channel, c) in irc.state.channels.items():
-            if newNick in c.users:
-                self.doLog(irc, channel, True, None,
-                           '*** %s is now known as %s', oldNick, newNick)
+        for channel in self.getMembership(irc).channelsOf(oldNick):
+            self.doLog(irc, channel, True, None,
+                       '*** %s is now known as %s', oldNick, newNick)
     def doJoin(self, irc, msg):
         for channel in msg.args[0].split(','):
-            if(self.registryValue('showJoinParts', channel)):
-                self.doLog(irc, channel, True, None,
-                           '*** %s <%s> has joined %s',
-                           msg.nick, msg.prefix, channel)
+            if self.getSettings(irc, channel).showJoinParts:
+                self.logJoinPart(irc, channel, 'join', msg.nick, None,
+                                 '*** %s <%s> has joined %s',
+                                 msg.nick, msg.prefix, channel)
 
     def doKick(self, irc, msg):
         if len(msg.args) == 3:
@@ -439,10 +2763,10 @@ class HtmlLogger(callbacks.Plugin):
         else:
             reason = ""
         for channel in msg.args[0].split(','):
-            if(self.registryValue('showJoinParts', channel)):
-                self.doLog(irc, channel, True, None,
-                           '*** %s <%s> has left %s%s',
-                           msg.nick, msg.prefix, channel, reason)
+            if self.getSettings(irc, channel).showJoinParts:
+                self.logJoinPart(irc, channel, 'part', msg.nick, None,
+                                 '*** %s <%s> has left %s%s',
+                                 msg.nick, msg.prefix, channel, reason)
 
     def doMode(self, irc, msg):
         channel = msg.args[0]
@@ -460,18 +2784,19 @@ class HtmlLogger(callbacks.Plugin):
                    '*** %s changes topic to "%s"', msg.nick, msg.args[1])
 
     def doQuit(self, irc, msg):
+        split = None
         if len(msg.args) == 1:
             reason = " (%s)" % msg.args[0]
+            match = netsplit_regex.match(msg.args[0])
+            if match is not None:
+                split = match.groups()
         else:
             reason = ""
-        if not isinstance(irc, irclib.Irc):
-            irc = irc.getRealIrc()
-        for (channel, chan) in self.lastStates[irc].channels.items():
-            if(self.registryValue('showJoinParts', channel)):
-                if msg.nick in chan.users:
-                    self.doLog(irc, channel, True, None,
-                               '*** %s <%s> has quit IRC%s',
-                               msg.nick, msg.prefix, reason)
+        for channel in self.getMembership(irc).channelsOf(msg.nick):
+            if self.getSettings(irc, channel).showJoinParts:
+                self.logJoinPart(irc, channel, 'quit', msg.nick, split,
+                                 '*** %s <%s> has quit IRC%s',
+                                 msg.nick, msg.prefix, reason)
 
     def outFilter(self, irc, msg):
         # Gotta catch my own messages *somehow* :)
@@ -0,0 +1,188 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Reads the rows of the HTML logs from their end, for the lastlog and greplog
+commands.
+
+Plain logs are mapped in memory and walked backwards a line at a time, so
+only the end of a big log is read when the last rows are all that is needed.
+Only the row lines are parsed.
+'''
+
+import os
+import re
+import gzip
+import mmap
+import time
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+from .search import parseRow, tag_regex, html_unescape
+
+log_regex = re.compile(r'^log_.*\.html(?:\.gz)?$')
+row_start = b'<p class="style-row'
+msg_start = b'<span class="style-msg">'
+msg_end = b'</span></p>'
+# The time budget is checked every this many lines.
+check_every = 1000
+
+def logFiles(logDir, since=None):
+    ''' Returns the logs of logDir, compressed or not, last written first.
+        If since is given, only the logs written since then.
+    '''
+    logs = []
+    names = set(os.listdir(logDir))
+    for name in names:
+        if not log_regex.match(name):
+            continue
+        if name.endswith('.gz') and name[:-3] in names:
+            # A compressed copy, while compressLogs.keepOriginal keeps the
+            # original.
+            continue
+        path = os.path.join(logDir, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            # Deleted or compressed meanwhile.
+            continue
+        if since is None or mtime >= since:
+            logs.append((mtime, name, path))
+    logs.sort(reverse=True)
+    return [(name, path) for (mtime, name, path) in logs]
+
+def reverseRows(path):
+    ''' Yields the row lines of the log at path, as bytes, last first. '''
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as logFile:
+            data = logFile.read()
+        mapped = None
+    else:
+        with open(path, 'rb') as logFile:
+            try:
+                data = mapped = mmap.mmap(logFile.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty.
+                return
+    try:
+        end = len(data)
+        while end > 0:
+            start = data.rfind(b'\n', 0, end - 1) + 1
+            if data[start:start + len(row_start)] == row_start:
+                yield data[start:end]
+            end = start
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+def decodeRow(line):
+    return parseRow(line.decode('utf-8', 'replace'))
+
+def rowText(line):
+    ''' Returns the text of a row line, like parseRow but cheaper. '''
+    start = line.find(msg_start)
+    if start < 0:
+        return None
+    text = line[start + len(msg_start):line.rfind(msg_end)].decode('utf-8',
+                                                                   'replace')
+    if '<' in text:
+        text = tag_regex.sub('', text)
+    if '&' in text:
+        text = html_unescape(text)
+    return text
+
+def lastRows(logs, count, deadline):
+    ''' Returns ([(log name, (stamp, nick, text))], done) for the last count
+        rows of logs, last first.  done is False if the rows could not all
+        be read before the deadline.
+    '''
+    rows = []
+    lines = 0
+    for (name, path) in logs:
+        for line in reverseRows(path):
+            row = decodeRow(line)
+            if row is not None:
+                rows.append((name, row))
+                if len(rows) >= count:
+                    return (rows, True)
+            lines += 1
+            if lines % check_every == 0 and time.time() > deadline:
+                return (rows, False)
+    return (rows, True)
+
+def grepLog(task):
+    ''' Returns ([(stamp, nick, text)], done) for the last rows of a log
+        whose text matches regex, up to limit.
+    '''
+    (path, regex, limit, deadline, stop) = task
+    matches = []
+    lines = 0
+    for line in reverseRows(path):
+        lines += 1
+        if lines % check_every == 0 and \
+                (stop.is_set() or time.time() > deadline):
+            return (matches, False)
+        text = rowText(line)
+        if text is None or not regex.search(text):
+            continue
+        row = decodeRow(line)
+        if row is not None:
+            matches.append(row)
+            if len(matches) >= limit:
+                break
+    return (matches, True)
+
+def grepRows(logs, regex, limit, deadline, threads):
+    ''' Returns ([(log name, (stamp, nick, text))], logs searched, done) for
+        the last rows of logs whose text matches regex, up to limit, last
+        first.  Logs are searched threads at a time; the newer ones come
+        first.
+    '''
+    stop = threading.Event()
+    pool = ThreadPool(threads)
+    matches = []
+    searched = 0
+    done = True
+    try:
+        results = pool.imap(grepLog, [(path, regex, limit, deadline, stop)
+                                      for (name, path) in logs])
+        for ((name, path), (rows, finished)) in zip(logs, results):
+            if not finished:
+                done = False
+                break
+            searched += 1
+            matches.extend((name, row) for row in rows)
+            if len(matches) >= limit:
+                break
+    finally:
+        stop.set()
+        pool.terminate()
+    return (matches[:limit], searched, done)
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
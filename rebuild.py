@@ -0,0 +1,273 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Regenerates the HTML logs and index pages from the event store.
+
+Run it as a module from the bot's plugin directory:
+
+    python -m HtmlLogger.rebuild <events directory> <log directory>
+
+where <events directory> is data/HtmlLogger/events in the bot's directory,
+and <log directory> is where the HTML logs are written, usually
+logs/HtmlLogger.  Channels and days are rendered in parallel by a pool of
+processes.  Existing logs are replaced.
+'''
+
+import os
+import sys
+import time
+import calendar
+import argparse
+import multiprocessing
+
+from io import open
+
+from .events import readEvents
+from .manifest import writeAtomically
+from .compress import compressed_suffix
+from .plugin import LineRenderer, channel2URL, writeIndexPages, pageName, \
+                    pageLink, plugin_dir, file_prefix, file_suffix
+
+def logName(channel, when, options):
+    if not options.rotateLogs:
+        return '%s_%s.%s' % (file_prefix, channel2URL(channel), file_suffix)
+    return '%s_%s_%s.%s' % (file_prefix, channel2URL(channel),
+                            time.strftime(options.filenameTimestamp,
+                                          time.gmtime(when)),
+                            file_suffix)
+
+def dayOf(fileName):
+    return calendar.timegm(time.strptime(fileName, '%Y-%m-%d.jsonl')) // 86400
+
+def groupDays(channel, dayFiles, options):
+    ''' Splits the sorted day files of a channel into groups that produce
+        distinct HTML logs, so groups can be rendered independently.
+    '''
+    groups = []
+    lastName = None
+    for dayFile in dayFiles:
+        start = dayOf(dayFile) * 86400
+        if groups and logName(channel, start, options) == lastName:
+            groups[-1].append(dayFile)
+        else:
+            groups.append([dayFile])
+        lastName = logName(channel, start + 86399, options)
+    return groups
+
+def paginate(rows, options):
+    ''' Splits the rows of a log into pages, like the pageBytes and
+        pageLines settings.
+    '''
+    pages = [[]]
+    size = 0
+    for row in rows:
+        pages[-1].append(row)
+        size += len(row.encode('utf-8'))
+        if (options.pageBytes and size >= options.pageBytes) or \
+           (options.pageLines and len(pages[-1]) >= options.pageLines):
+            pages.append([])
+            size = 0
+    if len(pages) > 1 and not pages[-1]:
+        pages.pop()
+    return pages
+
+def renderGroup(task):
+    ''' Renders the HTML logs of consecutive days of a channel.  Returns the
+        number of events and the names of the written logs, without their
+        pages.
+    '''
+    (logDir, dayFiles, options) = task
+    channel = os.path.basename(logDir)
+    renderer = LineRenderer()
+    logs = {}
+    order = []
+    count = 0
+    for dayFile in dayFiles:
+        for (when, notice, nick, text, html) in readEvents(
+                os.path.join(options.eventsDir, logDir, dayFile)):
+            name = logName(channel, when, options)
+            if name not in logs:
+                logs[name] = []
+                order.append(name)
+            logs[name].append(renderer.render(notice, nick, text,
+                                              options.timestampFormat,
+                                              options.stripFormatting, when,
+                                              html))
+            count += 1
+    outDir = os.path.join(options.logRoot, logDir)
+    if order and not os.path.exists(outDir):
+        try:
+            os.makedirs(outDir)
+        except OSError:
+            # Created by another worker meanwhile.
+            pass
+    for name in order:
+        pages = paginate(logs[name], options)
+        for (index, rows) in enumerate(pages):
+            page = [options.header, "<h2>Daily Log for %s</h2>\n" %(channel)]
+            if index:
+                page.append(pageLink(pageName(name, index), 'Previous page'))
+            page.extend(rows)
+            if index + 1 < len(pages):
+                page.append(pageLink(pageName(name, index + 2), 'Next page'))
+            page.append(options.footer)
+            writeAtomically(os.path.join(outDir, pageName(name, index + 1)),
+                            ''.join(page))
+        # Drop the pages an earlier run wrote past the new last one.
+        extra = len(pages) + 1
+        while True:
+            removed = False
+            for path in (os.path.join(outDir, pageName(name, extra)),
+                         os.path.join(outDir, pageName(name, extra)) +
+                         compressed_suffix):
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed = True
+            if not removed:
+                break
+            extra += 1
+    return (count, order)
+
+def readTemplate(path, default):
+    with open(path or os.path.join(plugin_dir, default),
+              encoding='utf-8') as templateFile:
+        return templateFile.read()
+
+def findChannels(eventsDir):
+    ''' Returns {log directory: sorted day files} for every directory of
+        eventsDir holding day files.
+    '''
+    channels = {}
+    for (directory, dirs, files) in os.walk(eventsDir):
+        dayFiles = sorted(f for f in files if f.endswith('.jsonl'))
+        if dayFiles:
+            channels[os.path.relpath(directory, eventsDir)] = dayFiles
+    return channels
+
+def rebuild(options, out=sys.stdout):
+    started = time.time()
+    channels = findChannels(options.eventsDir)
+    tasks = []
+    for (logDir, dayFiles) in sorted(channels.items()):
+        channel = os.path.basename(logDir)
+        for group in groupDays(channel, dayFiles, options):
+            tasks.append((logDir, group, options))
+    # The longest tasks first, so no worker is left with one at the end.
+    tasks.sort(key=lambda task: -len(task[1]))
+    events = 0
+    written = {}
+    if options.processes == 1:
+        results = map(renderGroup, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(options.processes)
+        results = pool.imap_unordered(renderGroup, tasks)
+    for (count, names) in results:
+        events += count
+    if pool is not None:
+        pool.close()
+        pool.join()
+    for logDir in channels:
+        outDir = os.path.join(options.logRoot, logDir)
+        if not os.path.exists(outDir):
+            continue
+        logFiles = [f for f in os.listdir(outDir)
+                      if f.startswith(file_prefix+"_")
+                         and f.endswith("."+file_suffix)]
+        written[logDir] = len(logFiles)
+        writeIndexPages(outDir, os.path.basename(logDir), logFiles,
+                        options.logURL, options.filenameTimestamp,
+                        options.shardIndex, options.indexHeader,
+                        options.indexFooter)
+    elapsed = time.time() - started
+    out.write('Rendered %s events of %s channels into %s logs in %.1f '
+              'seconds (%.0f events/sec).\n' %
+              (events, len(channels), sum(written.values()), elapsed,
+               events / elapsed if elapsed else 0))
+    return events
+
+def parseOptions(args=None):
+    parser = argparse.ArgumentParser(
+            description='Regenerate HtmlLogger logs from the event store.')
+    parser.add_argument('eventsDir', help='the event store directory')
+    parser.add_argument('logRoot', help='where the HTML logs are written')
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--no-rotate', dest='rotateLogs',
+                        action='store_false',
+                        help='write one log per channel, like rotateLogs '
+                             'False')
+    parser.add_argument('--filename-timestamp', dest='filenameTimestamp',
+                        default='%Y-%m-%d',
+                        help='the filenameTimestamp of the rotated logs')
+    parser.add_argument('--timestamp-format', dest='timestampFormat',
+                        default='%Y-%m-%dT%H:%M:%S',
+                        help='the supybot.log.timestampFormat of the rows')
+    parser.add_argument('--no-timestamp', dest='timestampFormat',
+                        action='store_const', const=None,
+                        help='do not timestamp the rows')
+    parser.add_argument('--keep-formatting', dest='stripFormatting',
+                        action='store_false',
+                        help='do not strip IRC formatting characters')
+    parser.add_argument('--page-bytes', dest='pageBytes', type=int, default=0,
+                        help='split the logs into pages of this many bytes, '
+                             'like pageBytes')
+    parser.add_argument('--page-lines', dest='pageLines', type=int,
+                        default=0,
+                        help='split the logs into pages of this many lines, '
+                             'like pageLines')
+    parser.add_argument('--flat-index', dest='shardIndex',
+                        action='store_false',
+                        help='write one index page per channel, like '
+                             'shardIndex False')
+    parser.add_argument('--log-url', dest='logURL', default='',
+                        help='the logURL used in the index pages')
+    for (name, default) in (('header', 'header.html'),
+                            ('footer', 'footer.html'),
+                            ('indexHeader', 'header.html'),
+                            ('indexFooter', 'footer.html')):
+        parser.add_argument('--%s' % name.lower().replace('index', 'index-'),
+                            dest=name, default='',
+                            help='the %s template, instead of %s' %
+                                 (name, default))
+    options = parser.parse_args(args)
+    for (name, default) in (('header', 'header.html'),
+                            ('footer', 'footer.html'),
+                            ('indexHeader', 'header.html'),
+                            ('indexFooter', 'footer.html')):
+        setattr(options, name, readTemplate(getattr(options, name), default))
+    return options
+
+def main():
+    rebuild(parseOptions())
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
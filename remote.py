@@ -0,0 +1,174 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Client side of the shared writer daemon, see daemon.py.
+'''
+
+import json
+import select
+import socket
+import struct
+
+header_format = struct.Struct('>I')
+# Bytes buffered before they are sent without waiting for flush().
+max_buffer = 65536
+# Seconds a send or a sync waits for the daemon before it is given up.
+timeout = 10
+
+def frame(message):
+    data = json.dumps(message, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+    return header_format.pack(len(data)) + data
+
+class DaemonClient(object):
+    ''' Connection of a bot to the writer daemon.
+
+        Messages are buffered, and sent by flush(), or by full() once
+        max_buffer bytes are waiting.  Once sending failed, every flush()
+        fails, and pending holds the messages the daemon did not get
+        completely, to be written another way.
+
+        The daemon tells which logs it deleted for this client, which sync()
+        and poll() collect in deleted.
+    '''
+    def __init__(self, path, full=None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        try:
+            self.socket.connect(path)
+        except:
+            self.socket.close()
+            raise
+        self.path = path
+        self.full = full
+        self.pending = []
+        self.size = 0
+        self.failed = False
+        self.received = b''
+        self.syncs = 0
+        self.synced = 0
+        # (log directory, names of the deleted logs)
+        self.deleted = []
+
+    def send(self, *message):
+        self.pending.append(message)
+        if message[0] == 'write':
+            self.size += len(message[2])
+        else:
+            self.size += 100
+        if self.size >= max_buffer and not self.failed and \
+                self.full is not None:
+            self.full()
+
+    def flush(self):
+        if self.failed:
+            raise IOError('The connection to the writer daemon failed.')
+        if not self.pending:
+            return
+        frames = [frame(message) for message in self.pending]
+        data = memoryview(b''.join(frames))
+        sent = 0
+        try:
+            while sent < len(data):
+                sent += self.socket.send(data[sent:])
+        except:
+            self.failed = True
+            # A frame sent in part is dropped by the daemon.
+            for (count, sentFrame) in enumerate(frames):
+                sent -= len(sentFrame)
+                if sent < 0:
+                    break
+            del self.pending[:count]
+            raise
+        self.pending = []
+        self.size = 0
+
+    def sync(self):
+        ''' Waits until the daemon wrote everything sent before. '''
+        self.send('sync')
+        self.flush()
+        self.syncs += 1
+        while self.synced < self.syncs:
+            self.receive()
+
+    def poll(self):
+        ''' Reads what the daemon sent, without waiting, and returns the
+            logs it deleted since the last call.
+        '''
+        while not self.failed and \
+                select.select([self.socket], [], [], 0)[0]:
+            self.receive()
+        (deleted, self.deleted) = (self.deleted, [])
+        return deleted
+
+    def receive(self):
+        ''' Reads the messages of the daemon, waiting for some data. '''
+        try:
+            data = self.socket.recv(max_buffer)
+        except:
+            self.failed = True
+            raise
+        if not data:
+            self.failed = True
+            raise IOError('The writer daemon closed the connection.')
+        self.received += data
+        while len(self.received) >= header_format.size:
+            (size,) = header_format.unpack(
+                    self.received[:header_format.size])
+            end = header_format.size + size
+            if len(self.received) < end:
+                break
+            message = json.loads(
+                    self.received[header_format.size:end].decode('utf-8'))
+            self.received = self.received[end:]
+            if message[0] == 'synced':
+                self.synced += 1
+            elif message[0] == 'deleted':
+                self.deleted.append((message[1], message[2]))
+
+    def close(self):
+        self.socket.close()
+
+class RemoteLog(object):
+    ''' Stands for a log file written by the daemon. '''
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def write(self, text):
+        self.client.send('write', self.name, text)
+
+    def flush(self):
+        # The daemon flushes the logs on its own.
+        pass
+
+    def close(self, text=''):
+        ''' Closes the log after text, which is usually the footer. '''
+        self.client.send('close', self.name, text)
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,311 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Full-text index of the logged lines, kept in SQLite.
+
+The plugin adds lines to it as they are logged.  Existing logs can be added
+with the backfill tool:
+
+    python search.py <log directory> <database> [--timestamp-format FORMAT]
+
+where <log directory> is the HtmlLogger directory in the bot's log
+directory, and <database> is data/HtmlLogger/search.sqlite in the bot's
+directory.  Backfill before enabling searchIndex, or the lines of the
+current logs will be indexed twice.
+'''
+
+import os
+import re
+import sys
+import gzip
+import time
+import logging
+import sqlite3
+import calendar
+import argparse
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from html import unescape as html_unescape
+except ImportError:
+    from HTMLParser import HTMLParser
+    html_unescape = HTMLParser().unescape
+
+log = logging.getLogger('supybot')
+
+# Lines waiting to be indexed; any more are dropped and counted.
+queue_size = 100000
+# Upper bound on the number of lines inserted in one transaction.
+max_batch = 5000
+
+timestamp_format = '%Y-%m-%d %H:%M:%S'
+
+row_regex = re.compile(r'<p class="style-row[^"]*">'
+                       r'(?:<span class="style-tz">(.*?)</span>)?'
+                       r'(?:<span class="style-nick">(.*?)</span>)?'
+                       r'<span class="style-msg">(.*?)</span></p>')
+tag_regex = re.compile(r'<[^>]*>')
+
+def connect(path):
+    ''' Opens the index, creating it if needed.  Uses FTS5 if SQLite has it,
+        FTS4 otherwise.
+    '''
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute('PRAGMA journal_mode=WAL')
+    exists = db.execute("SELECT 1 FROM sqlite_master WHERE name='lines'")
+    if exists.fetchone() is None:
+        columns = 'text, nick, dir UNINDEXED, file UNINDEXED, time UNINDEXED'
+        try:
+            db.execute('CREATE VIRTUAL TABLE lines USING fts5(%s)' % columns)
+        except sqlite3.OperationalError:
+            # FTS4 has no UNINDEXED, so every column is indexed.
+            db.execute('CREATE VIRTUAL TABLE lines USING fts4'
+                       '(text, nick, dir, file, time)')
+        db.commit()
+    return db
+
+def isFts5(db):
+    sql = db.execute("SELECT sql FROM sqlite_master WHERE name='lines'")
+    return 'fts5' in sql.fetchone()[0].lower()
+
+def makeQuery(terms):
+    ''' Quotes every term, so user input cannot be an FTS syntax error. '''
+    return ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+
+def search(db, logDir, terms, limit):
+    ''' Returns the best (time, nick, text, file) matches in logDir. '''
+    if isFts5(db):
+        order = 'rank'
+    else:
+        order = 'time DESC'
+    cursor = db.execute('SELECT time, nick, text, file FROM lines '
+                        'WHERE lines MATCH ? AND dir = ? '
+                        'ORDER BY %s LIMIT ?' % order,
+                        (makeQuery(terms), logDir, limit))
+    return cursor.fetchall()
+
+class SearchIndex(object):
+    ''' Adds lines to the index from a thread of its own, in batches, so
+        logging a line only costs putting it in a queue.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.db = connect(path)
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(queue_size)
+        self.indexed = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run,
+                                       name='HtmlLogger search index')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, logDir, fileName, nick, text, when=None):
+        if when is None:
+            when = time.time()
+        row = (text, nick or '', logDir, fileName, when)
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def forget(self, logDir, fileName):
+        ''' Has the lines of the log fileName of logDir, which was deleted,
+            taken off the index, after the lines added before.
+        '''
+        self.queue.put(Forget(logDir, fileName))
+
+    def search(self, logDir, terms, limit):
+        with self.lock:
+            return search(self.db, logDir, terms, limit)
+
+    def sync(self):
+        ''' Waits until every line added so far is indexed. '''
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.db.close()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = []
+            for item in batch + [None]:
+                if isinstance(item, tuple):
+                    rows.append(item[:4] + (time.strftime(
+                            timestamp_format, time.gmtime(item[4])),))
+                    continue
+                if rows:
+                    self.insert(rows)
+                    rows = []
+                if isinstance(item, Forget):
+                    self.delete(item)
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in batch:
+                return
+
+    def insert(self, rows):
+        try:
+            with self.lock:
+                self.db.executemany('INSERT INTO lines (text, nick, dir, '
+                                    'file, time) VALUES (?, ?, ?, ?, ?)', rows)
+                self.db.commit()
+            self.indexed += len(rows)
+        except sqlite3.Error:
+            log.exception('HtmlLogger could not index %s lines:', len(rows))
+
+    def delete(self, forget):
+        try:
+            with self.lock:
+                self.db.execute('DELETE FROM lines WHERE dir = ? AND file = ?',
+                                (forget.logDir, forget.fileName))
+                self.db.commit()
+        except sqlite3.Error:
+            log.exception('HtmlLogger could not take %s off the index:',
+                          forget.fileName)
+
+class Forget(object):
+    ''' Queued to take the lines of a deleted log off the index. '''
+    def __init__(self, logDir, fileName):
+        self.logDir = logDir
+        self.fileName = fileName
+
+def parseRow(line):
+    ''' Returns (timestamp, nick, text) of a row of an HTML log, as text, or
+        None if line is not a row.  timestamp and nick are None if the row
+        has none.
+    '''
+    match = row_regex.match(line)
+    if match is None:
+        return None
+    (stamp, nick, text) = match.groups()
+    if nick:
+        nick = html_unescape(nick).strip()[1:-1]
+    text = html_unescape(tag_regex.sub('', text))
+    return (stamp and stamp.strip(), nick, text)
+
+def parseLog(path, timestampFormat):
+    ''' Yields (nick, text, time) for every row of an HTML log, compressed
+        or not.  time is None when the timestamp cannot be parsed with
+        timestampFormat.
+    '''
+    if path.endswith('.gz'):
+        opener = gzip.open
+    else:
+        opener = open
+    with opener(path, 'rb') as logFile:
+        for line in logFile:
+            row = parseRow(line.decode('utf-8', 'replace'))
+            if row is None:
+                continue
+            (stamp, nick, text) = row
+            when = None
+            if stamp:
+                try:
+                    when = calendar.timegm(time.strptime(stamp,
+                                                         timestampFormat))
+                except (ValueError, OverflowError):
+                    pass
+            yield (nick, text, when)
+
+def backfill(logRoot, dbPath, timestampFormat, out=sys.stdout):
+    ''' Indexes every log_*.html below logRoot, and every log_*.html.gz
+        written by compressLogs, under the name of its original, unless the
+        original is still there.  Files that were backfilled before are
+        indexed again from scratch.
+    '''
+    db = connect(dbPath)
+    started = time.time()
+    total = 0
+    for (directory, dirs, files) in os.walk(logRoot):
+        dirs.sort()
+        logDir = os.path.relpath(directory, logRoot)
+        names = set(files)
+        for fileName in sorted(files):
+            if not (fileName.startswith('log_') and
+                    fileName.endswith(('.html', '.html.gz'))):
+                continue
+            path = os.path.join(directory, fileName)
+            if fileName.endswith('.gz'):
+                fileName = fileName[:-len('.gz')]
+                if fileName in names:
+                    # Kept by compressLogs.keepOriginal, and read instead.
+                    continue
+            mtime = os.stat(path).st_mtime
+            rows = [(text, nick or '', logDir, fileName,
+                     time.strftime(timestamp_format,
+                                   time.gmtime(when or mtime)))
+                    for (nick, text, when) in parseLog(path, timestampFormat)]
+            db.execute('DELETE FROM lines WHERE dir = ? AND file = ?',
+                       (logDir, fileName))
+            db.executemany('INSERT INTO lines (text, nick, dir, file, time) '
+                           'VALUES (?, ?, ?, ?, ?)', rows)
+            db.commit()
+            total += len(rows)
+            out.write('%s: %s lines\n' % (os.path.join(logDir, fileName),
+                                          len(rows)))
+    elapsed = time.time() - started
+    out.write('Indexed %s lines in %.1f seconds.\n' % (total, elapsed))
+    db.close()
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Add existing HtmlLogger logs to the search index.')
+    parser.add_argument('logRoot', help='the HtmlLogger log directory')
+    parser.add_argument('database', help='the search index to fill')
+    parser.add_argument('--timestamp-format', dest='timestampFormat',
+                        default='%Y-%m-%dT%H:%M:%S',
+                        help='the supybot.log.timestampFormat the logs were '
+                             'written with')
+    options = parser.parse_args()
+    backfill(options.logRoot, options.database, options.timestampFormat)
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,181 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Counters and latency histograms of the plugin, with their rendering in the
+Prometheus text format.
+'''
+
+import time
+import bisect
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Upper bounds of the histogram buckets, in seconds.
+buckets = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1,
+           0.5, 1.0, 5.0)
+
+# The operations timed, with what they cover.
+operations = (
+    ('write', 'rendering and writing a line'),
+    ('open', 'opening a log, with the header of a new log'),
+    ('rotate', 'closing logs whose name changed'),
+    ('index', 'generating an index page, in a maintenance thread'),
+    ('delete', 'deleting old logs, in a maintenance thread'),
+    ('flush', 'flushing the logs'),
+    ('commit', 'committing the logs, with durability'),
+)
+
+class Histogram(object):
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        # One more bucket than bounds, for what is above the last one.
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def percentile(self, fraction):
+        ''' Returns the upper bound of the bucket holding the given fraction
+            of the observations, or None if there are none.
+        '''
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for (bound, count) in zip(buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+class Timed(object):
+    ''' Context manager adding the time spent in it to a histogram. '''
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = timer()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(timer() - self.started)
+
+class NotTimed(object):
+    ''' Stands for Timed when statistics are disabled. '''
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+not_timed = NotTimed()
+
+class Stats(object):
+    ''' Counters of the plugin.  Only updated from the bot thread, but for
+        the index and delete timings, which the maintenance threads add to.
+    '''
+    def __init__(self):
+        self.started = time.time()
+        # (network, channel) -> [lines, bytes]
+        self.channels = {}
+        self.histograms = dict((name, Histogram())
+                               for (name, description) in operations)
+        # kind -> count
+        self.errors = {}
+
+    def line(self, network, channel, size):
+        counters = self.channels.get((network, channel))
+        if counters is None:
+            counters = [0, 0]
+            self.channels[(network, channel)] = counters
+        counters[0] += 1
+        counters[1] += size
+
+    def timed(self, name):
+        return Timed(self.histograms[name])
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def totals(self):
+        lines = sum(counters[0] for counters in self.channels.values())
+        size = sum(counters[1] for counters in self.channels.values())
+        return (lines, size)
+
+def escapeLabel(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+                .replace('\n', '\\n')
+
+def prometheus(stats, gauges, counters):
+    ''' Returns the statistics in the Prometheus text format.  gauges and
+        counters are (name, help, value) of other values to include.
+    '''
+    lines = []
+    def metric(name, kind, help):
+        lines.append('# HELP htmllogger_%s %s' % (name, help))
+        lines.append('# TYPE htmllogger_%s %s' % (name, kind))
+    for (name, index, help) in (('lines_total', 0, 'Lines logged.'),
+                                ('bytes_total', 1, 'Bytes of HTML logged.')):
+        metric(name, 'counter', help)
+        for ((network, channel), values) in sorted(stats.channels.items()):
+            lines.append('htmllogger_%s{network="%s",channel="%s"} %s' %
+                         (name, escapeLabel(network), escapeLabel(channel),
+                          values[index]))
+    for (name, description) in operations:
+        histogram = stats.histograms[name]
+        metric('%s_seconds' % name, 'histogram',
+               'Time spent %s.' % description)
+        seen = 0
+        for (bound, count) in zip(buckets, histogram.counts):
+            seen += count
+            lines.append('htmllogger_%s_seconds_bucket{le="%s"} %s' %
+                         (name, bound, seen))
+        lines.append('htmllogger_%s_seconds_bucket{le="+Inf"} %s' %
+                     (name, histogram.count))
+        lines.append('htmllogger_%s_seconds_sum %r' %
+                     (name, histogram.total))
+        lines.append('htmllogger_%s_seconds_count %s' %
+                     (name, histogram.count))
+    metric('errors_total', 'counter', 'Errors, by kind.')
+    for (kind, count) in sorted(stats.errors.items()):
+        lines.append('htmllogger_errors_total{kind="%s"} %s' % (kind, count))
+    for (kind, values) in (('gauge', gauges), ('counter', counters)):
+        for (name, help, value) in values:
+            metric(name, kind, help)
+            lines.append('htmllogger_%s %s' % (name, value))
+    return '\n'.join(lines) + '\n'
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,249 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Background sweep of the log tree, deleting the logs beyond the retention
+limits.
+'''
+
+import os
+import time
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import supybot.log as log
+import supybot.ircutils as ircutils
+
+class LogGroup(object):
+    ''' A log with its pages and their compressed copies, which are kept or
+        deleted together.
+    '''
+    __slots__ = ('name', 'files', 'size', 'mtime')
+
+    def __init__(self, name):
+        self.name = name
+        self.files = []
+        self.size = 0
+        self.mtime = 0
+
+def groupLogs(logDir, files, splitName):
+    ''' Returns the LogGroups of the files of logDir, newest first.
+        splitName(file) returns the name of the log a file belongs to, or
+        None to skip it.
+    '''
+    groups = {}
+    for f in files:
+        name = splitName(f)
+        if name is None:
+            continue
+        try:
+            stat = os.stat(os.path.join(logDir, f))
+        except OSError:
+            # Deleted or compressed meanwhile.
+            continue
+        group = groups.get(name)
+        if group is None:
+            group = groups[name] = LogGroup(name)
+        group.files.append(f)
+        group.size += stat.st_size
+        group.mtime = max(group.mtime, stat.st_mtime)
+    return [groups[name] for name in sorted(groups, reverse=True)]
+
+def expiredLogs(groups, keep, maxAge, maxBytes, now):
+    ''' Returns the groups, newest first, that are beyond the keep newest
+        ones, older than maxAge seconds, or beyond the maxBytes of the
+        newest ones.  A zero limit is no limit.  The newest log is never
+        expired.
+    '''
+    expired = []
+    total = 0
+    for (index, group) in enumerate(groups):
+        total += group.size
+        if index and ((keep and index >= keep) or
+                      (maxAge and group.mtime < now - maxAge) or
+                      (maxBytes and total > maxBytes)):
+            expired.append(group)
+    return expired
+
+class Sweeper(object):
+    ''' Deletes the logs beyond the retention limits below a log root, from
+        a thread of its own.
+
+        Each sweep walks the whole tree.  Only the directories named after a
+        channel are swept, with the (keep, maxAge, maxBytes) limits given
+        for the lowercased channel, or those given for None;
+        splitName(file) returns the name of the log a file belongs to, or
+        None if it is not a log; busy(path) tells whether a log is still
+        being written.  At most unlinkRate files are deleted per second, so
+        the disk is not monopolized.  Every change to a log directory is
+        reported by calling done(logDir, removed) from the sweeping thread.
+    '''
+    def __init__(self, root, unlinkRate, splitName, busy, done):
+        self.root = root
+        self.unlinkRate = unlinkRate
+        self.splitName = splitName
+        self.busy = busy
+        self.done = done
+        self.queue = queue.Queue()
+        self.stopping = threading.Event()
+        self.nextUnlink = 0
+        self.sweeps = 0
+        self.deleted = 0
+        self.reclaimed = 0
+        # (files deleted, bytes reclaimed, seconds) of the last sweep
+        self.lastSweep = None
+        self.errors = 0
+        self.thread = threading.Thread(target=self.run,
+                                       name='HtmlLogger sweeper')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def sweep(self, limits, networkBytes):
+        ''' Has the tree swept with limits, a dict of the limits of each
+            channel, unless a sweep is already waiting.  The logs of the
+            directories of each network directory, or of the whole tree
+            without network directories, are limited to networkBytes if it
+            is not zero.
+        '''
+        if self.queue.empty():
+            self.queue.put((limits, networkBytes))
+
+    def sync(self):
+        ''' Waits until the sweeps asked for so far are done. '''
+        self.queue.join()
+
+    def stop(self):
+        ''' Stops the thread, in the middle of a sweep if needed. '''
+        self.stopping.set()
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                try:
+                    self.sweepTree(*task)
+                except Exception:
+                    self.errors += 1
+                    log.exception('HtmlLogger sweep failed:')
+            finally:
+                self.queue.task_done()
+
+    def sweepTree(self, channelLimits, networkBytes):
+        started = time.time()
+        (deleted, reclaimed) = (self.deleted, self.reclaimed)
+        # network directory -> [(logDir, its LogGroups left)]
+        networks = {}
+        for (logDir, dirs, files) in os.walk(self.root):
+            if self.stopping.is_set():
+                return
+            channel = os.path.basename(logDir)
+            if not ircutils.isChannel(channel):
+                continue
+            limits = channelLimits.get(ircutils.toLower(channel),
+                                       channelLimits[None])
+            if not (any(limits) or networkBytes):
+                # Nothing to delete here, so nothing to stat.
+                continue
+            groups = groupLogs(logDir, files, self.splitName)
+            expired = expiredLogs(groups, *(limits + (started,)))
+            self.deleteLogs(logDir, expired)
+            network = os.path.dirname(logDir)
+            networks.setdefault(network, []).append(
+                    (logDir, [group for group in groups
+                              if group not in expired]))
+        if networkBytes:
+            for logDirs in networks.values():
+                self.sweepNetwork(logDirs, networkBytes)
+        elapsed = time.time() - started
+        self.sweeps += 1
+        self.lastSweep = (self.deleted - deleted, self.reclaimed - reclaimed,
+                          elapsed)
+        log.info('HtmlLogger swept %s: %s files deleted, %s bytes '
+                 'reclaimed in %.2f seconds.', self.root, *self.lastSweep)
+
+    def sweepNetwork(self, logDirs, limit):
+        ''' Deletes the oldest logs of the directories of a network beyond
+            limit bytes.  The newest log of each directory is kept.
+        '''
+        total = 0
+        candidates = []
+        for (logDir, groups) in logDirs:
+            for (index, group) in enumerate(groups):
+                total += group.size
+                if index:
+                    candidates.append((group.mtime, logDir, group))
+        candidates.sort(key=lambda candidate: candidate[0])
+        expired = {}
+        for (mtime, logDir, group) in candidates:
+            if total <= limit:
+                break
+            total -= group.size
+            expired.setdefault(logDir, []).append(group)
+        for (logDir, groups) in expired.items():
+            self.deleteLogs(logDir, groups)
+
+    def deleteLogs(self, logDir, groups):
+        removed = []
+        for group in groups:
+            for f in group.files:
+                if self.stopping.is_set():
+                    break
+                path = os.path.join(logDir, f)
+                if self.busy(path):
+                    continue
+                self.throttle()
+                try:
+                    size = os.stat(path).st_size
+                    os.remove(path)
+                except OSError:
+                    if os.path.exists(path):
+                        self.errors += 1
+                        log.exception('HtmlLogger could not delete %s:', path)
+                    continue
+                log.info('Deleting old logfile "%s".', path)
+                self.deleted += 1
+                self.reclaimed += size
+                removed.append(f)
+        if removed:
+            self.done(logDir, removed)
+
+    def throttle(self):
+        now = time.time()
+        self.nextUnlink = max(self.nextUnlink, now) + 1.0 / self.unlinkRate
+        wait = self.nextUnlink - now - 1.0 / self.unlinkRate
+        if wait > 0:
+            self.stopping.wait(wait)
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
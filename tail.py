@@ -0,0 +1,270 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Live tail of the logs being written, over HTTP.
+
+A log is addressed by byte offsets: the rows of a log file end at an offset,
+before the footer if it has one, and a client asks for the rows after the
+offset it has seen:
+
+    GET /<log directory>/<log name>?offset=<bytes>
+
+returns those rows as an HTML fragment, with the offset they end at in the
+X-Log-Offset header.  Without offset, no rows are returned, only the offset
+to start from.  <log name> can be "latest", the log of the directory written
+last, which is named in the X-Log-Name header.  The same URL sent with
+"Accept: text/event-stream", or with &stream=1, is a Server-Sent Events
+stream: every row is an event whose id is the offset it ends at, so a
+reconnecting client resumes with Last-Event-ID, and a "log" event names the
+new log when "latest" moves to another one.
+
+Rows are read from the log files, so they show up once they are flushed;
+the durability setting, or liveTail, flushes them regularly.  The bot's HTTP
+server answers fragment requests with liveTail enabled, for the channels
+with liveTail.allowChannel the bot is in that are neither secret nor
+private.  Streams need a
+thread per client, so they come from the standalone server:
+
+    python tail.py <log directory> [--port 8081] [--footer FILE]
+
+where <log directory> is the HtmlLogger directory in the bot's log
+directory.  Viewers cost nothing to the bot either way.
+'''
+
+import os
+import re
+import sys
+import time
+import argparse
+
+try:
+    from urllib.parse import unquote, urlsplit, parse_qs
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from urllib import unquote
+    from urlparse import urlsplit, parse_qs
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from io import open
+
+log_regex = re.compile(r'^log_.*\.html$')
+# Upper bound on the bytes of rows returned at once.
+max_fragment = 1 << 20
+# Seconds between two checks of a streamed log, and between two keepalive
+# comments of a stream.
+poll_interval = 0.5
+keepalive_interval = 15
+# Seconds between two looks for a newer log, for the streams of "latest".
+latest_interval = 5
+
+def resolve(root, path):
+    ''' Returns the path of the log that the request path names below root,
+        or None if it names none.
+    '''
+    parts = [unquote(part) for part in path.strip('/').split('/')]
+    if len(parts) < 2 or '..' in parts or '' in parts:
+        return None
+    logDir = os.path.join(root, *parts[:-1])
+    name = parts[-1]
+    if name == 'latest':
+        name = latestLog(logDir)
+        if name is None:
+            return None
+    if not log_regex.match(name):
+        return None
+    logPath = os.path.realpath(os.path.join(logDir, name))
+    if not logPath.startswith(os.path.realpath(root) + os.sep):
+        return None
+    return logPath
+
+def latestLog(logDir):
+    ''' Returns the name of the log of logDir written last, or None. '''
+    try:
+        names = [f for f in os.listdir(logDir) if log_regex.match(f)]
+    except OSError:
+        return None
+    if not names:
+        return None
+    return max(names,
+               key=lambda f: (os.path.getmtime(os.path.join(logDir, f)), f))
+
+def readRows(logPath, offset, footer):
+    ''' Returns (rows, end) where rows are the complete rows of logPath
+        after the byte offset, as bytes, and end is the offset they end at.
+        If offset is None or past the rows, no rows are read, and end is
+        where the rows end.
+    '''
+    with open(logPath, 'rb') as logFile:
+        logFile.seek(0, os.SEEK_END)
+        size = logFile.tell()
+        tailSize = min(size, len(footer))
+        logFile.seek(size - tailSize)
+        if footer and logFile.read(tailSize) == footer:
+            size -= len(footer)
+        if offset is None or offset > size:
+            offset = size
+        logFile.seek(offset)
+        data = logFile.read(min(size - offset, max_fragment))
+    # A row being written is sent once it is complete.
+    data = data[:data.rfind(b'\n') + 1]
+    return (data, offset + len(data))
+
+def getOffset(query, headers):
+    value = query.get('offset', [headers.get('Last-Event-ID')])[0]
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def fragment(root, path, footer, logDirs=None):
+    ''' Answers a fragment request.  Returns (status, headers, body).  If
+        logDirs is given, only the logs of those directories, relative to
+        root, are served.
+    '''
+    url = urlsplit(path)
+    logPath = resolve(root, url.path)
+    if logPath is None or not os.path.isfile(logPath) or \
+            (logDirs is not None and
+             os.path.relpath(os.path.dirname(logPath), root) not in logDirs):
+        return (404, {'Content-Type': 'text/plain'}, b'No such log.\n')
+    (rows, end) = readRows(logPath, getOffset(parse_qs(url.query), {}),
+                           footer)
+    headers = {'Content-Type': 'text/html; charset=utf-8',
+               'Cache-Control': 'no-cache',
+               'X-Log-Name': os.path.basename(logPath),
+               'X-Log-Offset': str(end)}
+    return (200, headers, rows)
+
+class TailHandler(BaseHTTPRequestHandler):
+    ''' Serves fragments and streams of the logs below server.root. '''
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if 'text/event-stream' in self.headers.get('Accept', '') or \
+                query.get('stream') == ['1']:
+            self.stream(url.path, getOffset(query, self.headers))
+            return
+        (status, headers, body) = fragment(self.server.root, self.path,
+                                           self.server.footer)
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, path, offset):
+        logPath = resolve(self.server.root, path)
+        if logPath is None or not os.path.isfile(logPath):
+            self.send_error(404, 'No such log.')
+            return
+        latest = path.rstrip('/').endswith('/latest')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        lastSent = lastLooked = time.time()
+        try:
+            while not self.server.stopping:
+                (rows, offset) = readRows(logPath, offset, self.server.footer)
+                events = []
+                end = offset - len(rows)
+                for row in rows.split(b'\n')[:-1]:
+                    end += len(row) + 1
+                    # Not the header of a new log.
+                    if row.startswith(b'<p '):
+                        events.append(b'id: ' + str(end).encode('ascii') +
+                                      b'\ndata: ' + row + b'\n\n')
+                now = time.time()
+                if latest and now - lastLooked >= latest_interval:
+                    lastLooked = now
+                    newPath = resolve(self.server.root, path)
+                    if newPath is not None and newPath != logPath:
+                        logPath = newPath
+                        offset = 0
+                        events.append(b'event: log\ndata: ' +
+                                      os.path.basename(logPath).encode('utf-8')
+                                      + b'\n\n')
+                if not events and now - lastSent >= keepalive_interval:
+                    events.append(b': keepalive\n\n')
+                if events:
+                    self.wfile.write(b''.join(events))
+                    self.wfile.flush()
+                    lastSent = now
+                time.sleep(self.server.pollInterval)
+        except (IOError, OSError):
+            # The client went away, or the log did.
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+class TailServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root, footer, pollInterval=poll_interval):
+        HTTPServer.__init__(self, address, TailHandler)
+        self.root = root
+        self.footer = footer
+        self.pollInterval = pollInterval
+        self.stopping = False
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Serve the live tail of HtmlLogger logs.')
+    parser.add_argument('logRoot', help='the HtmlLogger log directory')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8081,
+                        help='port to listen on (default: %(default)s)')
+    parser.add_argument('--footer', default='',
+                        help='the footer template of the logs, instead of '
+                             'footer.html')
+    parser.add_argument('--interval', type=float, default=poll_interval,
+                        help='seconds between two checks of a streamed log')
+    options = parser.parse_args()
+    footerPath = options.footer or \
+            os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'footer.html')
+    with open(footerPath, encoding='utf-8') as footerFile:
+        footer = footerFile.read().encode('utf-8')
+    server = TailServer((options.host, options.port), options.logRoot, footer,
+                        options.interval)
+    sys.stdout.write('Serving %s on http://%s:%s/\n' %
+                     (options.logRoot, options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
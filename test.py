@@ -27,10 +27,940 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import os
+import re
+import sys
+import gzip
+import calendar
+import threading
+
 from supybot.test import *
 
+def plugin_escape(s):
+    return sys.modules['HtmlLogger.plugin'].html_escape(s)
+
 class HtmlLoggerTestCase(PluginTestCase):
     plugins = ('HtmlLogger',)
 
+    def enterChannel(self, channel):
+        ''' Puts the bot and the tester in channel, without logging it. '''
+        state = irclib.ChannelState()
+        state.addUser(self.nick)
+        self.irc.state.channels[channel] = state
+
+    def testSettingsSnapshot(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        settings = cb.getSettings(self.irc, '#test')
+        self.assertTrue(settings is cb.getSettings(self.irc, '#TEST'))
+        with conf.supybot.plugins.HtmlLogger.timestamp.context(False):
+            newSettings = cb.getSettings(self.irc, '#test')
+            self.assertFalse(newSettings is settings)
+            self.assertFalse(newSettings.timestamp)
+        settings = cb.getSettings(self.irc, '#test')
+        self.assertTrue(settings.timestamp)
+        # A reload from disk drops the snapshot too.
+        import supybot.registry as registry
+        loadedAt = registry._lastModified
+        registry._lastModified = settings.builtAt + 1
+        try:
+            self.assertFalse(cb.getSettings(self.irc, '#test') is settings)
+        finally:
+            registry._lastModified = loadedAt
+
+    def testNextLogNameChange(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        nextLogNameChange = sys.modules[cb.__module__].nextLogNameChange
+        now = calendar.timegm((2024, 2, 28, 23, 59, 30, 0, 0, 0))
+        self.assertEqual(nextLogNameChange('%Y-%m-%d', now),
+                         calendar.timegm((2024, 2, 29, 0, 0, 0, 0, 0, 0)))
+        self.assertEqual(nextLogNameChange('%Y-%m', now),
+                         calendar.timegm((2024, 3, 1, 0, 0, 0, 0, 0, 0)))
+        self.assertEqual(nextLogNameChange('%H:%M:%S', now), now + 1)
+        now = calendar.timegm((2024, 2, 28, 10, 0, 0, 0, 0, 0))
+        self.assertEqual(nextLogNameChange('%Y-%m-%d_%p', now),
+                         calendar.timegm((2024, 2, 28, 12, 0, 0, 0, 0, 0)))
+        self.assertEqual(nextLogNameChange('static', now), None)
+
+    def testStripFooter(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        footer = cb.getFooter()
+        logPath = os.path.join(conf.supybot.directories.log(), 'footer.html')
+        body = '<p>line</p>\n' * 1000
+        with open(logPath, 'w') as logFile:
+            logFile.write(body + footer)
+        cb.stripFooter(logPath)
+        with open(logPath) as logFile:
+            self.assertEqual(logFile.read(), body)
+        # Nothing to strip.
+        cb.stripFooter(logPath)
+        with open(logPath) as logFile:
+            self.assertEqual(logFile.read(), body)
+        # Footer written by an older template.
+        with open(logPath, 'w') as logFile:
+            logFile.write(body + '<hr/>\n</body>\n</html>\n')
+        cb.stripFooter(logPath)
+        with open(logPath) as logFile:
+            self.assertEqual(logFile.read(), body + '<hr/>\n')
+        # Cut short by a crash.
+        with open(logPath, 'w') as logFile:
+            logFile.write(body + '<p>li')
+        cb.stripFooter(logPath)
+        with open(logPath) as logFile:
+            self.assertEqual(logFile.read(), body)
+
+    def testTemplateCache(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        footerPath = os.path.join(conf.supybot.directories.log(), 'foot.html')
+        with open(footerPath, 'w') as footerFile:
+            footerFile.write('</body>old</html>\n')
+        with conf.supybot.plugins.HtmlLogger.footerFile.context(footerPath):
+            self.assertEqual(cb.getFooter(), '</body>old</html>\n')
+            with open(footerPath, 'w') as footerFile:
+                footerFile.write('</body>new</html>\n')
+            # Not checked again until the interval elapsed.
+            self.assertEqual(cb.getFooter(), '</body>old</html>\n')
+            os.utime(footerPath, (0, 0))
+            cb.templates['footer'].checkedAt = 0
+            self.assertEqual(cb.getFooter(), '</body>new</html>\n')
+        self.assertNotEqual(cb.getFooter(), '</body>new</html>\n')
+
+    def testAsyncWrites(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        with conf.supybot.plugins.HtmlLogger.asyncWrites.context(True):
+            self.assertNotEqual(cb.writer, None)
+            for i in range(100):
+                cb.doLog(self.irc, '#test', False, 'foo', 'line %s', i)
+            logPath = cb.getLog(self.irc, '#test').name
+            cb.reset()
+            cb.syncLogs()
+            with open(logPath) as logFile:
+                contents = logFile.read()
+            self.assertTrue(contents.endswith('line 99</span></p>\n' +
+                                              cb.getFooter()))
+            self.assertEqual(cb.writer.lines, 100)
+        self.assertEqual(cb.writer, None)
+
+    def testDurability(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        config = conf.supybot.plugins.HtmlLogger
+        footer = cb.getFooter()
+        for asyncWrites in (False, True):
+            with config.asyncWrites.context(asyncWrites):
+                with config.durability.context('fsync'):
+                    cb.doLog(self.irc, '#durable', False, 'foo', 'line 1')
+                    logPath = cb.getLog(self.irc, '#durable').name
+                    cb.commitLogs()
+                    cb.syncLogs()
+                    # What a crash would leave behind.
+                    with open(logPath) as logFile:
+                        contents = logFile.read()
+                    self.assertTrue(contents.endswith(
+                        'line 1</span></p>\n' + footer))
+                    with config.durability.bytes.context(10):
+                        cb.doLog(self.irc, '#durable', False, 'foo', 'line 2')
+                    cb.syncLogs()
+                    with open(logPath) as logFile:
+                        contents = logFile.read()
+                    self.assertTrue(contents.endswith(
+                        'line 2</span></p>\n' + footer))
+                    self.assertEqual(contents.count(footer), 1)
+                    cb.doLog(self.irc, '#durable', False, 'foo', 'line 3')
+                    cb.reset()
+                    cb.syncLogs()
+            with open(logPath) as logFile:
+                contents = logFile.read()
+            self.assertTrue(contents.endswith('line 3</span></p>\n' + footer))
+            self.assertEqual(contents.count(footer), 1)
+            os.remove(logPath)
+
+    def testLiveTail(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        package = cb.__module__.rsplit('.', 1)[0]
+        tail = sys.modules[package + '.tail']
+        root = conf.supybot.directories.log.dirize(cb.name())
+        footer = cb.getFooter().encode('utf-8')
+        config = conf.supybot.plugins.HtmlLogger.liveTail
+        with config.context(True):
+            self.assertTrue(cb.tailHooked)
+            self.assertEqual(cb.tailFooter, footer)
+            self.assertEqual(cb.durability[0], 'flush')
+            cb.doLog(self.irc, '#tail', False, 'foo', 'line 1')
+            logPath = cb.getLog(self.irc, '#tail').name
+            cb.commitLogs()
+            path = '/' + '/'.join(part.replace('#', '%23') for part in
+                                  os.path.relpath(logPath, root).split(os.sep))
+            # Only the allowed channels the bot is in, and not secret ones.
+            self.enterChannel('#tail')
+            cb.updateTailDirs()
+            self.assertEqual(cb.tailDirs, frozenset())
+            with config.allowChannel.get('#tail').context(True):
+                self.assertEqual(cb.tailDirs, frozenset(
+                        [os.path.dirname(os.path.relpath(logPath, root))]))
+                self.assertEqual(tail.fragment(root, path, footer,
+                                               cb.tailDirs)[0], 200)
+                self.irc.state.channels['#tail'].modes['s'] = None
+                cb.updateTailDirs()
+                self.assertEqual(tail.fragment(root, path, footer,
+                                               cb.tailDirs)[0], 404)
+                del self.irc.state.channels['#tail']
+                cb.updateTailDirs()
+                self.assertEqual(cb.tailDirs, frozenset())
+            (status, headers, body) = tail.fragment(root, path, footer)
+            self.assertEqual((status, body), (200, b''))
+            offset = int(headers['X-Log-Offset'])
+            self.assertEqual(offset, os.path.getsize(logPath) - len(footer))
+            cb.doLog(self.irc, '#tail', False, 'foo', 'line 2')
+            cb.commitLogs()
+            latest = path.rsplit('/', 1)[0] + '/latest'
+            (status, headers, body) = tail.fragment(
+                    root, '%s?offset=%s' % (latest, offset), footer)
+            self.assertTrue(b'line 2' in body and b'line 1' not in body)
+            self.assertTrue(body.endswith(b'</p>\n'))
+            self.assertEqual(headers['X-Log-Name'], os.path.basename(logPath))
+            self.assertEqual(int(headers['X-Log-Offset']), offset + len(body))
+            # A row being written is left for the next request.
+            with open(logPath, 'r+b') as logFile:
+                logFile.truncate(offset + len(body))
+                logFile.seek(0, os.SEEK_END)
+                logFile.write(b'<p class="style-row">li')
+            (status, headers, body) = tail.fragment(
+                    root, '%s?offset=%s' % (path, offset), footer)
+            self.assertTrue(body.endswith(b'line 2</span></p>\n'))
+            self.assertEqual(tail.fragment(root, '/../etc/passwd', footer)[0],
+                             404)
+        self.assertFalse(cb.tailHooked)
+        cb.reset()
+
+    def testManifest(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        logDir = cb.getLogDir(self.irc, '#manifest')
+        for day in ('2024-01-01', '2024-01-02'):
+            with open(os.path.join(logDir,
+                                   'log_hash-manifest_%s.html' % day), 'w'):
+                pass
+        cb.generateIndex(self.irc, logDir, '#manifest')
+        cb.syncMaintenance()
+        manifest = cb.getManifest(logDir)
+        self.assertEqual(manifest.files, ['log_hash-manifest_2024-01-01.html',
+                                          'log_hash-manifest_2024-01-02.html'])
+        self.assertTrue(os.path.exists(manifest.path))
+        self.assertFalse(manifest.isStale())
+        # A file added behind our back makes the manifest stale.
+        time.sleep(0.01)
+        newLog = os.path.join(logDir, 'log_hash-manifest_2024-01-03.html')
+        with open(newLog, 'w'):
+            pass
+        self.assertTrue(manifest.isStale())
+        with conf.supybot.plugins.HtmlLogger.deleteOldLogs.context(2):
+            cb.deleteOldLogs(self.irc, '#manifest', 2)
+        cb.generateIndex(self.irc, logDir, '#manifest')
+        cb.syncMaintenance()
+        self.assertEqual(sorted(cb.listLogFiles(logDir)),
+                         ['log_hash-manifest_2024-01-02.html',
+                          'log_hash-manifest_2024-01-03.html'])
+        del cb.manifests[logDir]
+        self.assertEqual(cb.getManifest(logDir).files,
+                         sorted(cb.listLogFiles(logDir)))
+        with open(os.path.join(logDir, 'index.html')) as indexFile:
+            index = indexFile.read()
+        self.assertTrue('2024-01-03' in index)
+        self.assertFalse('2024-01-01' in index)
+
+    def testManifestRotation(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        plugin = sys.modules[cb.__module__]
+        class Clock(object):
+            now = time.time()
+            def time(self):
+                return self.now
+            def __getattr__(self, name):
+                return getattr(time, name)
+        clock = Clock()
+        logDir = cb.getLogDir(self.irc, '#rotating')
+        listLogFiles = cb.listLogFiles
+        rebuilds = []
+        def countRebuilds(path):
+            rebuilds.append(path)
+            return listLogFiles(path)
+        cb.listLogFiles = countRebuilds
+        plugin.time = clock
+        try:
+            with conf.supybot.plugins.HtmlLogger.rotateLogs.context(True):
+                for day in range(5):
+                    clock.now += 86400
+                    cb.doLog(self.irc, '#rotating', False, 'foo', 'bar')
+                    cb.syncMaintenance()
+        finally:
+            plugin.time = time
+            del cb.listLogFiles
+        self.assertEqual(len(listLogFiles(logDir)), 5)
+        # Only the first start finds a manifest that is not ours.
+        self.assertEqual(rebuilds, [logDir])
+
+    def testSweep(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        logDir = cb.getLogDir(self.irc, '#sweep')
+        old = time.time() - 10 * 86400
+        for name in ('log_hash-sweep_2024-01-01.html',
+                     'log_hash-sweep_2024-01-01.p2.html.gz',
+                     'log_hash-sweep_2024-01-02.html',
+                     'log_hash-sweep_2024-01-03.html',
+                     'log_hash-sweep_2024-01-04.html'):
+            path = os.path.join(logDir, name)
+            with open(path, 'w') as logFile:
+                logFile.write('x' * 100)
+            if '01-01' in name:
+                os.utime(path, (old, old))
+        config = conf.supybot.plugins.HtmlLogger.deleteOldLogs
+        with config.sweepInterval.context(3600):
+            cb.generateIndex(self.irc, logDir, '#sweep')
+            cb.syncMaintenance()
+            def sweep():
+                cb.sweepLogs()
+                cb.sweeper.sync()
+                cb.applySweeperChanges()
+                cb.syncMaintenance()
+                with open(os.path.join(logDir, 'index.html')) as index:
+                    return (sorted(cb.listLogFiles(logDir)), index.read())
+            sweep()
+            self.assertEqual(len(cb.listLogFiles(logDir)), 5)
+            with config.maxDays.get('#sweep').context(1):
+                # Read on the bot thread, for the sweeper.
+                limits = cb.retentionLimits()
+                self.assertEqual(limits['#sweep'], (0, 86400, 0))
+                self.assertEqual(limits[None], (0, 0, 0))
+                (files, index) = sweep()
+            self.assertEqual(files, ['log_hash-sweep_2024-01-02.html',
+                                     'log_hash-sweep_2024-01-03.html',
+                                     'log_hash-sweep_2024-01-04.html'])
+            self.assertFalse('2024-01-01' in index)
+            self.assertEqual(cb.sweeper.lastSweep[:2], (2, 200))
+            with config.maxBytes.get('#sweep').context(250):
+                (files, index) = sweep()
+            self.assertEqual(files, ['log_hash-sweep_2024-01-03.html',
+                                     'log_hash-sweep_2024-01-04.html'])
+            self.assertEqual(cb.getManifest(logDir).files, files)
+            # The newest log is kept whatever the limits.
+            with config.maxBytes.get('#sweep').context(1):
+                (files, index) = sweep()
+            self.assertEqual(files, ['log_hash-sweep_2024-01-04.html'])
+            self.assertTrue('2024-01-04' in index)
+
+    def testActivityStats(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        package = cb.__module__.rsplit('.', 1)[0]
+        activity = sys.modules[package + '.activity']
+        config = conf.supybot.plugins.HtmlLogger.activityStats
+        with config.context(True):
+            with config.maxNicks.context(4):
+                for nick in ('alice', 'alice', 'bob', 'carol', 'dave',
+                             'eve', 'alice', '<mallory>'):
+                    cb.doLog(self.irc, '#activity', False, nick, 'hi')
+                cb.doLog(self.irc, '#activity', True, None, '*** joined')
+                logDir = cb.getLogDir(self.irc, '#activity')
+                counts = cb.activityDirs[logDir]
+                # Folded to make room for new nicks.
+                self.assertTrue(len(counts.nicks) <= 4)
+                self.assertEqual(counts.nicks['alice'].lines, 3)
+                self.assertEqual(counts.totals(), (8, 16))
+                cb.snapshotActivity()
+                cb.syncMaintenance()
+                # A restart merges the snapshot.
+                del cb.activity[(self.irc.network, '#activity')]
+                del cb.activityDirs[logDir]
+                cb.doLog(self.irc, '#activity', False, 'alice', 'hello')
+                self.assertEqual(cb.activityDirs[logDir].totals(), (9, 21))
+                cb.snapshotActivity()
+                cb.generateIndex(self.irc, logDir, '#activity')
+                cb.syncMaintenance()
+        with open(os.path.join(logDir, 'index.html')) as indexFile:
+            index = indexFile.read()
+        self.assertTrue('<td>alice</td><td>4</td><td>11</td>' in index)
+        self.assertTrue('&lt;mallory&gt;' in index)
+        self.assertEqual(activity.renderActivity(None, 10), '')
+
+    def testShardedIndex(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        logDir = cb.getLogDir(self.irc, '#shards')
+        def names():
+            return sorted(f for f in os.listdir(logDir)
+                          if f.startswith('index'))
+        def read(name):
+            with open(os.path.join(logDir, name)) as indexFile:
+                return indexFile.read()
+        config = conf.supybot.plugins.HtmlLogger
+        with config.shardIndex.context(True):
+            with config.filenameTimestamp.context('%Y.%m.%d'):
+                for day in ('2023.12.30', '2023.12.31', '2024.01.01',
+                            'static'):
+                    with open(os.path.join(
+                            logDir, 'log_hash-shards_%s.html' % day), 'w'):
+                        pass
+                cb.generateIndex(self.irc, logDir, '#shards')
+                cb.syncMaintenance()
+                self.assertEqual(names(), ['index-2023-12.html',
+                                           'index-2023.html',
+                                           'index-2024-01.html',
+                                           'index-2024.html', 'index.html'])
+                index = read('index.html')
+                self.assertTrue('href="index-2023-12.html">2023-12</a> (2)'
+                                in index)
+                self.assertTrue('static' in index)
+                self.assertFalse('2023.12.31' in index)
+                self.assertTrue('2023.12.31' in read('index-2023-12.html'))
+                # Only the pages of the changed months are rewritten.
+                old = os.path.join(logDir, 'index-2023-12.html')
+                os.utime(old, (0, 0))
+                newLog = 'log_hash-shards_2024.01.02.html'
+                with open(os.path.join(logDir, newLog), 'w'):
+                    pass
+                cb.logStarted(logDir, newLog, 0, None, None,
+                              cb.getIndexOptions(self.irc, '#shards'))
+                self.assertEqual(os.stat(old).st_mtime, 0)
+                self.assertTrue('2024.01.02' in read('index-2024-01.html'))
+                # Deleting a month's logs deletes its pages.
+                cb.logStarted(logDir, newLog, 3, None, None,
+                              cb.getIndexOptions(self.irc, '#shards'))
+                self.assertEqual(names(), ['index-2024-01.html',
+                                           'index-2024.html', 'index.html'])
+                with config.shardIndex.context(False):
+                    cb.generateIndex(self.irc, logDir, '#shards')
+                    cb.syncMaintenance()
+                    self.assertEqual(names(), ['index.html'])
+                    self.assertTrue('2024.01.02' in read('index.html'))
+
+    def testAsyncMaintenance(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        config = conf.supybot.plugins.HtmlLogger
+        with config.asyncMaintenance.context(True):
+            logDir = cb.getLogDir(self.irc, '#maintenance')
+            # Hold up the maintenance of the directory.
+            blocked = threading.Event()
+            cb.runMaintenance(logDir, blocked.wait)
+            with config.flushImmediately.context(True):
+                cb.doLog(self.irc, '#maintenance', False, 'foo', 'not waiting')
+            log = cb.getLog(self.irc, '#maintenance')
+            with open(log.name) as logFile:
+                self.assertTrue('not waiting' in logFile.read())
+            index = os.path.join(logDir, 'index.html')
+            self.assertFalse(os.path.exists(index))
+            blocked.set()
+            cb.syncMaintenance()
+            self.assertTrue(os.path.exists(index))
+            self.assertFalse(cb.getManifest(logDir).isStale())
+
+    def testRenderer(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        plugin = sys.modules[cb.__module__]
+        url_regex = re.compile(r'(\s*)([fhtps]{3,5}://\S+)(\s*)')
+        def render(notice, nick, s, timestampFormat, stripFormatting):
+            # How rows were written before LineRenderer.
+            row_classes = plugin.row_class
+            if notice:
+                row_classes = plugin.row_class + " " + plugin.notice_class
+            row = '<p class="%s">' % row_classes
+            if timestampFormat is not None:
+                row += '<span class="%s">' % plugin.timestamp_class
+                if timestampFormat:
+                    row += time.strftime(timestampFormat, time.gmtime())
+                    row += '  '
+                row += '</span>'
+            if nick != None:
+                row += '<span class="%s">' % plugin.nick_class
+                row += plugin.html_escape("<%s> " %nick)
+                row += '</span>'
+            if stripFormatting:
+                s = ircutils.stripFormatting(s)
+            row += '<span class="%s">' % plugin.message_class
+            row += url_regex.sub(r'\1<a href="\2">\2</a>\3',
+                                 plugin.html_escape(s))
+            row += '</span>'
+            row += '</p>\n'
+            return row
+        renderer = plugin.LineRenderer()
+        for notice in (False, True):
+            for nick in (None, 'foo', '<b&r>'):
+                for timestampFormat in (None, '', '%Y'):
+                    for stripFormatting in (False, True):
+                        for s in ('hi', '\x02bold\x02 <a> & "q" http://x/?a&b',
+                                  ''):
+                            args = (notice, nick, s, timestampFormat,
+                                    stripFormatting)
+                            self.assertEqual(renderer.render(*args),
+                                             render(*args))
+
+    def testRenderMessage(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        renderMessage = sys.modules[cb.__module__].renderMessage
+        for s in ('', 'plain', '\x02b\x02 \x0304,05c\x03 \x1fu\x1f\x0f',
+                  '\x034', 'a  b\t' * 50):
+            self.assertEqual(renderMessage(s, True),
+                             plugin_escape(ircutils.stripFormatting(s)))
+        self.assertEqual(renderMessage('\x02http://x/\x02', True),
+                         '<a href="http://x/">http://x/</a>')
+        self.assertEqual(renderMessage('<http://x.org/?a=1&b=2>.', False),
+                         '&lt;<a href="http://x.org/?a=1&amp;b=2">'
+                         'http://x.org/?a=1&amp;b=2</a>&gt;.')
+        self.assertEqual(renderMessage('(see https://w.org/A_(b)), ok',
+                                       False),
+                         '(see <a href="https://w.org/A_(b)">'
+                         'https://w.org/A_(b)</a>), ok')
+        self.assertEqual(renderMessage('"ftp://f/x" http://', False),
+                         plugin_escape('"') + '<a href="ftp://f/x">ftp://f/x'
+                         '</a>' + plugin_escape('" ') + 'http://')
+
+    def testSearchlog(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        with conf.supybot.plugins.HtmlLogger.searchIndex.context(True):
+            cb.doLog(self.irc, '#search', False, 'alice',
+                     'the quick brown fox')
+            cb.doLog(self.irc, '#search', False, 'bob', 'a lazy dog')
+            cb.getSearchIndex().sync()
+            self.assertError('searchlog #search fox')
+            self.enterChannel('#search')
+            self.assertRegexp('searchlog #search fox',
+                              r'<alice> the quick brown fox '
+                              r'\(log_hash-search.html\)')
+            self.assertResponse('searchlog #search cat', 'No matches.')
+            # The lines of a deleted log are forgotten.
+            logDir = cb.getLogDir(self.irc, '#search')
+            oldName = 'log_hash-search-old.html'
+            open(os.path.join(logDir, oldName), 'w').close()
+            cb.getSearchIndex().add(cb.getRelativeLogDir(self.irc, '#search'),
+                                    oldName, 'carol', 'an old fox')
+            cb.getSearchIndex().sync()
+            self.assertRegexp('searchlog #search fox', 'carol')
+            self.assertEqual(cb.removeOldLogs(logDir, 1), [oldName])
+            cb.getSearchIndex().sync()
+            self.assertNotRegexp('searchlog #search fox', 'carol')
+            self.assertRegexp('searchlog #search fox', 'alice')
+        self.assertError('searchlog #search fox')
+
+    def testSearchBackfill(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        search = sys.modules[cb.__module__.rsplit('.', 1)[0] + '.search']
+        cb.doLog(self.irc, '#backfill', False, 'alice', 'see <http://x/?a&b>')
+        cb.doLog(self.irc, '#backfill', True, None, '*** bob has joined')
+        logPath = cb.getLog(self.irc, '#backfill').name
+        cb.flush()
+        self.assertEqual([row[:2] for row in search.parseLog(logPath,
+                              conf.supybot.log.timestampFormat())],
+                         [('alice', 'see <http://x/?a&b>'),
+                          (None, '*** bob has joined')])
+        # Compressed logs are read too, unless their original is kept.
+        with open(logPath, 'rb') as logFile:
+            data = logFile.read()
+        copyName = 'log_hash-backfill-copy.html'
+        for name in (logPath + '.gz',
+                     os.path.join(os.path.dirname(logPath), copyName + '.gz')):
+            with gzip.open(name, 'wb') as gzFile:
+                gzFile.write(data)
+        logRoot = conf.supybot.directories.log.dirize('HtmlLogger')
+        dbPath = os.path.join(conf.supybot.directories.data(), 'backfill.db')
+        out = open(os.devnull, 'w')
+        search.backfill(logRoot, dbPath, conf.supybot.log.timestampFormat(),
+                        out)
+        db = search.connect(dbPath)
+        matches = search.search(db, cb.getRelativeLogDir(self.irc, '#backfill'),
+                                ['http'], 5)
+        self.assertEqual(sorted(m[1:] for m in matches),
+                         [('alice', 'see <http://x/?a&b>', copyName),
+                          ('alice', 'see <http://x/?a&b>',
+                           os.path.basename(logPath))])
+        db.close()
+        out.close()
+
+    def testLastlogGreplog(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        for i in range(3):
+            cb.doLog(self.irc, '#reader', False, 'alice', 'line %d' % i)
+        cb.doLog(self.irc, '#reader', False, 'bob', 'the <quick> fox')
+        # Only for the members of the channel.
+        self.assertError('lastlog #reader 1')
+        self.assertError('greplog #reader quick')
+        self.enterChannel('#reader')
+        self.assertRegexp('lastlog #reader 1',
+                          r'^\[[^]]+\] <bob> the <quick> fox '
+                          r'\(log_hash-reader.html\)$')
+        self.assertRegexp('lastlog #reader 3', r'<alice> line 1 ')
+        self.assertRegexp('greplog #reader LINE.2', r'<alice> line 2 ')
+        self.assertRegexp('greplog #reader --days 2 quick', r'<bob> the')
+        self.assertResponse('greplog #reader cat', 'No matches.')
+        self.assertError('greplog #reader (')
+        self.enterChannel('#nothing')
+        self.assertResponse('lastlog #nothing', 'Nothing logged.')
+        if not world.disableMultiprocessing:
+            # A regexp that would take forever is given up.
+            cb.doLog(self.irc, '#reader', False, 'bob', 'a' * 40 + '!')
+            with conf.supybot.plugins.HtmlLogger.readTimeout.context(0.5):
+                self.assertRegexp('greplog #reader (a+)+$', 'Stopped after')
+
+    def testReadKeptOriginal(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        self.enterChannel('#kept')
+        config = conf.supybot.plugins.HtmlLogger
+        with config.rotateLogs.context(True):
+            with config.compressLogs.context(True):
+                with config.compressLogs.keepOriginal.context(3600):
+                    cb.doLog(self.irc, '#kept', False, 'alice', 'the fox')
+                    log = cb.getLog(self.irc, '#kept')
+                    with config.filenameTimestamp.context('%Y'):
+                        cb.checkLogNames()
+                        cb.compressor.sync()
+                        self.assertTrue(os.path.exists(log.name))
+                        self.assertTrue(os.path.exists(log.name + '.gz'))
+                        # The compressed copy is not read a second time.
+                        m = self.getMsg('lastlog #kept 5')
+                        self.assertEqual(m.args[1].count('the fox'), 1)
+                        self.assertNotRegexp('greplog #kept fox',
+                                             'the fox.*the fox')
+
+    def testWriterDaemon(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        package = cb.__module__.rsplit('.', 1)[0]
+        __import__(package + '.daemon')
+        daemon = sys.modules[package + '.daemon']
+        writer = sys.modules[package + '.writer'].LogWriter(1000, 'block',
+                                                            0.1, 65536)
+        maintenance = sys.modules[package + '.maintenance'].Maintenance(1)
+        socketPath = os.path.join(conf.supybot.directories.data(),
+                                  'writer.sock')
+        logRoot = conf.supybot.directories.log()
+        server = daemon.DaemonServer(socketPath, logRoot, writer,
+                                     maintenance)
+        self.assertEqual(server.logs.resolve('/etc/passwd'), None)
+        self.assertEqual(server.logs.resolve(
+                os.path.join(logRoot, '..', 'escaped.html')), None)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        footer = cb.getFooter()
+        try:
+            with conf.supybot.plugins.HtmlLogger.writerDaemon.context(
+                    socketPath):
+                self.assertNotEqual(cb.daemon, None)
+                cb.doLog(self.irc, '#daemon', False, 'alice', 'line 1')
+                logPath = cb.getLog(self.irc, '#daemon').name
+                cb.syncLogs()
+                with open(logPath) as logFile:
+                    contents = logFile.read()
+                self.assertTrue('Daily Log for #daemon' in contents)
+                self.assertTrue(contents.endswith('line 1</span></p>\n'))
+                self.assertTrue(os.path.isfile(
+                    os.path.join(os.path.dirname(logPath), 'index.html')))
+                manifest = server.logs.manifests[
+                        os.path.realpath(os.path.dirname(logPath))]
+                self.assertEqual(manifest.snapshot(),
+                                 [os.path.basename(logPath)])
+                self.assertFalse(manifest.isStale())
+                # The logs it deletes are taken off the search index.
+                logDir = os.path.dirname(logPath)
+                oldName = 'log_hash-daemon-old.html'
+                open(os.path.join(logDir, oldName), 'w').close()
+                manifest.add(oldName)
+                index = cb.getSearchIndex()
+                relativeDir = cb.getRelativeLogDir(self.irc, '#daemon')
+                index.add(relativeDir, oldName, 'carol', 'an old fox')
+                index.sync()
+                self.assertEqual(len(index.search(relativeDir, ['fox'], 5)),
+                                 1)
+                cb.startedLog(self.irc, '#daemon', logDir,
+                              os.path.basename(logPath), 1, None, None)
+                cb.syncLogs()
+                self.assertFalse(os.path.exists(
+                        os.path.join(logDir, oldName)))
+                index.sync()
+                self.assertEqual(index.search(relativeDir, ['fox'], 5), [])
+                # Written directly once the daemon is gone.
+                server.stop()
+                thread.join()
+                cb.doLog(self.irc, '#daemon', False, 'alice', 'line 2')
+                cb.flushDaemon()
+                self.assertEqual(cb.daemon, None)
+                self.assertTrue(hasattr(cb.getLog(self.irc, '#daemon'),
+                                        'fileno'))
+                cb.reset()
+            with open(logPath) as logFile:
+                contents = logFile.read()
+            self.assertEqual(contents.count('line 1</span>'), 1)
+            self.assertTrue(contents.endswith('line 2</span></p>\n' + footer))
+            self.assertEqual(contents.count(footer), 1)
+        finally:
+            if thread.is_alive():
+                server.stop()
+                thread.join()
+            writer.stop()
+            maintenance.stop()
+
+    def testEventStoreRebuild(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        package = cb.__module__.rsplit('.', 1)[0]
+        __import__(package + '.rebuild')
+        rebuild = sys.modules[package + '.rebuild']
+        with conf.supybot.plugins.HtmlLogger.eventStore.context(True):
+            cb.doLog(self.irc, '#events', False, 'alice', 'hi http://x/')
+            cb.doLog(self.irc, '#events', True, None, '*** bob has joined')
+            cb.doLog(self.irc, '#events', False, 'bob', '\x02bold\x02 <&>')
+            logPath = cb.getLog(self.irc, '#events').name
+            cb.reset()
+            cb.flush()
+        eventsDir = conf.supybot.directories.data.dirize('HtmlLogger/events')
+        logRoot = os.path.join(conf.supybot.directories.data(), 'rebuilt')
+        options = rebuild.parseOptions([eventsDir, logRoot, '--no-rotate',
+                '--processes', '1', '--timestamp-format',
+                conf.supybot.log.timestampFormat()])
+        rebuild.rebuild(options, open(os.devnull, 'w'))
+        rebuiltPath = os.path.join(logRoot,
+                                   cb.getRelativeLogDir(self.irc, '#events'),
+                                   os.path.basename(logPath))
+        with open(logPath) as logFile:
+            with open(rebuiltPath) as rebuiltFile:
+                self.assertEqual(rebuiltFile.read(), logFile.read())
+        # Pages left by a run with smaller pages are dropped.
+        options.pageLines = 1
+        rebuild.rebuild(options, open(os.devnull, 'w'))
+        pagePath = rebuiltPath[:-len('.html')] + '.p3.html'
+        self.assertTrue(os.path.exists(pagePath))
+        options.pageLines = 0
+        rebuild.rebuild(options, open(os.devnull, 'w'))
+        self.assertFalse(os.path.exists(pagePath))
+        self.assertFalse(os.path.exists(
+            rebuiltPath[:-len('.html')] + '.p2.html'))
+
+    def testRotation(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        with conf.supybot.plugins.HtmlLogger.rotateLogs.context(True):
+            cb.doLog(self.irc, '#test', False, 'foo', 'bar')
+            log = cb.getLog(self.irc, '#test')
+            self.assertTrue(cb.rotations[(self.irc, '#test')] > time.time())
+            # Pretend the boundary was crossed before the scheduler ran.
+            cb.rotations[(self.irc, '#test')] = time.time() - 1
+            newLog = cb.getLog(self.irc, '#test')
+            self.assertFalse(newLog is log)
+            self.assertTrue(log.closed)
+            # A new filename format is picked up by the next check.
+            with conf.supybot.plugins.HtmlLogger.filenameTimestamp \
+                    .context('%Y'):
+                cb.checkLogNames()
+                self.assertTrue(newLog.closed)
+
+    def testMaxOpenLogs(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        cb.reset()
+        with conf.supybot.plugins.HtmlLogger.maxOpenLogs.context(2):
+            for channel in ('#lru1', '#lru2', '#lru3'):
+                cb.doLog(self.irc, channel, False, 'foo', 'first')
+            self.assertEqual(cb.logEvictions, 1)
+            self.assertEqual(list(cb.logOrder),
+                             [(self.irc, '#lru2'), (self.irc, '#lru3')])
+            logPath = cb.parkedLogs[(self.irc, '#lru1')]
+            cb.doLog(self.irc, '#lru2', False, 'foo', 'second')
+            cb.doLog(self.irc, '#lru1', False, 'foo', 'second')
+            self.assertEqual(cb.logEvictions, 2)
+            self.assertTrue((self.irc, '#lru3') in cb.parkedLogs)
+            self.assertEqual(cb.logMisses, 4)
+            self.assertEqual(cb.logHits, 1)
+            cb.reset()
+        self.assertEqual(cb.parkedLogs, {})
+        with open(logPath) as logFile:
+            contents = logFile.read()
+        self.assertEqual(contents.count('<h2>'), 1)
+        self.assertTrue(contents.endswith('second</span></p>\n' +
+                                          cb.getFooter()))
+        self.assertEqual(contents.count(cb.getFooter()), 1)
+
+    def testMembership(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        members = cb.getMembership(self.irc)
+        self.irc.feedMsg(ircmsgs.join('#members', prefix=self.prefix))
+        self.irc.feedMsg(ircmsgs.IrcMsg(prefix='server', command='353',
+            args=(self.nick, '=', '#members', '@Foo +bar baz!b@h')))
+        self.irc.feedMsg(ircmsgs.IrcMsg(prefix='server', command='366',
+            args=(self.nick, '#members', 'End of /NAMES list.')))
+        self.irc.feedMsg(ircmsgs.join('#other', prefix='foo!f@h'))
+        self.assertEqual(members.channelsOf('FOO'),
+                         set(['#members', '#other']))
+        self.assertEqual(members.channelsOf('baz'), set(['#members']))
+        self.irc.feedMsg(ircmsgs.nick('qux', prefix='foo!f@h'))
+        self.irc.feedMsg(ircmsgs.part('#other', prefix='qux!f@h'))
+        self.irc.feedMsg(ircmsgs.kick('#members', 'bar', prefix='qux!f@h'))
+        self.irc.feedMsg(ircmsgs.quit('bye', prefix='baz!b@h'))
+        self.assertEqual(members.channelsOf('foo'), ())
+        self.assertEqual(members.channelsOf('qux'), set(['#members']))
+        self.assertEqual(members.channelsOf('bar'), ())
+        self.assertEqual(members.channelsOf('baz'), ())
+        cb.flush()
+        with open(cb.getLog(self.irc, '#members').name) as logFile:
+            contents = logFile.read()
+        self.assertTrue('foo is now known as qux' in contents)
+        self.assertTrue('baz &lt;baz!b@h&gt; has quit IRC (bye)' in contents)
+        with open(cb.getLog(self.irc, '#other').name) as logFile:
+            contents = logFile.read()
+        self.assertTrue('foo is now known as qux' in contents)
+        self.assertFalse('has quit' in contents)
+        # Leaving a channel forgets everyone in it.
+        self.irc.feedMsg(ircmsgs.part('#members', prefix=self.prefix))
+        self.assertEqual(members.counts, {})
+        self.assertEqual(members.nicks, {})
+        # A reloaded plugin starts from the irc state.
+        self.irc.feedMsg(ircmsgs.join('#reloaded', prefix=self.prefix))
+        self.irc.feedMsg(ircmsgs.join('#reloaded', prefix='Old!o@h'))
+        cb.members.clear()
+        self.assertEqual(cb.getMembership(self.irc).channelsOf('old'),
+                         set(['#reloaded']))
+
+    def testCoalesceJoinParts(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        config = conf.supybot.plugins.HtmlLogger
+        with config.coalesceJoinParts.context(True):
+            for i in range(5):
+                self.irc.feedMsg(ircmsgs.join('#burst',
+                                              prefix='n%s!u@h' % i))
+            self.assertEqual(cb.bursts[(self.irc, '#burst')].size, 3)
+            cb.endBursts()
+            # A netsplit quit starts a burst at once.
+            self.irc.feedMsg(ircmsgs.quit('irc.a.net irc.b.net',
+                                          prefix='n0!u@h'))
+            self.irc.feedMsg(ircmsgs.quit('irc.a.net irc.b.net',
+                                          prefix='n1!u@h'))
+            self.assertEqual(cb.bursts[(self.irc, '#burst')].size, 2)
+            with config.coalesceJoinParts.maxNicks.context(3):
+                self.irc.feedMsg(ircmsgs.part('#burst', prefix='n2!u@h'))
+            self.assertEqual(cb.bursts, {})
+            cb.flush()
+        with open(cb.getLog(self.irc, '#burst').name) as logFile:
+            rows = logFile.read().split('\n')
+        self.assertTrue('n1 &lt;n1!u@h&gt; has joined' in rows[-4])
+        self.assertTrue('*** 3 joined <label class="style-burst">'
+                        '<input type="checkbox"/>[3 nicks]'
+                        '<span class="style-nicks"> joined: n2 n3 n4</span>'
+                        '</label>' in rows[-3])
+        self.assertTrue('*** Netsplit irc.a.net &lt;-&gt; irc.b.net: 1 left, '
+                        '2 quit' in rows[-2])
+        self.assertTrue('left: n2; quit: n0 n1' in rows[-2])
+
+    def testLogstats(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        stats = sys.modules[cb.__module__.rsplit('.', 1)[0] + '.stats']
+        # Off by default.
+        self.assertEqual(cb.stats, None)
+        self.assertError('logstats')
+        config = conf.supybot.plugins.HtmlLogger.stats
+        with config.context(True):
+            cb.doLog(self.irc, '#stats', False, 'foo', 'bar')
+            self.assertEqual(
+                    cb.stats.channels[(self.irc.network, '#stats')][0], 1)
+            self.assertEqual(cb.stats.histograms['write'].count, 1)
+            self.assertRegexp('logstats #stats',
+                              r'#stats: 1 lines, \d+ bytes;.*write <\d+')
+            with config.prometheusInterval.context(60):
+                cb.writePrometheus()
+        promPath = os.path.join(conf.supybot.directories.log(), 'HtmlLogger',
+                                'htmllogger.prom')
+        with open(promPath) as promFile:
+            prom = promFile.read()
+        self.assertTrue('htmllogger_lines_total{network="%s",'
+                        'channel="#stats"} 1' % self.irc.network in prom)
+        self.assertTrue('htmllogger_write_seconds_count 1' in prom)
+        histogram = stats.Histogram()
+        for seconds in (0.00002, 0.00002, 0.002):
+            histogram.observe(seconds)
+        self.assertEqual(histogram.percentile(0.5), 0.00005)
+        self.assertEqual(histogram.percentile(0.99), 0.005)
+
+    def testCompressLogs(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        plugin = sys.modules[cb.__module__]
+        logDir = cb.getLogDir(self.irc, '#compress')
+        oldLog = os.path.join(logDir, 'log_hash-compress_2024-01-01.html')
+        with open(oldLog, 'w') as logFile:
+            logFile.write('<p>old</p>\n')
+        config = conf.supybot.plugins.HtmlLogger
+        with config.rotateLogs.context(True):
+            with config.compressLogs.context(True):
+                # Starting today's log compresses the older ones.
+                cb.doLog(self.irc, '#compress', False, 'foo', 'today')
+                log = cb.getLog(self.irc, '#compress')
+                cb.syncMaintenance()
+                cb.compressor.sync()
+                self.assertFalse(os.path.exists(oldLog))
+                with gzip.open(oldLog + '.gz') as gzFile:
+                    self.assertEqual(gzFile.read(), b'<p>old</p>\n')
+                # And rotating a log compresses it.
+                with config.filenameTimestamp.context('%Y'):
+                    cb.checkLogNames()
+                    cb.compressor.sync()
+                    self.assertTrue(os.path.exists(log.name + '.gz'))
+                    self.assertFalse(os.path.exists(log.name))
+                    cb.deleteOldLogs(self.irc, '#compress', 1)
+                    cb.generateIndex(self.irc, logDir, '#compress')
+                    cb.syncMaintenance()
+                    self.assertFalse(os.path.exists(oldLog + '.gz'))
+                # A compressed log is decompressed to be appended to.
+                cb.doLog(self.irc, '#compress', False, 'foo', 'again')
+                self.assertEqual(cb.getLog(self.irc, '#compress').name,
+                                 log.name)
+                self.assertFalse(os.path.exists(log.name + '.gz'))
+                cb.endLog(cb.logs[self.irc].pop('#compress'))
+        with open(log.name) as logFile:
+            contents = logFile.read()
+        self.assertEqual(contents.count(cb.getFooter()), 1)
+        self.assertTrue('today' in contents and 'again' in contents)
+        index = plugin.renderIndex('#compress',
+                                   ['log_hash-compress_2024-01-02.html',
+                                    'log_hash-compress_2024-01-02.html.gz'],
+                                   '', '%Y-%m-%d', '', '')
+        self.assertEqual(index.count('<li>'), 1)
+
+    def testPagination(self):
+        cb = self.irc.getCallback('HtmlLogger')
+        plugin = sys.modules[cb.__module__]
+        logDir = cb.getLogDir(self.irc, '#pages')
+        for name in ('log_hash-pages_2024-01-01.html',
+                     'log_hash-pages_2024-01-01.p2.html.gz'):
+            with open(os.path.join(logDir, name), 'w') as logFile:
+                logFile.write('<p>old</p>\n')
+        config = conf.supybot.plugins.HtmlLogger
+        with config.rotateLogs.context(True):
+            with config.pageLines.context(3):
+                for i in range(7):
+                    cb.doLog(self.irc, '#pages', False, 'foo', 'line %s', i)
+                log = cb.getLog(self.irc, '#pages')
+                (name, page) = plugin.splitPage(os.path.basename(log.name))
+                self.assertEqual(page, 3)
+                self.assertEqual(plugin.pageName(name, 3),
+                                 os.path.basename(log.name))
+                # A restart continues on the last page.
+                cb.reset()
+                self.assertEqual(cb.getLog(self.irc, '#pages').name,
+                                 log.name)
+                # The old pages go together.
+                cb.deleteOldLogs(self.irc, '#pages', 1)
+                cb.generateIndex(self.irc, logDir, '#pages')
+                cb.syncMaintenance()
+                self.assertEqual(sorted(os.listdir(logDir)),
+                                 sorted(['index.html',
+                                         name, plugin.pageName(name, 2),
+                                         plugin.pageName(name, 3)]))
+                with config.filenameTimestamp.context('%Y'):
+                    cb.checkLogNames()
+                    self.assertTrue(log.closed)
+        with open(os.path.join(logDir, name)) as logFile:
+            contents = logFile.read()
+        self.assertEqual(contents.count('line'), 3)
+        self.assertTrue(contents.endswith(
+            plugin.pageLink(plugin.pageName(name, 2), 'Next page') +
+            cb.getFooter()))
+        with open(log.name) as logFile:
+            contents = logFile.read()
+        self.assertTrue(plugin.pageLink(plugin.pageName(name, 2),
+                                        'Previous page') in contents)
+        self.assertEqual(contents.count('line'), 1)
+        self.assertEqual(contents.count(cb.getFooter()), 1)
+        with open(os.path.join(logDir, 'index.html')) as indexFile:
+            index = indexFile.read()
+        self.assertEqual(index.count('<li>'), 1)
+        self.assertTrue('<a href="%s">3</a>' % plugin.pageName(name, 3)
+                        in index)
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,279 @@
+###
+# Copyright (c) 2013, Richard Esplin
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+'''
+Background writer for the log files, and the commits of the durability
+setting.
+'''
+
+import os
+import time
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import supybot.log as log
+
+# Upper bound on the number of queued items handled in one batch.
+max_batch = 1000
+
+_WRITE = 0
+_CLOSE = 1
+_SYNC = 2
+_STOP = 3
+_COMMIT = 4
+
+def commitLog(logFile, footer):
+    ''' Writes footer at the end of logFile and flushes it, so the file is a
+        complete HTML document.  Returns the size of the file without the
+        footer, to truncate it to before anything else is written.
+    '''
+    logFile.flush()
+    size = os.fstat(logFile.fileno()).st_size
+    logFile.write(footer)
+    logFile.flush()
+    return size
+
+class LogWriter(object):
+    ''' Writes log lines from a thread of its own.
+
+        The bot thread renders each line and queues it.  The writer thread
+        takes everything waiting in the queue at once, joins the lines of
+        each file into a single write, and flushes a file once it has
+        flushBytes unflushed bytes or its oldest unflushed line is
+        flushInterval seconds old.
+
+        Commits of the durability setting are queued like the lines, so
+        they see every line queued before them.
+    '''
+    def __init__(self, queueSize, whenFull, flushInterval, flushBytes):
+        self.queue = queue.Queue(queueSize)
+        self.drop = (whenFull == 'drop')
+        self.flushInterval = flushInterval
+        self.flushBytes = flushBytes
+        # log -> [unflushed bytes, time of the first unflushed write]
+        self.dirty = {}
+        # Logs written since the last commit
+        self.uncommitted = set()
+        # log -> its size without the footer written by the last commit
+        self.committed = {}
+        self.closing = {}
+        self.closeCallbacks = {}
+        self.closingLock = threading.Lock()
+        self.lines = 0
+        self.batches = 0
+        self.flushes = 0
+        self.commits = 0
+        self.dropped = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self.run,
+                                       name='HtmlLogger writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, logFile, text, flush=False):
+        item = (_WRITE, logFile, text, flush)
+        if not self.drop:
+            self.queue.put(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                log.warning('HtmlLogger writer queue is full, %s lines '
+                            'dropped so far.', self.dropped)
+
+    def close(self, logFile, text, callback=None):
+        ''' Writes text, which is usually the footer, then closes the log.
+            callback is called from the writer thread once the log is closed.
+        '''
+        with self.closingLock:
+            self.closing[logFile.name] = self.closing.get(logFile.name, 0) + 1
+            if callback is not None:
+                self.closeCallbacks[logFile] = callback
+        self.queue.put((_CLOSE, logFile, text, True))
+
+    def isClosing(self, path):
+        with self.closingLock:
+            return path in self.closing
+
+    def commit(self, footer, sync):
+        ''' Has footer written at the end of every log written since the
+            last commit, and the logs flushed, and fsynced if sync is true.
+        '''
+        self.queue.put((_COMMIT, None, (footer, sync), True))
+
+    def sync(self):
+        ''' Waits until everything queued so far is written and flushed. '''
+        done = threading.Event()
+        self.queue.put((_SYNC, None, done, True))
+        done.wait()
+
+    def stop(self):
+        self.queue.put((_STOP, None, None, True))
+        self.thread.join()
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flushInterval)
+            except queue.Empty:
+                self.flushDirty(time.time())
+                continue
+            batch = [item]
+            # Group commit: everything already waiting goes in this batch.
+            while len(batch) < max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not self.process(batch):
+                return
+
+    def process(self, batch):
+        ''' Writes a batch.  Returns False if the writer has to stop. '''
+        self.batches += 1
+        pending = {}
+        order = []
+        flushNow = set()
+        running = True
+        for (kind, logFile, payload, flush) in batch:
+            if kind == _WRITE or kind == _CLOSE:
+                if logFile not in pending:
+                    pending[logFile] = []
+                    order.append(logFile)
+                pending[logFile].append(payload)
+                if flush:
+                    flushNow.add(logFile)
+                if kind == _WRITE:
+                    self.lines += 1
+                else:
+                    self.writePending(logFile, pending)
+                    self.closeLog(logFile)
+                    flushNow.discard(logFile)
+                continue
+            for pendingLog in order:
+                self.writePending(pendingLog, pending)
+            order = []
+            self.flushAll()
+            if kind == _SYNC:
+                payload.set()
+            elif kind == _COMMIT:
+                self.commitAll(*payload)
+            else:
+                running = False
+        for pendingLog in order:
+            self.writePending(pendingLog, pending)
+        for logFile in flushNow:
+            self.flushLog(logFile)
+        self.flushDirty(time.time())
+        return running
+
+    def writePending(self, logFile, pending):
+        lines = pending.pop(logFile, None)
+        if not lines:
+            return
+        text = ''.join(lines)
+        try:
+            if self.committed:
+                size = self.committed.pop(logFile, None)
+                if size is not None:
+                    # Take off the footer of the last commit.
+                    logFile.truncate(size)
+            logFile.write(text)
+        except (IOError, OSError, ValueError):
+            self.errors += 1
+            log.exception('HtmlLogger writer could not write to %s:',
+                          getattr(logFile, 'name', logFile))
+            return
+        self.uncommitted.add(logFile)
+        state = self.dirty.get(logFile)
+        if state is None:
+            self.dirty[logFile] = [len(text), time.time()]
+        else:
+            state[0] += len(text)
+
+    def closeLog(self, logFile):
+        self.dirty.pop(logFile, None)
+        self.uncommitted.discard(logFile)
+        self.committed.pop(logFile, None)
+        try:
+            logFile.close()
+        except (IOError, OSError, ValueError):
+            self.errors += 1
+            log.exception('HtmlLogger writer could not close %s:',
+                          logFile.name)
+        with self.closingLock:
+            count = self.closing.pop(logFile.name, 1) - 1
+            if count:
+                self.closing[logFile.name] = count
+            callback = self.closeCallbacks.pop(logFile, None)
+        if callback is not None:
+            callback()
+
+    def flushLog(self, logFile):
+        self.dirty.pop(logFile, None)
+        try:
+            logFile.flush()
+        except ValueError:
+            # The file was closed under us.
+            pass
+        except (IOError, OSError):
+            self.errors += 1
+            log.exception('HtmlLogger writer could not flush %s:',
+                          getattr(logFile, 'name', logFile))
+        self.flushes += 1
+
+    def commitAll(self, footer, sync):
+        for logFile in self.uncommitted:
+            if not hasattr(logFile, 'name'):
+                continue
+            try:
+                self.committed[logFile] = commitLog(logFile, footer)
+                if sync:
+                    os.fsync(logFile.fileno())
+            except (IOError, OSError, ValueError):
+                self.errors += 1
+                log.exception('HtmlLogger writer could not commit %s:',
+                              getattr(logFile, 'name', logFile))
+        self.uncommitted.clear()
+        self.commits += 1
+
+    def flushAll(self):
+        for logFile in list(self.dirty):
+            self.flushLog(logFile)
+
+    def flushDirty(self, now):
+        for (logFile, (size, since)) in list(self.dirty.items()):
+            if size >= self.flushBytes or now - since >= self.flushInterval:
+                self.flushLog(logFile)
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79: